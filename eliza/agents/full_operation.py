@@ -8,7 +8,7 @@ from jinja2 import Template
 from pydantic import BaseModel, Field
 from xai_sdk import Client, chat
 
-import eliza.memory
+import eliza.memory_context
 import eliza.tools
 from eliza.models import HEAVY_MODEL
 
@@ -98,28 +98,18 @@ class FullOperationAgent:
             chat.system(f"現在の日時（JST）: {now.strftime('%Y-%m-%d %H:%M:%S')}")
         )
 
-    def _inject_memory_summary(self, session: Any, request_id: str) -> None:
-        """memory summary と直近の会話履歴を system メッセージとして差し込む"""
+    def _inject_memory_summary(
+        self, session: Any, request_id: str, messages: list[dict[str, str]]
+    ) -> None:
+        """memory summary と発話に関連する過去の記録を system メッセージとして差し込む"""
         if not self.use_memory:
             return
-        summary = eliza.memory.get()
-        recent_messages = eliza.memory.get_recent_messages(6)
-        if summary or recent_messages:
+        memory_context = eliza.memory_context.get(request_id, messages)
+        if memory_context:
             logger.info(
                 f"[REQUEST ID: {request_id}] Injecting memory summary as system message..."
             )
-            summary_str = (
-                json.dumps(summary, ensure_ascii=False, indent=2) if summary else ""
-            )
-            session.append(
-                chat.system(
-                    self._load_prompt(
-                        "MEMORY_INSTRUCTION.md",
-                        summary_str=summary_str,
-                        recent_messages=recent_messages,
-                    )
-                )
-            )
+            session.append(chat.system(memory_context))
 
     def _inject_sleep_instruction(self, session: Any, request_id: str) -> None:
         """sleep 検出のためのシステムメッセージを差し込む"""
@@ -197,7 +187,7 @@ class FullOperationAgent:
         # プロンプト・会話履歴を順番に差し込む
         logger.info(f"[REQUEST ID: {request_id}] Appending conversation history...")
         self._inject_eliza_prompt(session, request_id)
-        self._inject_memory_summary(session, request_id)
+        self._inject_memory_summary(session, request_id, messages)
 
         for msg in messages:
             if msg["role"] == "system":
@@ -307,6 +297,9 @@ class FullOperationAgent:
                 )
             )
         _, agent_answer = session.parse(AgentAnswer)
+        # バックグラウンドで実行したクリップボード・ブラウザの副作用の結果を tool_history に書き戻す
+        # (最終回答の生成を待つ間にほとんど終わっている)
+        eliza.tools.effects.settle(tool_history)
 
         sleep = detect_sleep and "[SLEEP]" in agent_answer.answer
         return AgentResponse(
@@ -1,4 +1,3 @@
-import json
 import logging
 from datetime import datetime, timedelta, timezone
 from pathlib import Path
@@ -9,7 +8,7 @@ from pydantic import BaseModel, Field
 from xai_sdk import Client, chat
 from xai_sdk.tools import code_execution, web_search, x_search
 
-import eliza.memory
+import eliza.memory_context
 from eliza.models import HEAVY_MODEL
 
 logger = logging.getLogger(__name__)
@@ -133,21 +132,9 @@ class QuestionAgent:
 
         # memory summary 差し込み
         if self.use_memory:
-            summary = eliza.memory.get()
-            recent_messages = eliza.memory.get_recent_messages(6)
-            if summary or recent_messages:
-                summary_str = (
-                    json.dumps(summary, ensure_ascii=False, indent=2) if summary else ""
-                )
-                session.append(
-                    chat.system(
-                        self._load_prompt(
-                            "MEMORY_INSTRUCTION.md",
-                            summary_str=summary_str,
-                            recent_messages=recent_messages,
-                        )
-                    )
-                )
+            memory_context = eliza.memory_context.get(request_id, messages)
+            if memory_context:
+                session.append(chat.system(memory_context))
 
         for msg in messages:
             if msg["role"] == "system":
@@ -1,4 +1,3 @@
-import json
 import logging
 from datetime import datetime, timedelta, timezone
 from pathlib import Path
@@ -8,7 +7,7 @@ from jinja2 import Template
 from pydantic import BaseModel, Field
 from xai_sdk import Client, chat
 
-import eliza.memory
+import eliza.memory_context
 from eliza.models import LIGHT_MODEL
 
 logger = logging.getLogger(__name__)
@@ -110,21 +109,9 @@ class TrivialAgent:
 
         # memory summary 差し込み
         if self.use_memory:
-            summary = eliza.memory.get()
-            recent_messages = eliza.memory.get_recent_messages(6)
-            if summary or recent_messages:
-                summary_str = (
-                    json.dumps(summary, ensure_ascii=False, indent=2) if summary else ""
-                )
-                session.append(
-                    chat.system(
-                        self._load_prompt(
-                            "MEMORY_INSTRUCTION.md",
-                            summary_str=summary_str,
-                            recent_messages=recent_messages,
-                        )
-                    )
-                )
+            memory_context = eliza.memory_context.get(request_id, messages)
+            if memory_context:
+                session.append(chat.system(memory_context))
 
         for msg in messages:
             if msg["role"] == "system":
@@ -0,0 +1,493 @@
+"""Archive module - 古いメッセージを月別の圧縮セグメントに移して hot テーブルを小さく保つ
+
+セグメントはユーザーのメモリディレクトリの archive/YYYY-MM.seg に追記のみで書き込む
+1回の書き込みは独立した lzma フレーム (NDJSON を圧縮したもの) で、
+フレームの位置と各メッセージの所在は archive/index.sqlite に記録する
+"""
+
+import fcntl
+import json
+import logging
+import lzma
+import os
+import re
+import sqlite3
+from collections import defaultdict
+from contextlib import closing
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Iterable, Iterator
+from zoneinfo import ZoneInfo
+
+import eliza.memory
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_DIR_NAME = "archive"
+ARCHIVE_AFTER_DAYS = int(os.environ.get("ELIZA_ARCHIVE_AFTER_DAYS", "90"))
+JST = ZoneInfo("Asia/Tokyo")
+
+# SQLite の変数上限に引っかからないよう IN 句はこの件数ずつに分ける
+_CHUNK = 500
+
+
+def _chunks(items: list, size: int = _CHUNK) -> Iterator[list]:
+    """リストを size 件ずつに分けて返す
+
+    Parameters
+    ----------
+    items
+        分割するリスト
+    size
+        1チャンクの件数
+    """
+    for i in range(0, len(items), size):
+        yield items[i : i + size]
+
+
+def archive_dir(user_id: str | None = None) -> Path:
+    """ユーザーのアーカイブを置くディレクトリを返す
+
+    Parameters
+    ----------
+    user_id
+        ユーザー ID (None なら現在のコンテキストのユーザー)
+    """
+    return eliza.memory.user_dir(user_id) / ARCHIVE_DIR_NAME
+
+
+def _init_index(directory: Path) -> None:
+    """アーカイブのインデックス DB を初期化する
+
+    Parameters
+    ----------
+    directory
+        アーカイブのディレクトリ
+    """
+    directory.mkdir(parents=True, exist_ok=True)
+    with sqlite3.connect(directory / "index.sqlite") as conn:
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS frames (
+                segment         TEXT    NOT NULL,
+                offset          INTEGER NOT NULL,
+                length          INTEGER NOT NULL,
+                count           INTEGER NOT NULL,
+                first_timestamp TEXT    NOT NULL,
+                last_timestamp  TEXT    NOT NULL,
+                first_ts_ms     INTEGER,
+                last_ts_ms      INTEGER,
+                PRIMARY KEY (segment, offset)
+            )
+            """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS archived (
+                message_id TEXT    PRIMARY KEY,
+                timestamp  TEXT    NOT NULL,
+                segment    TEXT    NOT NULL,
+                offset     INTEGER NOT NULL,
+                day        TEXT
+            )
+            """
+        )
+        # 既存のインデックスへの後方互換: 後から足したカラムがなければ追加して埋める
+        for table, column, column_type in (
+            ("frames", "first_ts_ms", "INTEGER"),
+            ("frames", "last_ts_ms", "INTEGER"),
+            ("archived", "day", "TEXT"),
+        ):
+            columns = {r[1] for r in conn.execute(f"PRAGMA table_info({table})")}
+            if column not in columns:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+        missing_frames = conn.execute(
+            "SELECT segment, offset, first_timestamp, last_timestamp FROM frames WHERE first_ts_ms IS NULL"
+        ).fetchall()
+        conn.executemany(
+            "UPDATE frames SET first_ts_ms = ?, last_ts_ms = ? WHERE segment = ? AND offset = ?",
+            [
+                (eliza.memory.to_epoch_ms(first), eliza.memory.to_epoch_ms(last), segment, offset)
+                for segment, offset, first, last in missing_frames
+            ],
+        )
+        missing = conn.execute(
+            "SELECT message_id, timestamp FROM archived WHERE day IS NULL"
+        ).fetchall()
+        conn.executemany(
+            "UPDATE archived SET day = ? WHERE message_id = ?",
+            [(eliza.memory.jst_day(timestamp), message_id) for message_id, timestamp in missing],
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_archived_day ON archived(day)")
+        conn.commit()
+
+
+def _append_frame(directory: Path, segment: str, messages: list[dict]) -> tuple[int, int]:
+    """メッセージを1フレームに圧縮してセグメント末尾に追記する
+
+    Parameters
+    ----------
+    directory
+        アーカイブのディレクトリ
+    segment
+        セグメント名 (YYYY-MM)
+    messages
+        書き込むメッセージ
+
+    Returns
+    -------
+    (フレームの開始位置, フレームのバイト数)
+    """
+    payload = "\n".join(json.dumps(m, ensure_ascii=False) for m in messages)
+    data = lzma.compress(payload.encode("utf-8"))
+    with open(directory / f"{segment}.seg", "ab") as f:
+        offset = f.seek(0, os.SEEK_END)
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    return offset, len(data)
+
+
+def _read_frame(directory: Path, segment: str, offset: int, length: int) -> list[dict]:
+    """セグメントから1フレームを読み出して展開する
+
+    Parameters
+    ----------
+    directory
+        アーカイブのディレクトリ
+    segment
+        セグメント名 (YYYY-MM)
+    offset
+        フレームの開始位置
+    length
+        フレームのバイト数
+    """
+    with open(directory / f"{segment}.seg", "rb") as f:
+        f.seek(offset)
+        data = f.read(length)
+    payload = lzma.decompress(data).decode("utf-8")
+    messages = [json.loads(line) for line in payload.splitlines() if line]
+    # conversation_id を保存する前に書いたフレームには含まれない
+    for m in messages:
+        m.setdefault("conversation_id", None)
+    return messages
+
+
+def archive_messages(
+    older_than_days: int | None = None, user_id: str | None = None
+) -> dict[str, Any]:
+    """一定期間より古いメッセージを hot テーブルからアーカイブへ移す
+
+    セグメントへの追記とインデックスの登録が終わってから hot テーブルから削除する
+    途中で落ちても読み出し側が message_id で重複を除くため欠損しない
+
+    Parameters
+    ----------
+    older_than_days
+        何日より古いメッセージを移すか (省略時は ELIZA_ARCHIVE_AFTER_DAYS)
+    user_id
+        ユーザー ID (None なら現在のコンテキストのユーザー)
+    """
+    days = ARCHIVE_AFTER_DAYS if older_than_days is None else older_than_days
+    cutoff = eliza.memory.to_epoch_ms(
+        (datetime.now(JST) - timedelta(days=days)).isoformat()
+    )
+    user_id = eliza.memory._resolve_user(user_id)
+    directory = archive_dir(user_id)
+    eliza.memory.flush(user_id)
+    _init_index(directory)
+
+    with open(directory / ".lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+
+        with eliza.memory._connect(user_id) as hot:
+            rows = hot.execute(
+                """
+                SELECT m.message_id, m.timestamp, m.role, m.content, r.data, m.session_id,
+                       m.conversation_id, m.day
+                FROM messages m LEFT JOIN reasoning r USING (message_id)
+                WHERE m.ts_ms < ? ORDER BY m.ts_ms ASC
+                """,
+                (cutoff,),
+            ).fetchall()
+        if not rows:
+            return {"archived": 0, "segments": {}}
+
+        with sqlite3.connect(directory / "index.sqlite") as index:
+            already: set[str] = set()
+            for chunk in _chunks([r[0] for r in rows]):
+                already.update(
+                    r[0]
+                    for r in index.execute(
+                        f"SELECT message_id FROM archived WHERE message_id IN ({','.join('?' * len(chunk))})",
+                        chunk,
+                    )
+                )
+
+            by_segment: dict[str, list[dict]] = defaultdict(list)
+            for message_id, timestamp, role, content, reasoning, session_id, conversation_id, day in rows:
+                if message_id in already:
+                    continue
+                by_segment[day[:7]].append(
+                    {
+                        "message_id": message_id,
+                        "timestamp": timestamp,
+                        "role": role,
+                        "content": content,
+                        "reasoning": eliza.memory._unpack_reasoning(reasoning),
+                        "session_id": session_id,
+                        "conversation_id": conversation_id,
+                    }
+                )
+
+            for segment, msgs in sorted(by_segment.items()):
+                offset, length = _append_frame(directory, segment, msgs)
+                index.execute(
+                    """
+                    INSERT INTO frames (segment, offset, length, count, first_timestamp, last_timestamp, first_ts_ms, last_ts_ms)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    (
+                        segment,
+                        offset,
+                        length,
+                        len(msgs),
+                        msgs[0]["timestamp"],
+                        msgs[-1]["timestamp"],
+                        eliza.memory.to_epoch_ms(msgs[0]["timestamp"]),
+                        eliza.memory.to_epoch_ms(msgs[-1]["timestamp"]),
+                    ),
+                )
+                index.executemany(
+                    "INSERT OR IGNORE INTO archived (message_id, timestamp, segment, offset, day) VALUES (?, ?, ?, ?, ?)",
+                    [
+                        (m["message_id"], m["timestamp"], segment, offset, eliza.memory.jst_day(m["timestamp"]))
+                        for m in msgs
+                    ],
+                )
+            index.commit()
+
+        with eliza.memory._connect(user_id) as hot:
+            for chunk in _chunks([r[0] for r in rows]):
+                for table in ("messages", "reasoning"):
+                    hot.execute(
+                        f"DELETE FROM {table} WHERE message_id IN ({','.join('?' * len(chunk))})",
+                        chunk,
+                    )
+            eliza.memory._mark_rewritten(hot)
+
+    eliza.memory._notify_change(user_id)
+    result = {
+        "archived": sum(len(v) for v in by_segment.values()),
+        "removed_from_hot": len(rows),
+        "segments": {k: len(v) for k, v in sorted(by_segment.items())},
+    }
+    logger.info(f"[ARCHIVE] user={user_id} {result}")
+    return result
+
+
+def get_archived_index(
+    user_id: str | None = None, days: list[str] | None = None
+) -> list[tuple[str, str, str]]:
+    """アーカイブ済みメッセージの (message_id, timestamp, day) を返す
+
+    セグメントを展開せずに日別のグループ化に使える
+
+    Parameters
+    ----------
+    user_id
+        ユーザー ID (None なら現在のコンテキストのユーザー)
+    days
+        この日 (YYYY-MM-DD, JST) のメッセージだけを返す (None なら全期間)
+    """
+    directory = archive_dir(user_id)
+    if not (directory / "index.sqlite").exists():
+        return []
+    if days is not None and not days:
+        return []
+    _init_index(directory)
+    with closing(sqlite3.connect(directory / "index.sqlite")) as conn:
+        if days is None:
+            return conn.execute("SELECT message_id, timestamp, day FROM archived").fetchall()
+        rows = []
+        for chunk in _chunks(sorted(set(days))):
+            rows += conn.execute(
+                f"SELECT message_id, timestamp, day FROM archived WHERE day IN ({','.join('?' * len(chunk))})",
+                chunk,
+            ).fetchall()
+        return rows
+
+
+def archived_ids(message_ids: Iterable[str], user_id: str | None = None) -> set[str]:
+    """指定した message_id のうちアーカイブ済みのものを返す
+
+    Parameters
+    ----------
+    message_ids
+        調べる message_id
+    user_id
+        ユーザー ID (None なら現在のコンテキストのユーザー)
+    """
+    wanted = sorted(set(message_ids))
+    index_db = archive_dir(user_id) / "index.sqlite"
+    if not wanted or not index_db.exists():
+        return set()
+    found: set[str] = set()
+    with closing(sqlite3.connect(index_db)) as conn:
+        for chunk in _chunks(wanted):
+            found.update(
+                r[0]
+                for r in conn.execute(
+                    f"SELECT message_id FROM archived WHERE message_id IN ({','.join('?' * len(chunk))})",
+                    chunk,
+                )
+            )
+    return found
+
+
+def load_messages(message_ids: Iterable[str], user_id: str | None = None) -> list[dict]:
+    """指定した message_id のメッセージをアーカイブから読み出す
+
+    必要なフレームだけを展開する
+
+    Parameters
+    ----------
+    message_ids
+        読み出す message_id
+    user_id
+        ユーザー ID (None なら現在のコンテキストのユーザー)
+    """
+    wanted = set(message_ids)
+    directory = archive_dir(user_id)
+    if not wanted or not (directory / "index.sqlite").exists():
+        return []
+    frames: set[tuple[str, int]] = set()
+    with sqlite3.connect(directory / "index.sqlite") as conn:
+        for chunk in _chunks(sorted(wanted)):
+            frames.update(
+                conn.execute(
+                    f"SELECT segment, offset FROM archived WHERE message_id IN ({','.join('?' * len(chunk))})",
+                    chunk,
+                ).fetchall()
+            )
+        lengths = dict(
+            ((segment, offset), length)
+            for segment, offset, length in conn.execute(
+                "SELECT segment, offset, length FROM frames"
+            )
+            if (segment, offset) in frames
+        )
+
+    found: dict[str, dict] = {}
+    for (segment, offset), length in sorted(lengths.items()):
+        for m in _read_frame(directory, segment, offset, length):
+            if m["message_id"] in wanted:
+                found[m["message_id"]] = m
+    return sorted(found.values(), key=lambda m: eliza.memory.to_epoch_ms(m["timestamp"]))
+
+
+def iter_messages(
+    since: str | None = None, until: str | None = None, user_id: str | None = None
+) -> Iterator[dict]:
+    """アーカイブ済みメッセージを古いフレームから順に返す
+
+    一度に展開するのは1フレームだけ
+
+    Parameters
+    ----------
+    since
+        この日 (YYYY-MM-DD, JST) 以降のメッセージだけを返す
+    until
+        この日 (YYYY-MM-DD, JST) 以前のメッセージだけを返す
+    user_id
+        ユーザー ID (None なら現在のコンテキストのユーザー)
+        ジェネレータは呼び出し元と別のコンテキストで進むことがあるので、なるべく明示する
+    """
+    directory = archive_dir(user_id)
+    if not (directory / "index.sqlite").exists():
+        return
+    _init_index(directory)
+    lower = eliza.memory.to_epoch_ms(since) if since else None
+    upper = eliza.memory.to_epoch_ms(eliza.memory._next_day(until)) if until else None
+    with closing(sqlite3.connect(directory / "index.sqlite")) as conn:
+        frames = conn.execute(
+            """
+            SELECT segment, offset, length FROM frames
+            WHERE (? IS NULL OR last_ts_ms >= ?) AND (? IS NULL OR first_ts_ms < ?)
+            ORDER BY first_ts_ms ASC
+            """,
+            (lower, lower, upper, upper),
+        ).fetchall()
+    for segment, offset, length in frames:
+        for m in sorted(
+            _read_frame(directory, segment, offset, length),
+            key=lambda m: (eliza.memory.to_epoch_ms(m["timestamp"]), m["message_id"]),
+        ):
+            day = eliza.memory.jst_day(m["timestamp"])
+            if since and day < since:
+                continue
+            if until and day > until:
+                continue
+            yield m
+
+
+def iter_messages_newest_first(user_id: str | None = None) -> Iterator[dict]:
+    """アーカイブ済みメッセージを新しいフレームから順に返す
+
+    Parameters
+    ----------
+    user_id
+        ユーザー ID (None なら現在のコンテキストのユーザー)
+    """
+    directory = archive_dir(user_id)
+    if not (directory / "index.sqlite").exists():
+        return
+    _init_index(directory)
+    with closing(sqlite3.connect(directory / "index.sqlite")) as conn:
+        frames = conn.execute(
+            "SELECT segment, offset, length FROM frames ORDER BY last_ts_ms DESC"
+        ).fetchall()
+    for segment, offset, length in frames:
+        yield from sorted(
+            _read_frame(directory, segment, offset, length),
+            key=lambda m: eliza.memory.to_epoch_ms(m["timestamp"]),
+            reverse=True,
+        )
+
+
+def grep(
+    compiled: re.Pattern,
+    limit: int,
+    exclude: set[str] | None = None,
+    user_id: str | None = None,
+) -> list[dict]:
+    """アーカイブ済みメッセージの本文を正規表現で検索する
+
+    新しい順に最大 limit 件返す
+
+    Parameters
+    ----------
+    compiled
+        コンパイル済みの正規表現
+    limit
+        返す最大件数
+    exclude
+        除外する message_id (hot テーブルで既に見つかったものなど)
+    user_id
+        ユーザー ID (None なら現在のコンテキストのユーザー)
+    """
+    matched: list[dict] = []
+    seen = set(exclude or ())
+    if limit <= 0:
+        return matched
+    for m in iter_messages_newest_first(user_id):
+        if m["message_id"] in seen:
+            continue
+        seen.add(m["message_id"])
+        if compiled.search(m["content"]):
+            matched.append(
+                {k: m[k] for k in ("message_id", "timestamp", "role", "content")}
+            )
+            if len(matched) >= limit:
+                break
+    return matched
@@ -0,0 +1,416 @@
+"""Job queue - summary 生成などのバックグラウンドジョブを SQLite に永続化して順に実行する
+
+ジョブは .memory/jobs.sqlite に保存するので、どのワーカーで積んでも再起動しても失われない
+実行はリーダーのワーカー (eliza.leader) の run_jobs_loop が1件ずつ priority の高い順に行う
+チャットのリクエストが処理中の間は新しいジョブを始めず、実行中のジョブも進捗の報告ごとに待つ
+"""
+
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Iterator
+
+import eliza.leader
+
+logger = logging.getLogger(__name__)
+
+JOBS_DB = Path(".memory") / "jobs.sqlite"
+# 処理中のチャットリクエストごとに1ファイル置く (ワーカーをまたいで見える)
+CHAT_ACTIVE_DIR = Path(".memory") / "chat_active"
+
+PRIORITY_INTERACTIVE = 10  # API から明示的に積まれたジョブ
+PRIORITY_BACKGROUND = 0  # 定期実行で積まれたジョブ
+
+_POLL_INTERVAL_SECONDS = 1.0
+# 前のリーダーが実行中のまま残したジョブを探す間隔
+_REQUEUE_INTERVAL_SECONDS = 60.0
+# チャットが終わるのを待つ上限 (これを超えたらジョブを進める)
+_CHAT_WAIT_MAX_SECONDS = 120.0
+# クラッシュなどで残ったチャットの印はこの秒数で無視する
+_CHAT_STALE_SECONDS = 600.0
+# 終わったジョブを残しておく秒数
+_RETENTION_SECONDS = 7 * 24 * 60 * 60
+
+# kind -> handler(payload, progress) -> result
+Handler = Callable[[dict[str, Any], Callable[[str, int, int], None]], Any]
+_handlers: dict[str, Handler] = {}
+
+
+class JobCancelled(Exception):
+    """リーダーでなくなったなどの理由でジョブを中断する"""
+
+
+def register(kind: str, handler: Handler) -> None:
+    """ジョブの種類と実行する関数を登録する
+
+    Parameters
+    ----------
+    kind
+        ジョブの種類 (例: summary)
+    handler
+        (payload, progress) を受け取り結果を返す関数
+        progress(stage, done, total) で進捗を報告する
+    """
+    _handlers[kind] = handler
+
+
+def _connect() -> sqlite3.Connection:
+    """ジョブ DB に接続し、テーブルが未作成なら作成する"""
+    JOBS_DB.parent.mkdir(exist_ok=True)
+    conn = sqlite3.connect(JOBS_DB, timeout=5, isolation_level=None)
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS jobs (
+            job_id       TEXT    PRIMARY KEY,
+            kind         TEXT    NOT NULL,
+            payload      TEXT    NOT NULL,
+            priority     INTEGER NOT NULL,
+            status       TEXT    NOT NULL,
+            progress     TEXT,
+            result       TEXT,
+            error        TEXT,
+            worker_id    TEXT,
+            created_at   REAL    NOT NULL,
+            started_at   REAL,
+            heartbeat_at REAL,
+            finished_at  REAL
+        )
+        """
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS jobs_queue ON jobs (status, priority DESC, created_at ASC)"
+    )
+    return conn
+
+
+_JOB_COLUMNS = (
+    "job_id, kind, payload, priority, status, progress, result, error, "
+    "worker_id, created_at, started_at, heartbeat_at, finished_at"
+)
+
+
+def _row_to_job(row: tuple) -> dict[str, Any]:
+    """jobs テーブルの行を dict に変換する
+
+    Parameters
+    ----------
+    row
+        _JOB_COLUMNS の順に並んだ行
+    """
+    job = dict(zip([c.strip() for c in _JOB_COLUMNS.split(",")], row))
+    for key in ("payload", "progress", "result"):
+        if job[key] is not None:
+            job[key] = json.loads(job[key])
+    return job
+
+
+def enqueue(
+    kind: str, payload: dict[str, Any], priority: int = PRIORITY_BACKGROUND
+) -> dict[str, Any]:
+    """ジョブを積んで返す
+
+    同じ kind・payload のジョブが既に待機中なら新しく積まずにそれを返す (priority は高い方にする)
+
+    Parameters
+    ----------
+    kind
+        ジョブの種類
+    payload
+        ハンドラに渡す引数
+    priority
+        大きいほど先に実行する
+    """
+    payload_json = json.dumps(payload, ensure_ascii=False, sort_keys=True)
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute(
+            "SELECT job_id FROM jobs WHERE kind = ? AND payload = ? AND status = 'queued'",
+            (kind, payload_json),
+        ).fetchone()
+        if row is not None:
+            job_id = row[0]
+            conn.execute(
+                "UPDATE jobs SET priority = MAX(priority, ?) WHERE job_id = ?",
+                (priority, job_id),
+            )
+        else:
+            job_id = uuid.uuid4().hex[:16]
+            conn.execute(
+                "INSERT INTO jobs (job_id, kind, payload, priority, status, created_at) VALUES (?, ?, ?, ?, 'queued', ?)",
+                (job_id, kind, payload_json, priority, time.time()),
+            )
+        conn.execute("COMMIT")
+    except BaseException:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+    return get(job_id)
+
+
+def get(job_id: str) -> dict[str, Any] | None:
+    """ジョブの状態を返す (なければ None)
+
+    待機中のジョブには先に実行されるジョブの数 (queue_position) を付ける
+
+    Parameters
+    ----------
+    job_id
+        ジョブ ID
+    """
+    conn = _connect()
+    try:
+        row = conn.execute(
+            f"SELECT {_JOB_COLUMNS} FROM jobs WHERE job_id = ?", (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        job = _row_to_job(row)
+        if job["status"] == "queued":
+            job["queue_position"] = conn.execute(
+                """
+                SELECT COUNT(*) FROM jobs WHERE status = 'queued'
+                  AND (priority > ? OR (priority = ? AND created_at < ?))
+                """,
+                (job["priority"], job["priority"], job["created_at"]),
+            ).fetchone()[0]
+        return job
+    finally:
+        conn.close()
+
+
+def _claim_next() -> dict[str, Any] | None:
+    """次に実行するジョブを running にして返す
+
+    同じ kind のジョブが実行中なら、その kind は飛ばす
+    """
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute(
+            f"""
+            SELECT {_JOB_COLUMNS} FROM jobs
+            WHERE status = 'queued'
+              AND kind NOT IN (SELECT kind FROM jobs WHERE status = 'running')
+            ORDER BY priority DESC, created_at ASC
+            LIMIT 1
+            """
+        ).fetchone()
+        if row is None:
+            conn.execute("COMMIT")
+            return None
+        job = _row_to_job(row)
+        now = time.time()
+        conn.execute(
+            "UPDATE jobs SET status = 'running', worker_id = ?, started_at = ?, heartbeat_at = ? WHERE job_id = ?",
+            (eliza.leader.WORKER_ID, now, now, job["job_id"]),
+        )
+        conn.execute("COMMIT")
+        return job
+    except BaseException:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+
+def _update(job_id: str, **fields: Any) -> None:
+    """ジョブの列を更新する
+
+    Parameters
+    ----------
+    job_id
+        ジョブ ID
+    fields
+        列名 -> 値 (progress / result は JSON にして保存する)
+    """
+    for key in ("progress", "result"):
+        if key in fields and fields[key] is not None:
+            fields[key] = json.dumps(fields[key], ensure_ascii=False)
+    conn = _connect()
+    try:
+        conn.execute(
+            f"UPDATE jobs SET {', '.join(f'{k} = ?' for k in fields)} WHERE job_id = ?",
+            (*fields.values(), job_id),
+        )
+    finally:
+        conn.close()
+
+
+def _finish(job_id: str, **fields: Any) -> bool:
+    """このワーカーが実行中のジョブの列を更新し、更新できたかを返す
+
+    実行中に待機中へ戻された (リーダーが交代した、シャットダウンで止めた) ジョブは書き換えない
+
+    Parameters
+    ----------
+    job_id
+        ジョブ ID
+    fields
+        列名 -> 値 (result は JSON にして保存する)
+    """
+    if fields.get("result") is not None:
+        fields["result"] = json.dumps(fields["result"], ensure_ascii=False)
+    conn = _connect()
+    try:
+        return bool(
+            conn.execute(
+                f"""
+                UPDATE jobs SET {', '.join(f'{k} = ?' for k in fields)}
+                WHERE job_id = ? AND status = 'running' AND worker_id = ?
+                """,
+                (*fields.values(), job_id, eliza.leader.WORKER_ID),
+            ).rowcount
+        )
+    finally:
+        conn.close()
+
+
+def _requeue_abandoned() -> int:
+    """他のワーカーが実行中のまま残したジョブを待機中に戻し、戻した件数を返す
+
+    ジョブを実行するのはリースを持つリーダーだけなので、リーダーである間に呼べば
+    他のワーカーの running は全て前のリーダーが残したもの
+    (再起動でリースを手放した直後や、最後の進捗の報告の直後に交代した場合も含む)
+    """
+    conn = _connect()
+    try:
+        cur = conn.execute(
+            "UPDATE jobs SET status = 'queued', worker_id = NULL WHERE status = 'running' AND worker_id IS NOT ?",
+            (eliza.leader.WORKER_ID,),
+        )
+        conn.execute(
+            "DELETE FROM jobs WHERE status IN ('done', 'error') AND finished_at < ?",
+            (time.time() - _RETENTION_SECONDS,),
+        )
+        return cur.rowcount
+    finally:
+        conn.close()
+
+
+@contextmanager
+def interactive(request_id: str) -> Iterator[None]:
+    """チャットリクエストの処理中であることを他のワーカーのジョブに知らせる
+
+    Parameters
+    ----------
+    request_id
+        リクエスト ID
+    """
+    CHAT_ACTIVE_DIR.mkdir(parents=True, exist_ok=True)
+    marker = CHAT_ACTIVE_DIR / f"{os.getpid()}-{request_id}"
+    marker.touch()
+    try:
+        yield
+    finally:
+        marker.unlink(missing_ok=True)
+
+
+def chat_active() -> bool:
+    """処理中のチャットリクエストがあるかを返す"""
+    if not CHAT_ACTIVE_DIR.exists():
+        return False
+    cutoff = time.time() - _CHAT_STALE_SECONDS
+    for marker in CHAT_ACTIVE_DIR.iterdir():
+        try:
+            if marker.stat().st_mtime >= cutoff:
+                return True
+        except FileNotFoundError:
+            continue
+    return False
+
+
+def wait_for_chat_idle(max_seconds: float = _CHAT_WAIT_MAX_SECONDS) -> float:
+    """処理中のチャットがなくなるまで待ち、待った秒数を返す
+
+    Parameters
+    ----------
+    max_seconds
+        待つ上限の秒数
+    """
+    start = time.monotonic()
+    while chat_active() and time.monotonic() - start < max_seconds:
+        time.sleep(0.2)
+    return time.monotonic() - start
+
+
+def _run(job: dict[str, Any]) -> None:
+    """ジョブを実行して結果を保存する
+
+    Parameters
+    ----------
+    job
+        _claim_next が返したジョブ
+    """
+    job_id = job["job_id"]
+
+    def progress(stage: str, done: int, total: int) -> None:
+        if not eliza.leader.is_leader():
+            raise JobCancelled("this worker is no longer the leader")
+        _update(
+            job_id,
+            progress={"stage": stage, "done": done, "total": total},
+            heartbeat_at=time.time(),
+        )
+        wait_for_chat_idle()
+
+    handler = _handlers.get(job["kind"])
+    logger.info(f"[JOBS] Running {job['kind']} job {job_id} ({job['payload']})")
+    try:
+        if handler is None:
+            raise ValueError(f"Unknown job kind: {job['kind']}")
+        result = handler(job["payload"], progress)
+    except JobCancelled as e:
+        # 待機中に戻して、次のリーダーに最初から実行し直させる
+        logger.warning(f"[JOBS] Job {job_id} interrupted: {e}")
+        _finish(job_id, status="queued", worker_id=None)
+        return
+    except Exception as e:
+        logger.error(f"[JOBS] Job {job_id} failed: {e}")
+        _finish(job_id, status="error", error=str(e), finished_at=time.time())
+        return
+    if _finish(job_id, status="done", result=result, finished_at=time.time()):
+        logger.info(f"[JOBS] Job {job_id} done")
+    else:
+        logger.warning(f"[JOBS] Job {job_id} finished after it was requeued")
+
+
+async def run_jobs_loop():
+    """待機中のジョブを priority の高い順に1件ずつ実行するバックグラウンドループ
+
+    リーダーのワーカーでだけ動かす (eliza.leader.run_while_leader)
+    前のリーダーが実行中のまま残したジョブは、始めたときと _REQUEUE_INTERVAL_SECONDS ごとに待機中に戻す
+    キャンセルされたら (リーダーでなくなった、シャットダウン) 実行中のジョブを待機中に戻す
+    """
+    next_requeue = 0.0
+    while True:
+        if time.monotonic() >= next_requeue:
+            requeued = await asyncio.to_thread(_requeue_abandoned)
+            if requeued:
+                logger.info(f"[JOBS] Requeued {requeued} abandoned jobs")
+            next_requeue = time.monotonic() + _REQUEUE_INTERVAL_SECONDS
+        if await asyncio.to_thread(chat_active):
+            await asyncio.sleep(_POLL_INTERVAL_SECONDS)
+            continue
+        job = await asyncio.to_thread(_claim_next)
+        if job is None:
+            await asyncio.sleep(_POLL_INTERVAL_SECONDS)
+            continue
+        try:
+            await asyncio.to_thread(_run, job)
+        except asyncio.CancelledError:
+            # スレッドの処理は止められないので、終わっても結果は書かれない (_finish)
+            logger.warning(f"[JOBS] Job {job['job_id']} stopped by cancellation, requeueing")
+            await asyncio.shield(
+                asyncio.to_thread(_finish, job["job_id"], status="queued", worker_id=None)
+            )
+            raise
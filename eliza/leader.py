@@ -0,0 +1,238 @@
+"""Leader election - uvicorn の複数ワーカーのうち1つだけがバックグラウンドジョブを動かす
+
+.memory/leader.sqlite のリース行を期限付きで取り合う
+リーダーは期限の 1/3 ごとにリースを延長し、止まったワーカーのリースは期限切れで他のワーカーが引き継ぐ
+"""
+
+import asyncio
+import logging
+import os
+import socket
+import sqlite3
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Awaitable, Callable
+
+logger = logging.getLogger(__name__)
+
+LEADER_DB = Path(".memory") / "leader.sqlite"
+LEASE_NAME = "background"
+LEASE_SECONDS = float(os.environ.get("ELIZA_LEADER_LEASE_SECONDS", "30"))
+RENEW_INTERVAL_SECONDS = LEASE_SECONDS / 3
+
+# このワーカーの識別子 (同じ pid が再利用されても区別できるよう乱数を付ける)
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+_is_leader = False
+
+
+def _connect() -> sqlite3.Connection:
+    """リース DB に接続し、テーブルが未作成なら作成する"""
+    LEADER_DB.parent.mkdir(exist_ok=True)
+    conn = sqlite3.connect(LEADER_DB, timeout=5, isolation_level=None)
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS leases (
+            name        TEXT PRIMARY KEY,
+            holder      TEXT NOT NULL,
+            pid         INTEGER NOT NULL,
+            hostname    TEXT NOT NULL,
+            acquired_at REAL NOT NULL,
+            renewed_at  REAL NOT NULL,
+            expires_at  REAL NOT NULL
+        )
+        """
+    )
+    return conn
+
+
+def try_acquire(name: str = LEASE_NAME) -> bool:
+    """リースを取得または延長し、このワーカーがリーダーかどうかを返す
+
+    リースが空いているか期限切れなら取得し、自分が持っていれば期限を延ばす
+
+    Parameters
+    ----------
+    name
+        リース名
+    """
+    now = time.time()
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute(
+            "SELECT holder, acquired_at, expires_at FROM leases WHERE name = ?", (name,)
+        ).fetchone()
+        if row is not None and row[0] != WORKER_ID and row[2] > now:
+            conn.execute("COMMIT")
+            return False
+        acquired_at = row[1] if row is not None and row[0] == WORKER_ID else now
+        conn.execute(
+            """
+            INSERT OR REPLACE INTO leases (name, holder, pid, hostname, acquired_at, renewed_at, expires_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            (
+                name,
+                WORKER_ID,
+                os.getpid(),
+                socket.gethostname(),
+                acquired_at,
+                now,
+                now + LEASE_SECONDS,
+            ),
+        )
+        conn.execute("COMMIT")
+        return True
+    except BaseException:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+
+def release(name: str = LEASE_NAME) -> None:
+    """自分が持っているリースを手放す
+
+    正常終了時に呼ぶと、他のワーカーが期限切れを待たずに引き継げる
+
+    Parameters
+    ----------
+    name
+        リース名
+    """
+    conn = _connect()
+    try:
+        conn.execute("DELETE FROM leases WHERE name = ? AND holder = ?", (name, WORKER_ID))
+    finally:
+        conn.close()
+
+
+def is_leader() -> bool:
+    """このワーカーが現在バックグラウンドジョブを動かしているかを返す"""
+    return _is_leader
+
+
+def status(name: str = LEASE_NAME) -> dict[str, Any]:
+    """現在のリーダーの情報を返す
+
+    Parameters
+    ----------
+    name
+        リース名
+    """
+    conn = _connect()
+    try:
+        row = conn.execute(
+            "SELECT holder, pid, hostname, acquired_at, renewed_at, expires_at FROM leases WHERE name = ?",
+            (name,),
+        ).fetchone()
+    finally:
+        conn.close()
+    leader = None
+    if row is not None:
+        holder, pid, hostname, acquired_at, renewed_at, expires_at = row
+        leader = {
+            "worker_id": holder,
+            "pid": pid,
+            "hostname": hostname,
+            "acquired_at": acquired_at,
+            "renewed_at": renewed_at,
+            "expires_at": expires_at,
+            "expired": expires_at <= time.time(),
+        }
+    return {
+        "worker_id": WORKER_ID,
+        "pid": os.getpid(),
+        "is_leader": _is_leader,
+        "lease_seconds": LEASE_SECONDS,
+        "leader": leader,
+    }
+
+
+def _restart_finished(
+    tasks: dict[str, asyncio.Task], jobs: dict[str, Callable[[], Awaitable[None]]]
+) -> None:
+    """例外で終わってしまったジョブのタスクを、例外をログに残して起動し直す
+
+    例外なく終わったジョブ (設定がなくて動かす必要がないなど) はそのままにする
+
+    Parameters
+    ----------
+    tasks
+        ジョブ名 -> 動かしているタスク (起動し直したタスクに置き換える)
+    jobs
+        ジョブ名 -> ループ本体のコルーチンを返す関数
+    """
+    for name, task in tasks.items():
+        if not task.done() or task.cancelled() or task.exception() is None:
+            continue
+        error = task.exception()
+        logger.error(
+            f"[LEADER] Background job {name} died, restarting: {type(error).__name__}: {error}",
+            exc_info=error,
+        )
+        tasks[name] = asyncio.create_task(jobs[name](), name=name)
+
+
+async def _cancel(tasks: list[asyncio.Task]) -> None:
+    """タスクをキャンセルして終了を待つ
+
+    Parameters
+    ----------
+    tasks
+        キャンセルするタスク
+    """
+    for task in tasks:
+        task.cancel()
+    for task in tasks:
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.error(f"[LEADER] Background job {task.get_name()} failed: {e}")
+
+
+async def run_while_leader(jobs: dict[str, Callable[[], Awaitable[None]]]) -> None:
+    """リーダーである間だけ jobs を動かし続ける
+
+    RENEW_INTERVAL_SECONDS ごとにリースを延長する
+    延長に失敗したら (他のワーカーに取られた、DB に書けない) すぐにジョブを止める
+    延長のたびに、例外で終わってしまったジョブがあれば起動し直す
+
+    Parameters
+    ----------
+    jobs
+        ジョブ名 -> ループ本体のコルーチンを返す関数
+    """
+    global _is_leader
+    tasks: dict[str, asyncio.Task] = {}
+    try:
+        while True:
+            try:
+                leader = await asyncio.to_thread(try_acquire)
+            except Exception as e:
+                logger.error(f"[LEADER] Failed to renew lease: {e}")
+                leader = False
+            if leader and not tasks:
+                logger.info(f"[LEADER] {WORKER_ID} became leader. Starting {list(jobs)}")
+                tasks = {name: asyncio.create_task(job(), name=name) for name, job in jobs.items()}
+            elif leader:
+                _restart_finished(tasks, jobs)
+            elif tasks:
+                logger.warning(f"[LEADER] {WORKER_ID} lost leadership. Stopping background jobs")
+                await _cancel(list(tasks.values()))
+                tasks = {}
+            _is_leader = leader
+            await asyncio.sleep(RENEW_INTERVAL_SECONDS)
+    finally:
+        await _cancel(list(tasks.values()))
+        if _is_leader:
+            _is_leader = False
+            try:
+                await asyncio.to_thread(release)
+            except Exception as e:
+                logger.error(f"[LEADER] Failed to release lease: {e}")
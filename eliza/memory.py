@@ -1,24 +1,85 @@
 """Memory module - メッセージを SQLite に記録し、要約を生成する"""
 
+import atexit
+import contextvars
+import copy
+import hashlib
 import json
+import logging
 import os
 import re
 import sqlite3
-from collections import defaultdict
-from datetime import datetime
+import threading
+import time
+import zlib
+from collections import OrderedDict, defaultdict
+from contextlib import closing, contextmanager
+from datetime import date, datetime, timedelta
 from pathlib import Path
+from typing import Any, Callable, Iterator
 from zoneinfo import ZoneInfo
 
 from xai_sdk import Client, chat
 
+import eliza.archive
+import eliza.profile
+
+logger = logging.getLogger(__name__)
+
 MEMORY_DIR = Path(".memory")
+# 既定ユーザーのメモリは .memory/ 直下、それ以外のユーザーは .memory/users/<user_id>/ に置く
+USERS_DIR = MEMORY_DIR / "users"
+DEFAULT_USER = "default"
+USER_ID_PATTERN = r"^[A-Za-z0-9_-][A-Za-z0-9_.-]{0,63}$"
 MESSAGES_DB = MEMORY_DIR / "messages.sqlite"
+# summary は messages.sqlite の summaries テーブルに保存する
+# 以下は旧形式 (JSON ファイル) の置き場所で、初回の取り込みにだけ使う
 SUMMARY_DIR = MEMORY_DIR / "summary"
 ALL_SUMMARY_FILE = SUMMARY_DIR / "all.json"
+WEEKLY_DIR = SUMMARY_DIR / "weekly"
+MONTHLY_DIR = SUMMARY_DIR / "monthly"
+CHANGE_STAMP_FILE = MEMORY_DIR / ".changed"
 JST = ZoneInfo("Asia/Tokyo")
+_EPOCH = datetime(1970, 1, 1, tzinfo=ZoneInfo("UTC"))
 
 XAI_API_KEY = os.environ.get("XAI_API_KEY")
 
+# write-behind: この件数が溜まるか、最初の1件からこの秒数が経ったら書き込む
+WRITE_BEHIND_MAX_BATCH = int(os.environ.get("ELIZA_WRITE_BEHIND_MAX_BATCH", "64"))
+WRITE_BEHIND_INTERVAL_SECONDS = float(
+    os.environ.get("ELIZA_WRITE_BEHIND_INTERVAL_SECONDS", "1.0")
+)
+
+# 開いたままにしておくユーザーごとの SQLite 接続の上限 (超えたら使われていない順に閉じる)
+MAX_OPEN_STORES = int(os.environ.get("ELIZA_MEMORY_MAX_OPEN_STORES", "16"))
+
+# reasoning は messages とは別の reasoning テーブルに圧縮して置き、この日数より古いものを
+# ELIZA_REASONING_POLICY (truncate: 先頭だけ残す / drop: 削除する) に従って縮める (0 なら縮めない)
+REASONING_RETENTION_DAYS = int(os.environ.get("ELIZA_REASONING_RETENTION_DAYS", "0"))
+REASONING_POLICY = os.environ.get("ELIZA_REASONING_POLICY", "truncate")
+REASONING_TRUNCATE_CHARS = int(os.environ.get("ELIZA_REASONING_TRUNCATE_CHARS", "500"))
+
+_USER_ID_RE = re.compile(USER_ID_PATTERN)
+_current_user: contextvars.ContextVar[str] = contextvars.ContextVar(
+    "eliza_memory_user", default=DEFAULT_USER
+)
+
+# ユーザーごとのプロセス内での書き込み世代 (change_token に含める)
+# プロセス全体で単調増加するカウンタから取るので、ストアを閉じても巻き戻らない
+_generation = 0
+_generations: dict[str, int] = {}
+
+# 書き込み待ちのメッセージ (user_id -> message_id -> record)
+_pending: dict[str, dict[str, dict]] = {}
+_pending_cond = threading.Condition()
+_flush_locks: dict[str, threading.Lock] = defaultdict(threading.Lock)
+
+# プロセス内で書き込んだ件数と、既に同じ message_id があってスキップした件数
+_write_stats = {"inserted": 0, "duplicates_skipped": 0}
+_write_stats_lock = threading.Lock()
+_flusher: threading.Thread | None = None
+_stopping = False
+
 
 def _call_grok(
     system_prompt: str, user_message: str, model: str = "grok-3-fast"
@@ -42,326 +103,1951 @@ def _call_grok(
     return response.content
 
 
-def _init_db() -> None:
-    """SQLite DB を初期化する
+def check_user_id(user_id: str) -> str:
+    """user_id がディレクトリ名として安全か確認して返す
+
+    Parameters
+    ----------
+    user_id
+        ユーザー ID
+    """
+    if not _USER_ID_RE.match(user_id):
+        raise ValueError(f"Invalid user_id: {user_id!r}")
+    return user_id
+
+
+def current_user() -> str:
+    """現在のコンテキストのユーザー ID を返す"""
+    return _current_user.get()
+
+
+@contextmanager
+def use_user(user_id: str | None) -> Iterator[str]:
+    """ブロック内のメモリ操作を user_id のストアに向ける
+
+    asyncio.to_thread で起動したスレッドにも引き継がれる
+
+    Parameters
+    ----------
+    user_id
+        ユーザー ID (None や空文字なら既定ユーザー)
+    """
+    token = _current_user.set(check_user_id(user_id or DEFAULT_USER))
+    try:
+        yield _current_user.get()
+    finally:
+        _current_user.reset(token)
+
+
+def _resolve_user(user_id: str | None) -> str:
+    """user_id が None なら現在のコンテキストのユーザーを返す
+
+    Parameters
+    ----------
+    user_id
+        ユーザー ID
+    """
+    return current_user() if user_id is None else check_user_id(user_id)
+
+
+def user_dir(user_id: str | None = None) -> Path:
+    """ユーザーのメモリを置くディレクトリを返す
+
+    Parameters
+    ----------
+    user_id
+        ユーザー ID (None なら現在のコンテキストのユーザー)
+    """
+    user_id = _resolve_user(user_id)
+    return MEMORY_DIR if user_id == DEFAULT_USER else USERS_DIR / user_id
+
+
+def list_users() -> list[str]:
+    """メモリを持っているユーザーの一覧を返す
+
+    書き込み待ちのメッセージしかないユーザーも含める
+    """
+    users = [DEFAULT_USER] if MESSAGES_DB.exists() else []
+    if USERS_DIR.exists():
+        users += sorted(
+            p.name
+            for p in USERS_DIR.iterdir()
+            if p.name != DEFAULT_USER
+            and _USER_ID_RE.match(p.name)
+            and (p / "messages.sqlite").exists()
+        )
+    with _pending_cond:
+        users += [u for u, bucket in _pending.items() if bucket and u not in users]
+    return users
+
+
+class _Store:
+    """ユーザーごとの保存先と、開いたままにしておく SQLite 接続"""
+
+    def __init__(self, user_id: str):
+        """ストアを作る (接続は最初に使うときに開く)
+
+        Parameters
+        ----------
+        user_id
+            ユーザー ID
+        """
+        self.user_id = user_id
+        self.dir = user_dir(user_id)
+        self.messages_db = self.dir / "messages.sqlite"
+        self.change_stamp_file = self.dir / ".changed"
+        self.lock = threading.RLock()
+        self.conn: sqlite3.Connection | None = None
+
+    def close(self) -> None:
+        """接続を閉じる"""
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+
+
+_stores: OrderedDict[str, _Store] = OrderedDict()
+_stores_lock = threading.Lock()
+
+
+def _store(user_id: str | None = None) -> _Store:
+    """ユーザーのストアを返す
+
+    最近使ったストアを MAX_OPEN_STORES 個まで保持し、あふれたものは接続を閉じる
+
+    Parameters
+    ----------
+    user_id
+        ユーザー ID (None なら現在のコンテキストのユーザー)
+    """
+    user_id = _resolve_user(user_id)
+    evicted: list[_Store] = []
+    with _stores_lock:
+        store = _stores.get(user_id)
+        if store is None:
+            store = _stores[user_id] = _Store(user_id)
+        _stores.move_to_end(user_id)
+        while len(_stores) > MAX_OPEN_STORES:
+            evicted.append(_stores.popitem(last=False)[1])
+    for old in evicted:
+        old.close()
+    return store
+
+
+@contextmanager
+def _connect(user_id: str | None = None) -> Iterator[sqlite3.Connection]:
+    """ユーザーの messages.sqlite への接続を借りる
+
+    接続はストアに保持して使い回し、同じユーザーへのアクセスだけをロックで直列化する
+    ブロックを正常に抜けたら commit、例外なら rollback する
+
+    Parameters
+    ----------
+    user_id
+        ユーザー ID (None なら現在のコンテキストのユーザー)
+    """
+    store = _store(user_id)
+    with store.lock:
+        if store.conn is None:
+            store.dir.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(store.messages_db, check_same_thread=False)
+            _init_schema(conn)
+            if store.user_id == DEFAULT_USER:
+                _import_summary_files(conn)
+            store.conn = conn
+        try:
+            yield store.conn
+        except BaseException:
+            store.conn.rollback()
+            raise
+        store.conn.commit()
+
+
+def to_epoch_ms(timestamp: str) -> int:
+    """ISO 形式の時刻を UNIX エポックのミリ秒に変換する
 
-    テーブルが未作成なら作成する
+    オフセットのない時刻は JST とみなす
+
+    Parameters
+    ----------
+    timestamp
+        ISO 形式の時刻 (例: 2026-03-04T12:34:56+09:00)
+    """
+    dt = datetime.fromisoformat(timestamp)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=JST)
+    return (dt - _EPOCH) // timedelta(milliseconds=1)
+
+
+def _day_of_ms(ts_ms: int) -> str:
+    """エポックミリ秒の JST での日付 (YYYY-MM-DD) を返す
+
+    Parameters
+    ----------
+    ts_ms
+        UNIX エポックのミリ秒
+    """
+    return (_EPOCH + timedelta(milliseconds=ts_ms)).astimezone(JST).date().isoformat()
+
+
+def jst_day(timestamp: str) -> str:
+    """ISO 形式の時刻の JST での日付 (YYYY-MM-DD) を返す
+
+    Parameters
+    ----------
+    timestamp
+        ISO 形式の時刻
+    """
+    return _day_of_ms(to_epoch_ms(timestamp))
+
+
+def _pack_reasoning(text: str) -> bytes:
+    """reasoning を reasoning テーブルに置く形に圧縮する
+
+    Parameters
+    ----------
+    text
+        reasoning の文字列
+    """
+    return zlib.compress(text.encode("utf-8"))
+
+
+def _unpack_reasoning(data: bytes | None) -> str | None:
+    """reasoning テーブルの値を文字列に戻す
+
+    Parameters
+    ----------
+    data
+        _pack_reasoning で圧縮した値 (なければ None)
+    """
+    return zlib.decompress(data).decode("utf-8") if data is not None else None
+
+
+def _insert_message(conn: sqlite3.Connection, m: dict) -> str | None:
+    """メッセージを1件書き込み、新たに入ったらその日 (JST) を返す
+
+    reasoning は messages ではなく reasoning テーブルに圧縮して書く
+    既に同じ message_id があれば何もせず None を返す
+
+    Parameters
+    ----------
+    conn
+        messages.sqlite への接続
+    m
+        {message_id, timestamp, role, content, reasoning(optional), session_id(optional), conversation_id(optional)}
     """
-    MEMORY_DIR.mkdir(exist_ok=True)
-    with sqlite3.connect(MESSAGES_DB) as conn:
+    ts_ms = to_epoch_ms(m["timestamp"])
+    day = _day_of_ms(ts_ms)
+    cur = conn.execute(
+        "INSERT OR IGNORE INTO messages (message_id, timestamp, role, content, session_id, conversation_id, ts_ms, day) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        (
+            m["message_id"],
+            m["timestamp"],
+            m["role"],
+            m["content"],
+            m.get("session_id"),
+            m.get("conversation_id"),
+            ts_ms,
+            day,
+        ),
+    )
+    if not cur.rowcount:
+        return None
+    if m.get("reasoning"):
         conn.execute(
-            """
-            CREATE TABLE IF NOT EXISTS messages (
-                message_id TEXT PRIMARY KEY,
-                timestamp  TEXT NOT NULL,
-                role       TEXT NOT NULL,
-                content    TEXT NOT NULL,
-                reasoning  TEXT
-            )
-            """
+            "INSERT OR REPLACE INTO reasoning (message_id, ts_ms, data, raw_bytes) VALUES (?, ?, ?, ?)",
+            (
+                m["message_id"],
+                ts_ms,
+                _pack_reasoning(m["reasoning"]),
+                len(m["reasoning"].encode("utf-8")),
+            ),
+        )
+    return day
+
+
+def _init_schema(conn: sqlite3.Connection) -> None:
+    """テーブルが未作成なら作成する
+
+    Parameters
+    ----------
+    conn
+        messages.sqlite への接続
+    """
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS messages (
+            message_id TEXT PRIMARY KEY,
+            timestamp  TEXT NOT NULL,
+            role       TEXT NOT NULL,
+            content    TEXT NOT NULL,
+            reasoning  TEXT
         )
-        # 既存DBへの後方互換: reasoning カラムがなければ追加する
+        """
+    )
+    # 既存DBへの後方互換: reasoning / session_id / conversation_id / ts_ms / day カラムがなければ追加する
+    # (reasoning カラムは使わなくなり、中身は reasoning テーブルに移す)
+    # ts_ms: timestamp を UNIX エポックのミリ秒にしたもの (並べ替え・範囲検索に使う)
+    # day: JST での日付 YYYY-MM-DD (日別の集計に使う)
+    for column, type_ in (
+        ("reasoning", "TEXT"),
+        ("session_id", "TEXT"),
+        ("conversation_id", "TEXT"),
+        ("ts_ms", "INTEGER"),
+        ("day", "TEXT"),
+    ):
         try:
-            conn.execute("ALTER TABLE messages ADD COLUMN reasoning TEXT")
+            conn.execute(f"ALTER TABLE messages ADD COLUMN {column} {type_}")
         except sqlite3.OperationalError:
             pass
-        conn.commit()
+    # timestamp の文字列比較はオフセットが混ざると正しくないので、ts_ms / day の索引に置き換える
+    conn.execute("DROP INDEX IF EXISTS messages_timestamp")
+    conn.execute("CREATE INDEX IF NOT EXISTS messages_ts_ms ON messages (ts_ms, message_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS messages_day ON messages (day)")
+    # assistant の reasoning (zlib 圧縮) を hot な messages とは別に置く
+    # raw_bytes: 圧縮前のバイト数, truncated: 保持ポリシーで切り詰めたか
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS reasoning (
+            message_id TEXT    PRIMARY KEY,
+            ts_ms      INTEGER NOT NULL,
+            data       BLOB    NOT NULL,
+            raw_bytes  INTEGER NOT NULL,
+            truncated  INTEGER NOT NULL DEFAULT 0
+        )
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS reasoning_ts_ms ON reasoning (ts_ms)")
+    # level: day / week / month / all
+    # hash: day はメッセージの fingerprint、それ以外は子ノードの (key, hash) から求めたハッシュ
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS summaries (
+            level            TEXT    NOT NULL,
+            key              TEXT    NOT NULL,
+            hash             TEXT    NOT NULL,
+            num_messages     INTEGER NOT NULL,
+            first_timestamp  TEXT,
+            last_timestamp   TEXT,
+            children         TEXT    NOT NULL DEFAULT '[]',
+            summary          TEXT    NOT NULL,
+            user_profile     TEXT    NOT NULL,
+            created_datetime TEXT    NOT NULL,
+            updated_at       REAL    NOT NULL,
+            PRIMARY KEY (level, key)
+        )
+        """
+    )
+    # 既存DBへの後方互換: profile_evidence カラムがなければ追加する
+    try:
+        conn.execute("ALTER TABLE summaries ADD COLUMN profile_evidence TEXT")
+    except sqlite3.OperationalError:
+        pass
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS summaries_updated_at ON summaries (level, updated_at)"
+    )
+    # summary の再生成が必要な日 (メッセージが書き込まれた日)
+    # marked_at: 最後に書き込まれた時刻, pending: 前回の summary 以降に増えたメッセージ数
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS dirty_days (
+            day       TEXT    PRIMARY KEY,
+            marked_at REAL    NOT NULL,
+            pending   INTEGER NOT NULL DEFAULT 0
+        )
+        """
+    )
+    try:
+        conn.execute("ALTER TABLE dirty_days ADD COLUMN pending INTEGER NOT NULL DEFAULT 0")
+    except sqlite3.OperationalError:
+        pass
+    # rowid の差分で messages を読む側 (検索インデックス) が、行の削除や振り直しを検知するための番号
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS meta (
+            key   TEXT    PRIMARY KEY,
+            value INTEGER NOT NULL
+        )
+        """
+    )
+    _migrate_epoch(conn)
+    moved = _migrate_reasoning(conn)
+    if moved:
+        # VACUUM で rowid が振り直される
+        _mark_rewritten(conn)
+    conn.commit()
+    if moved:
+        # 空いたページを返して messages を小さくする (移行時の1回だけ)
+        before = _db_bytes(conn)
+        conn.execute("VACUUM")
+        logger.info(
+            f"[MEMORY] Moved reasoning of {moved} messages to the reasoning table. "
+            f"messages.sqlite: {before} -> {_db_bytes(conn)} bytes"
+        )
 
 
-def save_messages(messages: list[dict]) -> None:
-    """メッセージリストを SQLite に保存する
+def _db_bytes(conn: sqlite3.Connection) -> int:
+    """データベースのサイズ (バイト) を返す
+
+    Parameters
+    ----------
+    conn
+        messages.sqlite への接続
+    """
+    page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    return page_count * page_size
+
 
-    重複は INSERT OR IGNORE でスキップ
+def _migrate_reasoning(conn: sqlite3.Connection) -> int:
+    """messages.reasoning に残っている reasoning を reasoning テーブルに移し、移した件数を返す
 
     Parameters
     ----------
-    messages
-        {message_id, timestamp, role, content, reasoning(optional)} の dict リスト
-    """
-    _init_db()
-    with sqlite3.connect(MESSAGES_DB) as conn:
-        conn.executemany(
-            "INSERT OR IGNORE INTO messages (message_id, timestamp, role, content, reasoning) VALUES (?, ?, ?, ?, ?)",
-            [
-                (m["message_id"], m["timestamp"], m["role"], m["content"], m.get("reasoning"))
-                for m in messages
-            ],
-        )
-        conn.commit()
+    conn
+        messages.sqlite への接続
+    """
+    rows = conn.execute(
+        "SELECT message_id, ts_ms, reasoning FROM messages WHERE reasoning IS NOT NULL"
+    ).fetchall()
+    if not rows:
+        return 0
+    conn.executemany(
+        "INSERT OR REPLACE INTO reasoning (message_id, ts_ms, data, raw_bytes) VALUES (?, ?, ?, ?)",
+        [
+            (message_id, ts_ms, _pack_reasoning(text), len(text.encode("utf-8")))
+            for message_id, ts_ms, text in rows
+            if text
+        ],
+    )
+    conn.execute("UPDATE messages SET reasoning = NULL WHERE reasoning IS NOT NULL")
+    return len(rows)
 
 
-def get() -> dict | None:
-    """メモリのサマリを返す
+def _migrate_epoch(conn: sqlite3.Connection) -> None:
+    """ts_ms / day が未設定のメッセージ (カラム追加前に保存されたもの) を埋める
 
-    .memory/summary/all.json の中身を dict で返す
-    ファイルが存在しない場合は None を返す
+    timestamp の先頭10文字と JST の日付が違うメッセージ (UTC で送られたものなど) は、
+    日別 summary の所属が変わるので両方の日を dirty にする
+
+    Parameters
+    ----------
+    conn
+        messages.sqlite への接続
     """
-    if not ALL_SUMMARY_FILE.exists():
-        return None
-    try:
-        return json.loads(ALL_SUMMARY_FILE.read_text(encoding="utf-8"))
-    except json.JSONDecodeError:
-        return None
+    rows = conn.execute("SELECT rowid, timestamp FROM messages WHERE ts_ms IS NULL").fetchall()
+    if not rows:
+        return
+    updates = []
+    moved: set[str] = set()
+    for rowid, timestamp in rows:
+        try:
+            ts_ms = to_epoch_ms(timestamp)
+            day = _day_of_ms(ts_ms)
+        except ValueError:
+            ts_ms, day = 0, timestamp[:10]
+        updates.append((ts_ms, day, rowid))
+        if day != timestamp[:10]:
+            moved.update((day, timestamp[:10]))
+    conn.executemany("UPDATE messages SET ts_ms = ?, day = ? WHERE rowid = ?", updates)
+    _mark_days_dirty(conn, dict.fromkeys(moved, 0))
+    logger.info(
+        f"[MEMORY] Filled ts_ms/day for {len(updates)} messages ({len(moved)} days re-grouped)"
+    )
 
 
-def grep(pattern: str, limit: int = 10) -> list[dict]:
-    """メモリの検索
+def _import_summary_files(conn: sqlite3.Connection) -> None:
+    """旧形式の summary JSON ファイルを summaries テーブルに取り込む
 
-    日別 summary の summary テキストを正規表現で検索
-    マッチした結果を新しい順で返す
+    summaries テーブルが空のときだけ実行する
+    元のファイルは消さずに残す
 
     Parameters
     ----------
-    pattern
-        検索する正規表現パターン
-    limit
-        返す最大件数
+    conn
+        messages.sqlite への接続
     """
     if not SUMMARY_DIR.exists():
-        return []
-
-    compiled = re.compile(pattern)
-    matched: list[dict] = []
+        return
+    if conn.execute("SELECT 1 FROM summaries LIMIT 1").fetchone():
+        return
 
-    daily_files = sorted(SUMMARY_DIR.glob("[0-9-]*.json"), reverse=True)
+    sources = [("day", f) for f in sorted(SUMMARY_DIR.glob("[0-9-]*.json"))]
+    sources += [("week", f) for f in sorted(WEEKLY_DIR.glob("*.json"))]
+    sources += [("month", f) for f in sorted(MONTHLY_DIR.glob("*.json"))]
+    if ALL_SUMMARY_FILE.exists():
+        sources.append(("all", ALL_SUMMARY_FILE))
 
-    for daily_file in daily_files:
+    nodes = []
+    for level, path in sources:
         try:
-            data = json.loads(daily_file.read_text(encoding="utf-8"))
+            data = json.loads(path.read_text(encoding="utf-8"))
         except (json.JSONDecodeError, OSError):
             continue
-        summary_text = data.get("summary", "")
-        if compiled.search(summary_text):
-            matched.append(data)
-        if len(matched) >= limit:
-            break
+        if level == "day":
+            # 日別ファイルは message_id の一覧を持っているので fingerprint に変換する
+            data["hash"] = _content_hash(sorted(data.get("messages", [])))
+        nodes.append({**data, "level": level, "key": path.stem})
+    _put_summaries(conn, nodes)
+    conn.commit()
+    if nodes:
+        logger.info(f"[MEMORY] Imported {len(nodes)} summary files into summaries table")
 
-    return matched
 
+def _put_summaries(conn: sqlite3.Connection, nodes: list[dict]) -> None:
+    """summary ノードを summaries テーブルに書き込む
 
-def get_recent_messages(limit: int) -> list[dict]:
-    """直近のメッセージを古い順で返す
+    Parameters
+    ----------
+    conn
+        messages.sqlite への接続
+    nodes
+        level, key, hash, summary, user_profile などを持つ dict のリスト
+    """
+    now = time.time()
+    conn.executemany(
+        """
+        INSERT OR REPLACE INTO summaries (
+            level, key, hash, num_messages, first_timestamp, last_timestamp,
+            children, summary, user_profile, created_datetime, updated_at,
+            profile_evidence
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        [
+            (
+                n["level"],
+                n["key"],
+                n.get("hash", ""),
+                n.get("num_messages", 0),
+                n.get("first_timestamp"),
+                n.get("last_timestamp"),
+                json.dumps(n.get("children", []), ensure_ascii=False),
+                n.get("summary", ""),
+                json.dumps(n.get("user_profile") or _DEFAULT_PROFILE, ensure_ascii=False),
+                n.get("created_datetime")
+                or datetime.now(JST).isoformat(timespec="seconds"),
+                now,
+                json.dumps(n["profile_evidence"], ensure_ascii=False)
+                if n.get("profile_evidence") is not None
+                else None,
+            )
+            for n in nodes
+        ],
+    )
+
+
+_SUMMARY_COLUMNS = (
+    "level, key, hash, num_messages, first_timestamp, last_timestamp, "
+    "children, summary, user_profile, created_datetime, updated_at, profile_evidence"
+)
+
+
+def _row_to_summary(row: tuple) -> dict:
+    """summaries テーブルの行を dict に変換する
 
     Parameters
     ----------
-    limit
-        取得するメッセージ数の上限
+    row
+        _SUMMARY_COLUMNS の順に並んだ行
     """
-    _init_db()
-    with sqlite3.connect(MESSAGES_DB) as conn:
-        rows = conn.execute(
-            "SELECT message_id, timestamp, role, content FROM messages ORDER BY timestamp DESC LIMIT ?",
-            (limit,),
-        ).fetchall()
-    return [
-        {"message_id": r[0], "timestamp": r[1], "role": r[2], "content": r[3]}
-        for r in reversed(rows)
-    ]
+    (
+        level,
+        key,
+        hash_,
+        num_messages,
+        first_timestamp,
+        last_timestamp,
+        children,
+        summary,
+        user_profile,
+        created_datetime,
+        updated_at,
+        profile_evidence,
+    ) = row
+    return {
+        "level": level,
+        "key": key,
+        "hash": hash_,
+        "num_messages": num_messages,
+        "first_timestamp": first_timestamp,
+        "last_timestamp": last_timestamp,
+        "children": json.loads(children),
+        "summary": summary,
+        "user_profile": json.loads(user_profile),
+        "created_datetime": created_datetime,
+        "updated_at": updated_at,
+        "profile_evidence": json.loads(profile_evidence) if profile_evidence else None,
+    }
 
 
-def has_recent_messages(minutes: int = 30) -> bool:
-    """直近 N 分以内に保存されたメッセージがあるか確認する
+def _get_summary(conn: sqlite3.Connection, level: str, key: str) -> dict | None:
+    """summaries テーブルから1ノードを読む
 
     Parameters
     ----------
-    minutes
-        確認する時間範囲 (分)
+    conn
+        messages.sqlite への接続
+    level
+        day / week / month / all
+    key
+        ノードのキー
     """
-    from datetime import timedelta
+    row = conn.execute(
+        f"SELECT {_SUMMARY_COLUMNS} FROM summaries WHERE level = ? AND key = ?",
+        (level, key),
+    ).fetchone()
+    return _row_to_summary(row) if row else None
 
-    _init_db()
-    cutoff = (datetime.now(JST) - timedelta(minutes=minutes)).isoformat()
-    with sqlite3.connect(MESSAGES_DB) as conn:
-        row = conn.execute(
-            "SELECT 1 FROM messages WHERE timestamp >= ? LIMIT 1",
-            (cutoff,),
-        ).fetchone()
-    return row is not None
+
+def _bump_generation(user_id: str) -> None:
+    """ユーザーのプロセス内の書き込み世代を進める
+
+    Parameters
+    ----------
+    user_id
+        ユーザー ID
+    """
+    global _generation
+    _generation += 1
+    _generations[user_id] = _generation
 
 
-def generate_summary(model: str = "grok-4-1-fast") -> dict:
-    """SQLite の全メッセージから日別・全期間の summary を生成して返す
+def _notify_change(user_id: str | None = None) -> None:
+    """メモリが更新されたことを同一プロセスと他ワーカーに通知する
 
-    日付ごとにグループ化して各日の summary を生成しキャッシュする
-    いずれかの日別 summary が更新された場合のみ全期間 summary を再生成する
+    プロセス内の世代番号を進めユーザーの .changed ファイルを置き換える
+    他ワーカーは stat の結果 (inode, mtime) が変わったことで更新を検知する
 
     Parameters
     ----------
-    model
-        summary 生成に使用する Grok モデル名
+    user_id
+        ユーザー ID (None なら現在のコンテキストのユーザー)
     """
-    _init_db()
-    SUMMARY_DIR.mkdir(parents=True, exist_ok=True)
+    store = _store(user_id)
+    _bump_generation(store.user_id)
+    store.dir.mkdir(parents=True, exist_ok=True)
+    stamp = store.change_stamp_file
+    tmp = stamp.with_name(f"{stamp.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    tmp.write_text(str(time.time_ns()), encoding="utf-8")
+    os.replace(tmp, stamp)
 
-    with sqlite3.connect(MESSAGES_DB) as conn:
-        rows = conn.execute(
-            "SELECT message_id, timestamp, role, content, reasoning FROM messages ORDER BY timestamp ASC"
-        ).fetchall()
 
-    if not rows:
-        return {}
+def change_token(user_id: str | None = None) -> tuple[int, int, int]:
+    """ユーザーのメモリの更新検知用トークンを返す
 
-    # 日付でグループ化
-    groups: dict[str, list[dict]] = defaultdict(list)
-    for message_id, timestamp, role, content, reasoning in rows:
-        # timestamp は ISO形式 "2026-03-04T12:34:56+09:00" など
-        date_str = timestamp[:10]  # YYYY-MM-DD
-        groups[date_str].append(
-            {
-                "message_id": message_id,
-                "timestamp": timestamp,
-                "role": role,
-                "content": content,
-                "reasoning": reasoning,
-            }
-        )
+    save_messages / generate_summary で書き込みがあると値が変わる
+    stat 1回で済むため、キャッシュの鮮度確認に使う
 
-    daily_summaries: list[dict] = []
-    any_daily_updated = False
+    Parameters
+    ----------
+    user_id
+        ユーザー ID (None なら現在のコンテキストのユーザー)
+    """
+    user_id = _resolve_user(user_id)
+    generation = _generations.get(user_id, 0)
+    try:
+        st = (user_dir(user_id) / ".changed").stat()
+    except FileNotFoundError:
+        return (generation, 0, 0)
+    return (generation, st.st_ino, st.st_mtime_ns)
 
-    for date_str, msgs in sorted(groups.items()):
-        daily_file = SUMMARY_DIR / f"{date_str}.json"
-        msg_ids = [m["message_id"] for m in msgs]
 
-        # キャッシュ確認
-        if daily_file.exists():
-            try:
-                cached = json.loads(daily_file.read_text(encoding="utf-8"))
-                if cached.get("messages") == msg_ids:
-                    daily_summaries.append(cached)
-                    continue
-            except json.JSONDecodeError:
-                pass
-
-        # 日別要約を生成
-        def _fmt(m: dict) -> str:
-            base = f"[{m['timestamp']}] {m['role']}: {m['content']}"
-            if m.get("reasoning"):
-                base += f"\n  (reasoning: {m['reasoning']})"
-            return base
-
-        messages_text = "\n".join(_fmt(m) for m in msgs)
-        system_prompt = (
-            "以下はある一日の会話ログです。以下のJSON形式で要約してください。"
-            "JSONのみを出力し、余計な説明・コードブロックは不要です。\n"
-            "ログから読み取れる情報のみ埋めてください。不明なフィールドは null または空リストにしてください。\n\n"
-            "出力例:\n"
-            '{"summary": "この日の会話の要約(200文字目安)", '
-            '"user_profile": {'
-            '"name": "田中 太郎", '
-            '"age": 25, '
-            '"gender": "男性", '
-            '"location": {"prefecture": "東京都", "city": "渋谷区", "detail": "道玄坂付近"}, '
-            '"occupation": "エンジニア", '
-            '"interests": ["VRChat", "アニメ", "料理"], '
-            '"tendencies": ["夜型", "最新情報を求める傾向がある"], '
-            '"personal_notes": ["一人暮らし", "猫アレルギー"]}}'
-        )
-        raw = _call_grok(system_prompt, messages_text, model=model)
-        try:
-            parsed = json.loads(raw)
-        except json.JSONDecodeError:
-            parsed = {
-                "summary": raw[:500],
-                "user_profile": {
-                    "name": None,
-                    "age": None,
-                    "gender": None,
-                    "location": {"prefecture": None, "city": None, "detail": None},
-                    "occupation": None,
-                    "interests": [],
-                    "tendencies": [],
-                    "personal_notes": [],
-                },
-            }
+def _write_messages(messages: list[dict], user_id: str | None = None) -> None:
+    """メッセージリストを1トランザクションで SQLite に保存する
 
-        _default_profile = {
-            "name": None,
-            "age": None,
-            "gender": None,
-            "location": {"prefecture": None, "city": None, "detail": None},
-            "occupation": None,
-            "interests": [],
-            "tendencies": [],
-            "personal_notes": [],
-        }
-        now_jst = datetime.now(JST).isoformat(timespec="seconds")
-        daily_data = {
-            "created_datetime": now_jst,
-            "num_messages": len(msgs),
-            "messages": msg_ids,
-            "summary": parsed.get("summary", ""),
-            "user_profile": parsed.get("user_profile", _default_profile),
-        }
-        daily_file.write_text(
-            json.dumps(daily_data, ensure_ascii=False, indent=2), encoding="utf-8"
-        )
-        daily_summaries.append(daily_data)
-        any_daily_updated = True
+    重複は INSERT OR IGNORE でスキップし、新しく入ったメッセージの日を dirty にする (summary のトリガーに使う)
 
-    # daily が1件も更新されていなければ all はスキップ
-    if not any_daily_updated:
-        return get() or {}
+    Parameters
+    ----------
+    messages
+        {message_id, timestamp, role, content, reasoning(optional), session_id(optional), conversation_id(optional)} の dict リスト
+    user_id
+        ユーザー ID (None なら現在のコンテキストのユーザー)
+    """
+    days: dict[str, int] = defaultdict(int)
+    with _connect(user_id) as conn:
+        for m in messages:
+            day = _insert_message(conn, m)
+            if day is not None:
+                days[day] += 1
+        _mark_days_dirty(conn, days)
+    _count_writes(len(messages), sum(days.values()))
 
-    # 全期間 summary を生成
-    all_text = "\n\n".join(
-        f"[{d.get('created_datetime', '')[:10]}] {d.get('summary', '')}\nuser_profile: {json.dumps(d.get('user_profile', {}), ensure_ascii=False)}"
-        for d in daily_summaries
-    )
-    system_prompt_all = (
-        "以下は日別の会話要約です。全体を通じてユーザーの特徴・傾向・関心事・個人情報を把握し、"
-        "以下のJSON形式で出力してください。JSONのみを出力し、余計な説明・コードブロックは不要です。\n"
-        "複数日の情報を統合し、最も確からしい値を採用してください。不明なフィールドは null または空リストにしてください。\n\n"
-        "出力例:\n"
-        '{"summary": "全期間の総合要約(300文字目安)", '
-        '"user_profile": {'
-        '"name": "田中 太郎", '
-        '"age": 25, '
-        '"gender": "男性", '
-        '"location": {"prefecture": "東京都", "city": "渋谷区", "detail": null}, '
-        '"occupation": "エンジニア", '
-        '"interests": ["VRChat", "アニメ", "料理"], '
-        '"tendencies": ["夜型", "最新情報を求める傾向がある"], '
-        '"personal_notes": ["一人暮らし", "猫アレルギー"]}}'
-    )
-    raw_all = _call_grok(system_prompt_all, all_text, model=model)
-    try:
-        parsed_all = json.loads(raw_all)
-    except json.JSONDecodeError:
-        parsed_all = {
-            "summary": raw_all[:500],
-            "user_profile": {
-                "name": None,
-                "age": None,
-                "gender": None,
-                "location": {"prefecture": None, "city": None, "detail": None},
-                "occupation": None,
-                "interests": [],
-                "tendencies": [],
-                "personal_notes": [],
-            },
-        }
 
-    _default_profile_all = {
-        "name": None,
-        "age": None,
-        "gender": None,
-        "location": {"prefecture": None, "city": None, "detail": None},
-        "occupation": None,
-        "interests": [],
-        "tendencies": [],
-        "personal_notes": [],
-    }
-    total_msgs = sum(len(list(v)) for v in groups.values())
-    now_jst = datetime.now(JST).isoformat(timespec="seconds")
-    all_data = {
-        "created_datetime": now_jst,
-        "num_messages": total_msgs,
-        "summary": parsed_all.get("summary", ""),
-        "user_profile": parsed_all.get("user_profile", _default_profile_all),
-    }
-    ALL_SUMMARY_FILE.write_text(
-        json.dumps(all_data, ensure_ascii=False, indent=2), encoding="utf-8"
-    )
+def _count_writes(attempted: int, inserted: int) -> None:
+    """書き込み件数とスキップした重複の件数を数える
+
+    Parameters
+    ----------
+    attempted
+        書き込もうとした件数
+    inserted
+        実際に入った件数
+    """
+    with _write_stats_lock:
+        _write_stats["inserted"] += inserted
+        _write_stats["duplicates_skipped"] += attempted - inserted
+
+
+def write_stats() -> dict[str, int]:
+    """プロセス内の書き込み件数と、重複としてスキップした (保存せずに済んだ) 件数を返す"""
+    with _write_stats_lock:
+        return dict(_write_stats)
+
+
+def conversation_seed(user_id: str | None, conversation_id: str) -> str:
+    """会話の最初のメッセージの親として使う ID を返す
+
+    会話はクライアントが送る (なければサーバーが発行した) 会話 ID で区別するので、
+    同じ日に同じ言葉で始まった別の会話も別の ID になる
+
+    Parameters
+    ----------
+    user_id
+        ユーザー ID (None なら既定ユーザー)
+    conversation_id
+        会話 ID
+    """
+    return _content_hash([user_id or DEFAULT_USER, "conversation", conversation_id])
+
+
+def derive_conversation_id(
+    user_id: str | None, role: str, content: str, started_at: str | None
+) -> str:
+    """conversation_id を送らないクライアントの会話 ID を、会話の最初のメッセージから決める
+
+    履歴を毎回送り直すクライアントでも、最初のメッセージが同じなら同じ会話 ID になる
+    最初のメッセージの時刻は、クライアントが送ったときだけ使う (オフセットの違いは区別しない)
+
+    Parameters
+    ----------
+    user_id
+        ユーザー ID (None なら既定ユーザー)
+    role
+        最初のメッセージの role
+    content
+        最初のメッセージの内容
+    started_at
+        クライアントが送った最初のメッセージの時刻 (ISO 形式, 送られていなければ None)
+    """
+    started_ms = to_epoch_ms(started_at) if started_at is not None else None
+    return _content_hash([user_id or DEFAULT_USER, role, content, started_ms])
+
+
+def _legacy_conversation_seed(user_id: str, session_id: str, day: str) -> str:
+    """会話 ID のない (以前に保存された) メッセージの会話の先頭の親を返す
+
+    以前は会話をユーザー・セッション・会話を始めた日 (JST) で区別していた
+
+    Parameters
+    ----------
+    user_id
+        ユーザー ID
+    session_id
+        セッション ID
+    day
+        会話を始めた日 (JST, YYYY-MM-DD)
+    """
+    return _content_hash([user_id, session_id, day])
+
+
+def chain_message_id(parent_id: str, role: str, content: str) -> str:
+    """直前のメッセージの ID・role・内容から message_id を決める
+
+    同じ会話の同じ位置にある同じ発話は常に同じ ID になるので、
+    履歴を毎回送り直すクライアントでも INSERT OR IGNORE で重複が入らない
+
+    Parameters
+    ----------
+    parent_id
+        直前のメッセージの message_id (最初のメッセージなら conversation_seed)
+    role
+        メッセージの role
+    content
+        メッセージ本文
+    """
+    return _content_hash([parent_id, role, content])
+
+
+def save_messages(messages: list[dict], user_id: str | None = None) -> None:
+    """メッセージリストをユーザーの書き込みキューに積む
+
+    ディスクへの書き込みはバックグラウンドの flusher がまとめて行うため、呼び出し側は待たない
+    キュー中のメッセージも同一プロセスの読み出し (get_recent_messages など) からは見える
+
+    Parameters
+    ----------
+    messages
+        {message_id, timestamp, role, content, reasoning(optional), session_id(optional), conversation_id(optional)} の dict リスト
+    user_id
+        ユーザー ID (None なら現在のコンテキストのユーザー)
+    """
+    if not messages:
+        return
+    user_id = _resolve_user(user_id)
+    with _pending_cond:
+        bucket = _pending.setdefault(user_id, {})
+        for m in messages:
+            bucket.setdefault(m["message_id"], m)
+        _bump_generation(user_id)
+        _ensure_flusher()
+        _pending_cond.notify()
+
+
+def _pending_count() -> int:
+    """全ユーザーの書き込み待ちの件数を返す
+
+    _pending_cond を保持した状態で呼ぶこと
+    """
+    return sum(len(bucket) for bucket in _pending.values())
+
+
+def _ensure_flusher() -> None:
+    """flusher スレッドが動いていなければ起動する
+
+    _pending_cond を保持した状態で呼ぶこと
+    """
+    global _flusher
+    if _flusher is None or not _flusher.is_alive():
+        _flusher = threading.Thread(
+            target=_flush_loop, name="memory-write-behind", daemon=True
+        )
+        _flusher.start()
+
+
+def _flush_loop() -> None:
+    """キューにメッセージが積まれたら、件数か時間の条件を満たした時点で書き込む"""
+    while True:
+        with _pending_cond:
+            _pending_cond.wait_for(lambda: _pending_count() or _stopping)
+            _pending_cond.wait_for(
+                lambda: _pending_count() >= WRITE_BEHIND_MAX_BATCH or _stopping,
+                timeout=WRITE_BEHIND_INTERVAL_SECONDS,
+            )
+            stopping = _stopping
+        try:
+            flush_all()
+        except Exception as e:
+            logger.error(f"[MEMORY] Failed to flush queued messages: {e}")
+        if stopping:
+            return
+
+
+def flush(user_id: str | None = None) -> int:
+    """ユーザーのキュー中のメッセージを1トランザクションで書き込み、書き込んだ件数を返す
+
+    Parameters
+    ----------
+    user_id
+        ユーザー ID (None なら現在のコンテキストのユーザー)
+    """
+    user_id = _resolve_user(user_id)
+    with _pending_cond:
+        flush_lock = _flush_locks[user_id]
+    with flush_lock:
+        with _pending_cond:
+            batch = list(_pending.get(user_id, {}).values())
+        if not batch:
+            return 0
+        _write_messages(batch, user_id)
+        with _pending_cond:
+            bucket = _pending.get(user_id, {})
+            for m in batch:
+                if bucket.get(m["message_id"]) is m:
+                    del bucket[m["message_id"]]
+            if not bucket:
+                _pending.pop(user_id, None)
+        _notify_change(user_id)
+        return len(batch)
+
+
+def flush_all() -> int:
+    """全ユーザーのキュー中のメッセージを書き込み、書き込んだ件数を返す"""
+    with _pending_cond:
+        users = [u for u, bucket in _pending.items() if bucket]
+    return sum(flush(u) for u in users)
+
+
+def shutdown() -> None:
+    """flusher を止め、キューに残っているメッセージをすべて書き込んで接続を閉じる"""
+    global _stopping, _flusher
+    with _pending_cond:
+        _stopping = True
+        _pending_cond.notify_all()
+        flusher = _flusher
+    if flusher is not None:
+        flusher.join()
+    flush_all()
+    with _pending_cond:
+        _stopping = False
+        _flusher = None
+    with _stores_lock:
+        stores = list(_stores.values())
+        _stores.clear()
+    for store in stores:
+        store.close()
+
+
+atexit.register(flush_all)
+
+
+def get_pending_messages(user_id: str | None = None) -> list[dict]:
+    """ユーザーの書き込み待ちのメッセージを timestamp 順で返す
+
+    Parameters
+    ----------
+    user_id
+        ユーザー ID (None なら現在のコンテキストのユーザー)
+    """
+    user_id = _resolve_user(user_id)
+    with _pending_cond:
+        pending = list(_pending.get(user_id, {}).values())
+    return sorted(pending, key=lambda m: to_epoch_ms(m["timestamp"]))
+
+
+def get(user_id: str | None = None) -> dict | None:
+    """メモリのサマリを返す
+
+    ユーザーの全期間 summary を dict で返す
+    まだ生成されていない場合は None を返す
+
+    Parameters
+    ----------
+    user_id
+        ユーザー ID (None なら現在のコンテキストのユーザー)
+    """
+    with _connect(user_id) as conn:
+        node = _get_summary(conn, "all", "all")
+    if node is None:
+        return None
+    return {k: node[k] for k in _PUBLIC_SUMMARY_KEYS}
+
+
+def summary_version(user_id: str | None = None) -> tuple[str, float] | None:
+    """全期間 summary の版 (hash, updated_at) を返す
+
+    get() の結果が変わると値が変わるので、本文を読まずにキャッシュの鮮度確認に使える
+    まだ生成されていない場合は None を返す
+
+    Parameters
+    ----------
+    user_id
+        ユーザー ID (None なら現在のコンテキストのユーザー)
+    """
+    with _connect(user_id) as conn:
+        row = conn.execute(
+            "SELECT hash, updated_at FROM summaries WHERE level = 'all' AND key = 'all'"
+        ).fetchone()
+    return tuple(row) if row else None
+
+
+def get_profile(user_id: str | None = None) -> dict | None:
+    """全期間で統合した user_profile と、スカラー項目の確信度を返す
+
+    確信度は フィールド -> {"count": 採用した値が出てきた日数, "total": そのフィールドに値があった日数}
+    まだ summary が生成されていない場合は None を返す
+
+    Parameters
+    ----------
+    user_id
+        ユーザー ID (None なら現在のコンテキストのユーザー)
+    """
+    with _connect(user_id) as conn:
+        node = _get_summary(conn, "all", "all")
+    if node is None:
+        return None
+    evidence = node["profile_evidence"] or eliza.profile.evidence_from_profile(
+        node["user_profile"], node["created_datetime"][:10]
+    )
+    profile, confidence = eliza.profile.profile_from_evidence(evidence)
+    return {"user_profile": profile, "confidence": confidence}
+
+
+def grep(pattern: str, limit: int = 10, user_id: str | None = None) -> list[dict]:
+    """メモリの検索
+
+    日別 summary の summary テキストを正規表現で検索
+    マッチした結果を新しい順で返す
+
+    Parameters
+    ----------
+    pattern
+        検索する正規表現パターン
+    limit
+        返す最大件数
+    user_id
+        ユーザー ID (None なら現在のコンテキストのユーザー)
+    """
+    compiled = re.compile(pattern)
+    with _connect(user_id) as conn:
+        conn.create_function(
+            "REGEXP", 2, lambda _, s: s is not None and compiled.search(s) is not None
+        )
+        rows = conn.execute(
+            f"SELECT {_SUMMARY_COLUMNS} FROM summaries WHERE level = 'day' AND REGEXP(?, summary) ORDER BY key DESC LIMIT ?",
+            (pattern, limit),
+        ).fetchall()
+    return [
+        {"date": node["key"], **{k: node[k] for k in _PUBLIC_SUMMARY_KEYS}}
+        for node in map(_row_to_summary, rows)
+    ]
+
+
+def grep_messages(
+    pattern: str, limit: int = 10, user_id: str | None = None
+) -> list[dict]:
+    """会話ログ本文の検索
+
+    hot テーブルとアーカイブの両方を正規表現で検索し、新しい順で返す
+
+    Parameters
+    ----------
+    pattern
+        検索する正規表現パターン
+    limit
+        返す最大件数
+    user_id
+        ユーザー ID (None なら現在のコンテキストのユーザー)
+    """
+    compiled = re.compile(pattern)
+    user_id = _resolve_user(user_id)
+    flush(user_id)
+    with _connect(user_id) as conn:
+        conn.create_function(
+            "REGEXP", 2, lambda _, s: s is not None and compiled.search(s) is not None
+        )
+        rows = conn.execute(
+            "SELECT message_id, timestamp, role, content FROM messages WHERE REGEXP(?, content) ORDER BY ts_ms DESC LIMIT ?",
+            (pattern, limit),
+        ).fetchall()
+    matched = [
+        {"message_id": r[0], "timestamp": r[1], "role": r[2], "content": r[3]}
+        for r in rows
+    ]
+    if len(matched) < limit:
+        matched += eliza.archive.grep(
+            compiled,
+            limit - len(matched),
+            exclude={m["message_id"] for m in matched},
+            user_id=user_id,
+        )
+    return matched
+
+
+def get_recent_messages(limit: int, user_id: str | None = None) -> list[dict]:
+    """直近のメッセージを古い順で返す
+
+    書き込み待ちのメッセージも含める
+
+    Parameters
+    ----------
+    limit
+        取得するメッセージ数の上限
+    user_id
+        ユーザー ID (None なら現在のコンテキストのユーザー)
+    """
+    user_id = _resolve_user(user_id)
+    with _connect(user_id) as conn:
+        rows = conn.execute(
+            "SELECT message_id, timestamp, role, content FROM messages ORDER BY ts_ms DESC LIMIT ?",
+            (limit,),
+        ).fetchall()
+    merged = {
+        r[0]: {"message_id": r[0], "timestamp": r[1], "role": r[2], "content": r[3]}
+        for r in rows
+    }
+    for m in get_pending_messages(user_id):
+        merged.setdefault(
+            m["message_id"],
+            {k: m[k] for k in ("message_id", "timestamp", "role", "content")},
+        )
+    recent = sorted(merged.values(), key=lambda m: to_epoch_ms(m["timestamp"]))
+    return recent[-limit:] if limit > 0 else []
+
+
+def _mark_rewritten(conn: sqlite3.Connection) -> None:
+    """messages の行を削除したり rowid を振り直したりしたことを記録する
+
+    記録は呼び出し元のトランザクションの中で行う
+
+    Parameters
+    ----------
+    conn
+        messages.sqlite への接続
+    """
+    conn.execute(
+        "INSERT INTO meta (key, value) VALUES ('rewrites', 1) "
+        "ON CONFLICT (key) DO UPDATE SET value = value + 1"
+    )
+
+
+def message_rewrites(user_id: str | None = None) -> int:
+    """messages の行が削除・振り直しされた回数を返す
+
+    値が変わったら get_messages_since で読んだ rowid は当てにならないので、最初から読み直す
+
+    Parameters
+    ----------
+    user_id
+        ユーザー ID (None なら現在のコンテキストのユーザー)
+    """
+    with _connect(user_id) as conn:
+        row = conn.execute("SELECT value FROM meta WHERE key = 'rewrites'").fetchone()
+    return row[0] if row else 0
+
+
+def get_messages_since(
+    rowid: int, limit: int = 5000, user_id: str | None = None
+) -> list[dict]:
+    """rowid が指定値より大きいメッセージを rowid 順で返す
+
+    インデックスの差分更新に使う
+    message_rewrites が変わっていたら rowid は振り直されているので 0 から読み直すこと
+    書き込み待ちのメッセージは含まない (get_pending_messages を使う)
+
+    Parameters
+    ----------
+    rowid
+        前回までに読んだ最大の rowid
+    limit
+        一度に返す最大件数
+    user_id
+        ユーザー ID (None なら現在のコンテキストのユーザー)
+    """
+    with _connect(user_id) as conn:
+        rows = conn.execute(
+            "SELECT rowid, message_id, timestamp, role, content, day FROM messages WHERE rowid > ? ORDER BY rowid ASC LIMIT ?",
+            (rowid, limit),
+        ).fetchall()
+    return [
+        {
+            "rowid": r[0],
+            "message_id": r[1],
+            "timestamp": r[2],
+            "role": r[3],
+            "content": r[4],
+            "day": r[5],
+        }
+        for r in rows
+    ]
+
+
+def iter_messages(
+    since: str | None = None,
+    until: str | None = None,
+    cursor: tuple[str, str] | None = None,
+    page_size: int = 1000,
+    user_id: str | None = None,
+) -> Iterator[dict]:
+    """hot テーブルのメッセージを時刻 (ts_ms) と message_id の順に返す
+
+    keyset ページングで page_size 件ずつ読むため、件数によらずメモリ使用量は一定
+
+    Parameters
+    ----------
+    since
+        この日 (YYYY-MM-DD, JST) 以降のメッセージだけを返す
+    until
+        この日 (YYYY-MM-DD, JST) 以前のメッセージだけを返す
+    cursor
+        (timestamp, message_id) より後のメッセージだけを返す
+    page_size
+        1回のクエリで読む件数
+    user_id
+        ユーザー ID (None なら現在のコンテキストのユーザー)
+        ジェネレータは呼び出し元と別のコンテキストで進むことがあるので、なるべく明示する
+    """
+    user_id = _resolve_user(user_id)
+    flush(user_id)
+    lower = to_epoch_ms(since) if since else None
+    upper = to_epoch_ms(_next_day(until)) if until else None
+    after = (to_epoch_ms(cursor[0]), cursor[1]) if cursor else (-1, "")
+    if lower is not None and after[0] < lower:
+        after = (lower, "")
+    while True:
+        with _connect(user_id) as conn:
+            rows = conn.execute(
+                """
+                SELECT m.message_id, m.timestamp, m.role, m.content, r.data, m.session_id,
+                       m.conversation_id, m.ts_ms
+                FROM messages m LEFT JOIN reasoning r USING (message_id)
+                WHERE (m.ts_ms, m.message_id) > (?, ?)
+                  AND (? IS NULL OR m.ts_ms < ?)
+                ORDER BY m.ts_ms ASC, m.message_id ASC
+                LIMIT ?
+                """,
+                (after[0], after[1], upper, upper, page_size),
+            ).fetchall()
+        for message_id, timestamp, role, content, reasoning, session_id, conversation_id, _ in rows:
+            yield {
+                "message_id": message_id,
+                "timestamp": timestamp,
+                "role": role,
+                "content": content,
+                "reasoning": _unpack_reasoning(reasoning),
+                "session_id": session_id,
+                "conversation_id": conversation_id,
+            }
+        if len(rows) < page_size:
+            return
+        after = (rows[-1][7], rows[-1][0])
+
+
+def insert_messages(messages: list[dict], user_id: str | None = None) -> dict[str, int]:
+    """メッセージを1トランザクションで直接書き込み、日 (JST) -> 新たに入った件数 を返す
+
+    write-behind キューを通さない一括取り込み用
+    重複は INSERT OR IGNORE でスキップし、新しく入ったメッセージの日を dirty にする
+
+    Parameters
+    ----------
+    messages
+        {message_id, timestamp, role, content, reasoning(optional), session_id(optional), conversation_id(optional)} の dict リスト
+    user_id
+        ユーザー ID (None なら現在のコンテキストのユーザー)
+    """
+    if not messages:
+        return {}
+    user_id = _resolve_user(user_id)
+    days: dict[str, int] = defaultdict(int)
+    inserted = 0
+    with _connect(user_id) as conn:
+        for m in messages:
+            day = _insert_message(conn, m)
+            if day is not None:
+                inserted += 1
+                days[day] += 1
+        _mark_days_dirty(conn, days)
+    _count_writes(len(messages), inserted)
+    if inserted:
+        _notify_change(user_id)
+    return dict(days)
+
+
+def compact_messages(user_id: str | None = None, dry_run: bool = False) -> dict[str, Any]:
+    """履歴の送り直しで重複して保存されたメッセージを削除し、残りを chain_message_id に振り直す
+
+    hot テーブルのメッセージを会話 ID ごと (会話 ID のない以前のメッセージは (セッション, 日) ごと) に時刻順にたどり、
+    会話の先頭からの並びを木として組み立てる
+    現在位置の子か会話の先頭と同じ発話が来たら送り直しとみなして削除し、
+    新しい発話なら木に加えて chain_message_id を付ける
+    アーカイブ済みのメッセージは対象外
+
+    Parameters
+    ----------
+    user_id
+        ユーザー ID (None なら現在のコンテキストのユーザー)
+    dry_run
+        True なら数えるだけで書き換えない
+    """
+    user_id = _resolve_user(user_id)
+    flush(user_id)
+    with _connect(user_id) as conn:
+        rows = conn.execute(
+            "SELECT rowid, message_id, timestamp, role, content, session_id, conversation_id, day FROM messages ORDER BY ts_ms ASC, rowid ASC"
+        ).fetchall()
+
+    # 会話の先頭の親 -> その会話のメッセージ
+    groups: dict[str, list[tuple]] = defaultdict(list)
+    # 会話 ID のない以前のメッセージは、以前と同じくセッションと日 (JST) で会話を分ける
+    legacy: dict[tuple[str, str], str] = {}
+    for row in rows:
+        if row[6] is not None:
+            seed = conversation_seed(user_id, row[6])
+        else:
+            key = (row[5] or "", row[7])
+            seed = legacy.get(key)
+            if seed is None:
+                seed = legacy[key] = _legacy_conversation_seed(user_id, *key)
+        groups[seed].append(row)
+
+    removed: list[int] = []
+    renamed: list[tuple[str, int, str]] = []
+    days: set[str] = set()
+    for seed, group in groups.items():
+        # node: (message_id, children)
+        root: tuple[str, dict] = (seed, {})
+        node = root
+        for rowid, message_id, timestamp, role, content, _, _, day in group:
+            key = (role, content)
+            child = node[1].get(key) or root[1].get(key)
+            if child is not None:
+                removed.append(rowid)
+                days.add(day)
+                node = child
+                continue
+            new_id = chain_message_id(node[0], role, content)
+            child = node[1][key] = (new_id, {})
+            node = child
+            if new_id != message_id:
+                renamed.append((new_id, rowid, message_id))
+                days.add(day)
+
+    result = {
+        "user_id": user_id,
+        "scanned": len(rows),
+        "removed": len(removed),
+        "renamed": len(renamed),
+        "days": sorted(days),
+        "dry_run": dry_run,
+    }
+    if dry_run or not days:
+        return result
+
+    with _connect(user_id) as conn:
+        for i in range(0, len(removed), 500):
+            chunk = removed[i : i + 500]
+            conn.execute(
+                f"DELETE FROM messages WHERE rowid IN ({','.join('?' * len(chunk))})", chunk
+            )
+        for new_id, rowid, old_id in renamed:
+            try:
+                conn.execute(
+                    "UPDATE messages SET message_id = ? WHERE rowid = ?", (new_id, rowid)
+                )
+                conn.execute(
+                    "UPDATE OR REPLACE reasoning SET message_id = ? WHERE message_id = ?",
+                    (new_id, old_id),
+                )
+            except sqlite3.IntegrityError:
+                # 同じ ID のメッセージが既にある (新しい形式で保存済み) ので、こちらは重複
+                conn.execute("DELETE FROM messages WHERE rowid = ?", (rowid,))
+                result["removed"] += 1
+                result["renamed"] -= 1
+        conn.execute(
+            "DELETE FROM reasoning WHERE message_id NOT IN (SELECT message_id FROM messages)"
+        )
+        _mark_days_dirty(conn, dict.fromkeys(days, 0))
+        _mark_rewritten(conn)
+    with _connect(user_id) as conn:
+        conn.execute("VACUUM")
+    _notify_change(user_id)
+    logger.info(f"[MEMORY] Compacted messages: {result}")
+    return result
+
+
+def _mark_days_dirty(conn: sqlite3.Connection, days: dict[str, int]) -> None:
+    """日を summary 再生成対象としてマークする
+
+    Parameters
+    ----------
+    conn
+        messages.sqlite への接続
+    days
+        YYYY-MM-DD -> その日に増えたメッセージ数
+    """
+    now = time.time()
+    conn.executemany(
+        """
+        INSERT INTO dirty_days (day, marked_at, pending) VALUES (?, ?, ?)
+        ON CONFLICT (day) DO UPDATE SET marked_at = excluded.marked_at, pending = pending + excluded.pending
+        """,
+        [(day, now, count) for day, count in days.items()],
+    )
+
+
+def get_dirty_days(user_id: str | None = None) -> list[str]:
+    """summary 再生成待ちの日を古い順で返す
+
+    Parameters
+    ----------
+    user_id
+        ユーザー ID (None なら現在のコンテキストのユーザー)
+    """
+    with _connect(user_id) as conn:
+        return [r[0] for r in conn.execute("SELECT day FROM dirty_days ORDER BY day ASC")]
+
+
+def get_dirty_state(user_id: str | None = None) -> dict[str, Any]:
+    """summary のトリガー判定に使う、前回の summary 以降の書き込み状況を返す
+
+    Parameters
+    ----------
+    user_id
+        ユーザー ID (None なら現在のコンテキストのユーザー)
+
+    Returns
+    -------
+    {"days": dirty な日のリスト, "pending": 増えたメッセージ数, "last_write_at": 最後に書き込まれた UNIX 秒 (なければ None)}
+    """
+    with _connect(user_id) as conn:
+        rows = conn.execute(
+            "SELECT day, marked_at, pending FROM dirty_days ORDER BY day ASC"
+        ).fetchall()
+    return {
+        "days": [r[0] for r in rows],
+        "pending": sum(r[2] for r in rows),
+        "last_write_at": max((r[1] for r in rows), default=None),
+    }
+
+
+def get_daily_summaries(
+    updated_after: float = 0.0, user_id: str | None = None
+) -> list[dict]:
+    """日別 summary を日付の古い順で返す
+
+    各 dict には date (YYYY-MM-DD) と updated_at (更新時刻の UNIX 秒) を付与する
+
+    Parameters
+    ----------
+    updated_after
+        この時刻以降に更新されたものだけを返す
+    user_id
+        ユーザー ID (None なら現在のコンテキストのユーザー)
+    """
+    with _connect(user_id) as conn:
+        rows = conn.execute(
+            f"SELECT {_SUMMARY_COLUMNS} FROM summaries WHERE level = 'day' AND updated_at >= ? ORDER BY key ASC",
+            (updated_after,),
+        ).fetchall()
+    return [
+        {
+            "date": node["key"],
+            "updated_at": node["updated_at"],
+            **{k: node[k] for k in _PUBLIC_SUMMARY_KEYS},
+        }
+        for node in map(_row_to_summary, rows)
+    ]
+
+
+def has_recent_messages(minutes: int = 30, user_id: str | None = None) -> bool:
+    """直近 N 分以内に保存されたメッセージがあるか確認する
+
+    Parameters
+    ----------
+    minutes
+        確認する時間範囲 (分)
+    user_id
+        ユーザー ID (None なら現在のコンテキストのユーザー)
+    """
+    user_id = _resolve_user(user_id)
+    cutoff = int((time.time() - minutes * 60) * 1000)
+    if any(to_epoch_ms(m["timestamp"]) >= cutoff for m in get_pending_messages(user_id)):
+        return True
+    with _connect(user_id) as conn:
+        row = conn.execute(
+            "SELECT 1 FROM messages WHERE ts_ms >= ? LIMIT 1",
+            (cutoff,),
+        ).fetchone()
+    return row is not None
+
+
+def get_reasoning(message_id: str, user_id: str | None = None) -> dict | None:
+    """メッセージの reasoning を返す (デバッグ用)
+
+    書き込み待ち・reasoning テーブル・アーカイブの順に探す
+    メッセージがないか reasoning がなければ None を返す
+
+    Parameters
+    ----------
+    message_id
+        メッセージ ID
+    user_id
+        ユーザー ID (None なら現在のコンテキストのユーザー)
+
+    Returns
+    -------
+    {"message_id", "reasoning", "truncated": 保持ポリシーで切り詰められたか, "source": pending / hot / archive}
+    """
+    user_id = _resolve_user(user_id)
+    for m in get_pending_messages(user_id):
+        if m["message_id"] == message_id and m.get("reasoning"):
+            return {
+                "message_id": message_id,
+                "reasoning": m["reasoning"],
+                "truncated": False,
+                "source": "pending",
+            }
+    with _connect(user_id) as conn:
+        row = conn.execute(
+            "SELECT data, truncated FROM reasoning WHERE message_id = ?", (message_id,)
+        ).fetchone()
+    if row is not None:
+        return {
+            "message_id": message_id,
+            "reasoning": _unpack_reasoning(row[0]),
+            "truncated": bool(row[1]),
+            "source": "hot",
+        }
+    for m in eliza.archive.load_messages([message_id], user_id):
+        if m.get("reasoning"):
+            return {
+                "message_id": message_id,
+                "reasoning": m["reasoning"],
+                "truncated": False,
+                "source": "archive",
+            }
+    return None
+
+
+def prune_reasoning(
+    older_than_days: int | None = None,
+    policy: str | None = None,
+    user_id: str | None = None,
+) -> dict[str, Any]:
+    """古い reasoning を保持ポリシーに従って切り詰めるか削除する
+
+    Parameters
+    ----------
+    older_than_days
+        何日より古い reasoning を対象にするか (省略時は ELIZA_REASONING_RETENTION_DAYS、0 なら何もしない)
+    policy
+        "truncate" (先頭 ELIZA_REASONING_TRUNCATE_CHARS 文字だけ残す) か "drop" (省略時は ELIZA_REASONING_POLICY)
+    user_id
+        ユーザー ID (None なら現在のコンテキストのユーザー)
+    """
+    days = REASONING_RETENTION_DAYS if older_than_days is None else older_than_days
+    policy = policy or REASONING_POLICY
+    if policy not in ("truncate", "drop"):
+        raise ValueError(f"Unknown reasoning policy: {policy}")
+    result = {"policy": policy, "older_than_days": days, "dropped": 0, "truncated": 0}
+    if days <= 0:
+        return result
+    cutoff = int((time.time() - days * 24 * 60 * 60) * 1000)
+    with _connect(user_id) as conn:
+        if policy == "drop":
+            result["dropped"] = conn.execute(
+                "DELETE FROM reasoning WHERE ts_ms < ?", (cutoff,)
+            ).rowcount
+        else:
+            rows = conn.execute(
+                "SELECT message_id, data FROM reasoning WHERE ts_ms < ? AND truncated = 0",
+                (cutoff,),
+            ).fetchall()
+            updates = []
+            for message_id, data in rows:
+                text = _unpack_reasoning(data)
+                if len(text) > REASONING_TRUNCATE_CHARS:
+                    text = text[:REASONING_TRUNCATE_CHARS] + "…"
+                updates.append((_pack_reasoning(text), message_id))
+            conn.executemany(
+                "UPDATE reasoning SET data = ?, truncated = 1 WHERE message_id = ?", updates
+            )
+            result["truncated"] = len(updates)
+    logger.info(f"[MEMORY] Pruned reasoning: {result}")
+    return result
+
+
+def reasoning_stats(user_id: str | None = None) -> dict[str, Any]:
+    """reasoning テーブルの件数と、圧縮・分離で messages から減ったバイト数を返す
+
+    Parameters
+    ----------
+    user_id
+        ユーザー ID (None なら現在のコンテキストのユーザー)
+    """
+    with _connect(user_id) as conn:
+        rows, raw_bytes, stored_bytes, truncated = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(raw_bytes), 0), COALESCE(SUM(LENGTH(data)), 0), COALESCE(SUM(truncated), 0) FROM reasoning"
+        ).fetchone()
+        db_bytes = _db_bytes(conn)
+    return {
+        "rows": rows,
+        "truncated": truncated,
+        # messages に置いていた場合に hot な行が持つはずだったバイト数
+        "raw_bytes": raw_bytes,
+        "stored_bytes": stored_bytes,
+        "db_bytes": db_bytes,
+    }
+
+
+_DEFAULT_PROFILE = eliza.profile.DEFAULT_PROFILE
+
+_PROFILE_EXAMPLE = (
+    '"user_profile": {'
+    '"name": "田中 太郎", '
+    '"age": 25, '
+    '"gender": "男性", '
+    '"location": {"prefecture": "東京都", "city": "渋谷区", "detail": null}, '
+    '"occupation": "エンジニア", '
+    '"interests": ["VRChat", "アニメ", "料理"], '
+    '"tendencies": ["夜型", "最新情報を求める傾向がある"], '
+    '"personal_notes": ["一人暮らし", "猫アレルギー"]}}'
+)
+
+# rollup 階層: 日 -> 週 -> 月 -> 全期間
+# level: (子ノードの単位, このノードの単位, summary の文字数目安)
+_ROLLUP_LEVELS = {
+    "week": ("日別", "ある一週間", 250),
+    "month": ("週別", "ある一か月", 300),
+    "all": ("月別", "全期間", 300),
+}
+
+# get() / grep() で返す summary のフィールド
+_PUBLIC_SUMMARY_KEYS = ("created_datetime", "num_messages", "summary", "user_profile")
+
+
+def _content_hash(obj: Any) -> str:
+    """JSON 化できるオブジェクトから16文字の hex ハッシュを作る
+
+    Parameters
+    ----------
+    obj
+        ハッシュ対象
+    """
+    raw = json.dumps(obj, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode()).hexdigest()[:16]
+
+
+def _week_of(date_str: str) -> tuple[str, str]:
+    """日付が属する週のキーと、その週を入れる月のキーを返す
+
+    週は ISO 年と ISO 週番号で区切るので、年をまたぐ週も1つの週になる
+    月をまたぐ週は木曜日のある月に入れる (ISO 週が木曜日のある年に属するのと同じ決め方)
+    こうすることで 日 -> 週 -> 月 の各ノードの親が1つに決まる
+
+    Parameters
+    ----------
+    date_str
+        YYYY-MM-DD
+
+    Returns
+    -------
+    (週のキー YYYY-Www, 月のキー YYYY-MM)
+    """
+    iso_year, week, _ = date.fromisoformat(date_str).isocalendar()
+    thursday = date.fromisocalendar(iso_year, week, 4)
+    return f"{iso_year}-W{week:02d}", thursday.isoformat()[:7]
+
+
+def _summarize_json(system_prompt: str, text: str, model: str) -> dict:
+    """Grok に JSON 形式の要約を作らせて dict で返す
+
+    JSON として解釈できない場合は生テキストを summary に入れて返す
+
+    Parameters
+    ----------
+    system_prompt
+        システムプロンプト
+    text
+        要約対象のテキスト
+    model
+        使用する Grok モデル名
+    """
+    raw = _call_grok(system_prompt, text, model=model)
+    try:
+        parsed = json.loads(raw)
+    except json.JSONDecodeError:
+        parsed = {"summary": raw[:500]}
+    return {
+        "summary": parsed.get("summary", ""),
+        "user_profile": parsed.get("user_profile") or copy.deepcopy(_DEFAULT_PROFILE),
+    }
+
+
+def _summarize_day(msgs: list[dict], model: str) -> dict:
+    """一日分のメッセージを要約する
+
+    Parameters
+    ----------
+    msgs
+        その日のメッセージ (古い順)
+    model
+        使用する Grok モデル名
+    """
+
+    def _fmt(m: dict) -> str:
+        base = f"[{m['timestamp']}] {m['role']}: {m['content']}"
+        if m.get("reasoning"):
+            base += f"\n  (reasoning: {m['reasoning']})"
+        return base
+
+    messages_text = "\n".join(_fmt(m) for m in msgs)
+    system_prompt = (
+        "以下はある一日の会話ログです。以下のJSON形式で要約してください。"
+        "JSONのみを出力し、余計な説明・コードブロックは不要です。\n"
+        "ログから読み取れる情報のみ埋めてください。不明なフィールドは null または空リストにしてください。\n\n"
+        "出力例:\n"
+        '{"summary": "この日の会話の要約(200文字目安)", '
+        + _PROFILE_EXAMPLE
+    )
+    return _summarize_json(system_prompt, messages_text, model)
+
+
+def _child_evidence(child: dict) -> dict:
+    """子ノードの profile evidence を返す
+
+    evidence を持たない古い日別ノードは、その日の user_profile から作る
+
+    Parameters
+    ----------
+    child
+        子ノード
+    """
+    if child.get("profile_evidence") is not None:
+        return child["profile_evidence"]
+    return eliza.profile.evidence_from_profile(child.get("user_profile"), child["key"][:10])
+
+
+def _rollup(
+    conn: sqlite3.Connection, level: str, key: str, children: list[dict], model: str
+) -> tuple[dict, bool]:
+    """子ノードの summary をまとめて上位ノードの summary を作る
+
+    user_profile は子ノードの evidence から eliza.profile でローカルに統合し、LLM には summary の文章だけを書かせる
+    子ノードの (key, hash) から求めたハッシュがキャッシュと一致すれば LLM を呼ばずに再利用する
+
+    Parameters
+    ----------
+    conn
+        messages.sqlite への接続
+    level
+        "week" / "month" / "all"
+    key
+        ノードのキー (例: 2026-W10, 2026-03, all)
+    children
+        子ノード (key, hash, summary, user_profile, num_messages を持つ dict) のリスト
+    model
+        使用する Grok モデル名
+
+    Returns
+    -------
+    (ノードの dict, 内容が変わったかどうか)
+    """
+    child_unit, unit, length = _ROLLUP_LEVELS[level]
+    node_hash = _content_hash([[c["key"], c["hash"]] for c in children])
+    evidence = eliza.profile.merge_evidence([_child_evidence(c) for c in children])
+    profile, _ = eliza.profile.profile_from_evidence(evidence)
+
+    cached = _get_summary(conn, level, key)
+    if cached is not None and cached["hash"] == node_hash:
+        if cached["profile_evidence"] == evidence:
+            return cached, False
+        # 以前 LLM が統合した user_profile のノードも、ここで evidence からの統合に置き換える
+        changed = cached["user_profile"] != profile
+        cached.update(user_profile=profile, profile_evidence=evidence)
+        _put_summaries(conn, [cached])
+        conn.commit()
+        return cached, changed
+
+    text = "\n\n".join(f"[{c['key']}] {c.get('summary', '')}" for c in children)
+    system_prompt = (
+        f"以下は{unit}の{child_unit}の会話要約です。全体を通じたユーザーの様子・出来事・関心事の移り変わりを、"
+        "以下のJSON形式で出力してください。JSONのみを出力し、余計な説明・コードブロックは不要です。\n\n"
+        "出力例:\n"
+        f'{{"summary": "{unit}の総合要約({length}文字目安)"}}'
+    )
+    node = {
+        "level": level,
+        "key": key,
+        "hash": node_hash,
+        "created_datetime": datetime.now(JST).isoformat(timespec="seconds"),
+        "num_messages": sum(c.get("num_messages", 0) for c in children),
+        "children": [c["key"] for c in children],
+        "summary": _summarize_json(system_prompt, text, model)["summary"],
+        "user_profile": profile,
+        "profile_evidence": evidence,
+    }
+    _put_summaries(conn, [node])
+    conn.commit()
+    return node, True
+
+
+def _next_day(day: str) -> str:
+    """翌日の YYYY-MM-DD を返す
+
+    Parameters
+    ----------
+    day
+        YYYY-MM-DD
+    """
+    return (date.fromisoformat(day) + timedelta(days=1)).isoformat()
+
+
+def _scan_days(
+    conn: sqlite3.Connection, user_id: str, days: list[str] | None
+) -> dict[str, list[dict]]:
+    """日ごとのメッセージの (message_id, timestamp) を集める
+
+    本文は読まない (fingerprint が変わった日だけ _load_day で読む)
+
+    Parameters
+    ----------
+    conn
+        messages.sqlite への接続
+    user_id
+        ユーザー ID
+    days
+        対象の日 (None なら全期間)
+    """
+    if days is None:
+        rows = conn.execute("SELECT message_id, timestamp, day FROM messages").fetchall()
+    else:
+        rows = []
+        for day in days:
+            rows += conn.execute(
+                "SELECT message_id, timestamp, day FROM messages WHERE day = ?", (day,)
+            ).fetchall()
+
+    groups: dict[str, list[dict]] = defaultdict(list)
+    for message_id, timestamp, day in rows:
+        groups[day].append({"message_id": message_id, "timestamp": timestamp})
+
+    # アーカイブ済みのメッセージは (message_id, timestamp) だけを読み、
+    # 日別 summary の再生成が必要になった日だけセグメントから本文を展開する
+    # 差分実行では dirty な日の分だけをインデックスから引く
+    hot_ids = {r[0] for r in rows}
+    for message_id, timestamp, day in eliza.archive.get_archived_index(user_id, days):
+        if message_id in hot_ids:
+            continue
+        groups[day].append(
+            {"message_id": message_id, "timestamp": timestamp, "archived": True}
+        )
+    return groups
+
+
+def _load_day(
+    conn: sqlite3.Connection, user_id: str, day: str, entries: list[dict]
+) -> list[dict]:
+    """_scan_days で集めた1日分のメッセージの本文を読んで古い順に返す
+
+    Parameters
+    ----------
+    conn
+        messages.sqlite への接続
+    user_id
+        ユーザー ID
+    day
+        YYYY-MM-DD
+    entries
+        その日の _scan_days の結果
+    """
+    wanted = {m["message_id"] for m in entries if not m.get("archived")}
+    msgs = [
+        {
+            "message_id": message_id,
+            "timestamp": timestamp,
+            "role": role,
+            "content": content,
+            "reasoning": _unpack_reasoning(reasoning),
+        }
+        for message_id, timestamp, role, content, reasoning in conn.execute(
+            """
+            SELECT m.message_id, m.timestamp, m.role, m.content, r.data
+            FROM messages m LEFT JOIN reasoning r USING (message_id)
+            WHERE m.day = ?
+            """,
+            (day,),
+        )
+        if message_id in wanted
+    ]
+    archived_ids = [m["message_id"] for m in entries if m.get("archived")]
+    if archived_ids:
+        msgs += eliza.archive.load_messages(archived_ids, user_id)
+    return sorted(msgs, key=lambda m: to_epoch_ms(m["timestamp"]))
+
+
+def generate_summary(
+    model: str = "grok-4-1-fast",
+    user_id: str | None = None,
+    progress: Callable[[str, int, int], None] | None = None,
+    only_dirty: bool = False,
+) -> dict:
+    """ユーザーの全メッセージから 日 -> 週 -> 月 -> 全期間 の summary を生成して返す
+
+    各階層のノードは子ノードの summary だけを入力に要約され、内容ハッシュ付きでキャッシュされる
+    当日のログが変わった場合はその日・その週・その月・全期間のノードだけが再生成される
+
+    Parameters
+    ----------
+    model
+        summary 生成に使用する Grok モデル名
+    user_id
+        ユーザー ID (None なら現在のコンテキストのユーザー)
+    progress
+        進捗を (stage, done, total) で受け取る関数。LLM を呼ぶ前に呼ばれる
+    only_dirty
+        True なら dirty_days の日だけメッセージを読み、それ以外の日は保存済みの日別 summary を使う
+        日別 summary がまだ1つもなければ全期間を読む
+    """
+    started_at = time.time()
+    report = progress or (lambda stage, done, total: None)
+    user_id = _resolve_user(user_id)
+    flush(user_id)
+
+    # DB がまだなければ作り、スキーマを最新にしておく
+    with _connect(user_id):
+        pass
+    # LLM 呼び出しの間も他のリクエストがこのユーザーの DB を読めるよう、共有の接続とは別に開く
+    with closing(sqlite3.connect(_store(user_id).messages_db)) as conn:
+        dirty = [r[0] for r in conn.execute("SELECT day FROM dirty_days ORDER BY day ASC")]
+        stored = {
+            node["key"]: node
+            for node in map(
+                _row_to_summary,
+                conn.execute(f"SELECT {_SUMMARY_COLUMNS} FROM summaries WHERE level = 'day'"),
+            )
+        }
+        incremental = only_dirty and bool(stored)
+        if incremental and not dirty:
+            return get(user_id) or {}
+
+        groups = _scan_days(conn, user_id, dirty if incremental else None)
+        if not groups and not incremental:
+            return {}
+
+        daily_nodes: dict[str, dict] = {}
+        if incremental:
+            # dirty でない日は保存済みの日別 summary をそのまま使う
+            daily_nodes = {day: node for day, node in stored.items() if day not in dirty}
+
+        for i, (date_str, entries) in enumerate(sorted(groups.items())):
+            # message_id の一覧の代わりに、ソート済み ID のハッシュを fingerprint として持つ
+            fingerprint = _content_hash(sorted(m["message_id"] for m in entries))
+
+            # キャッシュ確認
+            daily_data = stored.get(date_str)
+
+            # 日別要約を生成
+            if daily_data is None or daily_data["hash"] != fingerprint:
+                report("day", i, len(groups))
+                msgs = _load_day(conn, user_id, date_str, entries)
+                daily_data = {
+                    "level": "day",
+                    "key": date_str,
+                    "hash": fingerprint,
+                    "created_datetime": datetime.now(JST).isoformat(timespec="seconds"),
+                    "num_messages": len(msgs),
+                    "first_timestamp": msgs[0]["timestamp"] if msgs else None,
+                    "last_timestamp": msgs[-1]["timestamp"] if msgs else None,
+                    **_summarize_day(msgs, model),
+                }
+                daily_data["profile_evidence"] = eliza.profile.evidence_from_profile(
+                    daily_data["user_profile"], date_str
+                )
+                _put_summaries(conn, [daily_data])
+                conn.commit()
+
+            daily_nodes[date_str] = daily_data
+
+        weeks: dict[str, list[dict]] = defaultdict(list)
+        week_months: dict[str, str] = {}
+        for date_str, daily_data in sorted(daily_nodes.items()):
+            week_key, month_key = _week_of(date_str)
+            weeks[week_key].append(daily_data)
+            week_months[week_key] = month_key
+
+        months: dict[str, list[dict]] = defaultdict(list)
+        for i, (week_key, days) in enumerate(sorted(weeks.items())):
+            report("week", i, len(weeks))
+            weekly, _ = _rollup(conn, "week", week_key, days, model)
+            months[week_months[week_key]].append(weekly)
+
+        monthly_nodes = []
+        for i, (month_key, month_weeks) in enumerate(sorted(months.items())):
+            report("month", i, len(months))
+            monthly_nodes.append(_rollup(conn, "month", month_key, month_weeks, model)[0])
+
+        all_updated = False
+        if monthly_nodes:
+            report("all", 0, 1)
+            _, all_updated = _rollup(conn, "all", "all", monthly_nodes, model)
+
+        # 今回の実行より前に dirty になった日は処理済み
+        conn.execute("DELETE FROM dirty_days WHERE marked_at <= ?", (started_at,))
+        conn.commit()
 
-    return all_data
+    if all_updated:
+        _notify_change(user_id)
+    return get(user_id) or {}
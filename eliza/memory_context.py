@@ -0,0 +1,183 @@
+"""Memory context cache - エージェントに差し込む memory ブロックの全期間 summary をユーザーごとにプロセス内にキャッシュする"""
+
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from pathlib import Path
+from typing import Any
+
+from jinja2 import Template
+
+import eliza.memory
+import eliza.retrieval
+
+logger = logging.getLogger(__name__)
+
+PROMPT_DIR = Path(__file__).parent / "prompt"
+RECENT_MESSAGES_LIMIT = 6
+
+# _cache と統計の更新だけを守る (読み込みはユーザーごとのロックで行い、他のユーザーを待たせない)
+_lock = threading.Lock()
+_user_locks: dict[str, threading.Lock] = defaultdict(threading.Lock)
+_template: Template | None = None
+# user_id -> (全期間 summary の版, 整形済みの全期間 summary)
+# 保持するユーザー数は eliza.memory.MAX_OPEN_STORES まで
+_cache: OrderedDict[str, tuple[tuple | None, str]] = OrderedDict()
+
+_hits = 0
+_misses = 0
+_build_seconds = 0.0
+_saved_seconds = 0.0
+
+
+def _render(
+    summary_str: str, recent_messages: list[dict], related_passages: list[dict]
+) -> str:
+    """MEMORY_INSTRUCTION.md をレンダリングする
+
+    Parameters
+    ----------
+    summary_str
+        整形済みの全期間 summary
+    recent_messages
+        直近の会話履歴
+    related_passages
+        今回の発話に関連する過去の記録
+    """
+    global _template
+    if not summary_str and not recent_messages and not related_passages:
+        return ""
+    if _template is None:
+        path = PROMPT_DIR / "MEMORY_INSTRUCTION.md"
+        _template = Template(path.read_text(encoding="utf-8"))
+    return _template.render(
+        summary_str=summary_str,
+        recent_messages=recent_messages,
+        related_passages=related_passages,
+    ).strip()
+
+
+def _load_summary(user_id: str) -> str:
+    """全期間 summary を読み込んで整形する
+
+    Parameters
+    ----------
+    user_id
+        ユーザー ID
+    """
+    summary = eliza.memory.get(user_id)
+    return json.dumps(summary, ensure_ascii=False, indent=2) if summary else ""
+
+
+def _summary_str(request_id: str, user_id: str) -> str:
+    """整形済みの全期間 summary を返す
+
+    summary の版 (eliza.memory.summary_version) が前回と同じならキャッシュを使う
+    会話の保存では版は変わらないので、会話のターンごとにキャッシュを捨てることはない
+
+    Parameters
+    ----------
+    request_id
+        ログ追跡用のリクエスト ID
+    user_id
+        ユーザー ID
+    """
+    global _hits, _misses, _build_seconds, _saved_seconds
+    start = time.perf_counter()
+    with _user_locks[user_id]:
+        version = eliza.memory.summary_version(user_id)
+        with _lock:
+            cached = _cache.get(user_id)
+            if cached is not None and cached[0] == version:
+                _cache.move_to_end(user_id)
+                _hits += 1
+                avg_build = _build_seconds / _misses if _misses else 0.0
+                saved = max(avg_build - (time.perf_counter() - start), 0.0)
+                _saved_seconds += saved
+                logger.info(
+                    f"[REQUEST ID: {request_id}] Memory context cache hit for {user_id} "
+                    f"(saved {saved * 1000:.1f} ms, hit rate {_hit_rate():.0%})"
+                )
+                return cached[1]
+
+        summary_str = _load_summary(user_id)
+        elapsed = time.perf_counter() - start
+        with _lock:
+            _cache[user_id] = (version, summary_str)
+            _cache.move_to_end(user_id)
+            while len(_cache) > eliza.memory.MAX_OPEN_STORES:
+                _cache.popitem(last=False)
+            _misses += 1
+            _build_seconds += elapsed
+            logger.info(
+                f"[REQUEST ID: {request_id}] Memory context cache miss for {user_id} "
+                f"(built in {elapsed * 1000:.1f} ms, hit rate {_hit_rate():.0%})"
+            )
+        return summary_str
+
+
+def _related(messages: list[dict[str, str]] | None) -> list[dict]:
+    """会話の最後のユーザー発話に関連する過去の記録を検索する
+
+    リクエストに含まれている会話そのものは除外する
+
+    Parameters
+    ----------
+    messages
+        リクエストの会話履歴
+    """
+    if not messages:
+        return []
+    query = next((m["content"] for m in reversed(messages) if m["role"] == "user"), "")
+    return eliza.retrieval.search(query, exclude={m["content"] for m in messages})
+
+
+def get(request_id: str = "", messages: list[dict[str, str]] | None = None) -> str:
+    """現在のコンテキストのユーザーの memory ブロックを返す
+
+    memory ブロックは全期間 summary と、直近の会話履歴または発話に関連する過去の記録からなる
+    全期間 summary は版が変わらない限りキャッシュを使い、他ワーカーの generate_summary も版の変化で検知する
+    messages を渡すと、直近の会話履歴の代わりに発話に関連する過去の記録を BM25 で検索して差し込む
+    関連する記録が見つからなければ直近の会話履歴を使う (毎回 DB から読む)
+
+    Parameters
+    ----------
+    request_id
+        ログ追跡用のリクエスト ID
+    messages
+        リクエストの会話履歴
+    """
+    user_id = eliza.memory.current_user()
+    summary_str = _summary_str(request_id, user_id)
+
+    related_passages = _related(messages)
+    if not related_passages:
+        recent_messages = eliza.memory.get_recent_messages(RECENT_MESSAGES_LIMIT, user_id)
+        return _render(summary_str, recent_messages, [])
+    logger.info(
+        f"[REQUEST ID: {request_id}] Injecting {len(related_passages)} related memory passages"
+    )
+    return _render(summary_str, [], related_passages)
+
+
+def _hit_rate() -> float:
+    """これまでのヒット率を返す"""
+    total = _hits + _misses
+    return _hits / total if total else 0.0
+
+
+def stats() -> dict[str, Any]:
+    """キャッシュの統計情報を返す"""
+    return {
+        "hits": _hits,
+        "misses": _misses,
+        "hit_rate": round(_hit_rate(), 4),
+        "cached_users": len(_cache),
+        "avg_build_ms": round(_build_seconds / _misses * 1000, 2) if _misses else 0.0,
+        "saved_ms_total": round(_saved_seconds * 1000, 2),
+        "saved_ms_per_request": (
+            round(_saved_seconds * 1000 / (_hits + _misses), 2) if _hits + _misses else 0.0
+        ),
+    }
@@ -0,0 +1,252 @@
+"""Memory I/O - 会話ログの NDJSON エクスポート / インポートと重複の圧縮
+
+    python -m eliza.memory_io export --since 2026-03-01 --until 2026-03-31 > messages.ndjson
+    python -m eliza.memory_io import < messages.ndjson
+    python -m eliza.memory_io --user alice export > alice.ndjson
+    python -m eliza.memory_io compact --dry-run
+"""
+
+import argparse
+import json
+import sys
+import time
+from typing import Any, AsyncIterator, Iterable, Iterator
+
+import eliza.archive
+import eliza.memory
+
+IMPORT_BATCH_SIZE = 5000
+_REQUIRED_FIELDS = ("message_id", "timestamp", "role", "content")
+
+
+def parse_cursor(cursor: str | None) -> tuple[str, str] | None:
+    """エクスポートの再開位置を (timestamp, message_id) に変換する
+
+    cursor は最後に受け取った行の "<timestamp>|<message_id>"
+
+    Parameters
+    ----------
+    cursor
+        再開位置の文字列
+    """
+    if not cursor:
+        return None
+    timestamp, sep, message_id = cursor.rpartition("|")
+    if not sep:
+        raise ValueError(f"Invalid cursor: {cursor}")
+    eliza.memory.to_epoch_ms(timestamp)
+    return timestamp, message_id
+
+
+def export_ndjson(
+    since: str | None = None,
+    until: str | None = None,
+    cursor: str | None = None,
+    include_archive: bool = True,
+    user_id: str | None = None,
+) -> Iterator[str]:
+    """メッセージを1行1件の JSON として順に返す
+
+    アーカイブ済みのメッセージを先に、続けて hot テーブルのメッセージを
+    それぞれ (時刻, message_id) 順で返す (時刻はオフセットを考慮して比べる)
+    メモリ使用量は件数によらず一定 (hot テーブルはページ単位、アーカイブはフレーム単位で読む)
+
+    Parameters
+    ----------
+    since
+        この日 (YYYY-MM-DD) 以降のメッセージだけを返す
+    until
+        この日 (YYYY-MM-DD) 以前のメッセージだけを返す
+    cursor
+        最後に受け取った行の "<timestamp>|<message_id>"。これより後から再開する
+    include_archive
+        True のときアーカイブ済みのメッセージも含める
+    user_id
+        ユーザー ID (None なら最初の行を読むときのコンテキストのユーザー)
+    """
+    after = parse_cursor(cursor)
+    after_key = (eliza.memory.to_epoch_ms(after[0]), after[1]) if after else None
+    user_id = eliza.memory.current_user() if user_id is None else user_id
+    if include_archive:
+        for m in eliza.archive.iter_messages(since, until, user_id=user_id):
+            if after_key and (eliza.memory.to_epoch_ms(m["timestamp"]), m["message_id"]) <= after_key:
+                continue
+            yield json.dumps(m, ensure_ascii=False) + "\n"
+    for m in eliza.memory.iter_messages(since, until, cursor=after, user_id=user_id):
+        yield json.dumps(m, ensure_ascii=False) + "\n"
+
+
+class NdjsonImporter:
+    """NDJSON の行を受け取り、batch_size 件ごとにまとめて取り込むための集計器"""
+
+    def __init__(self, batch_size: int = IMPORT_BATCH_SIZE):
+        """集計器を初期化する
+
+        Parameters
+        ----------
+        batch_size
+            1トランザクションで書き込む件数
+        """
+        self.batch_size = batch_size
+        self.received = 0
+        self.inserted = 0
+        self.errors = 0
+        self._batch: list[dict] = []
+        # この取り込みで新しくメッセージが入った日
+        self._days: set[str] = set()
+        self._start = time.perf_counter()
+
+    def add_line(self, line: str | bytes) -> list[dict] | None:
+        """1行を読み込み、バッチが埋まったらそれを返す
+
+        Parameters
+        ----------
+        line
+            NDJSON の1行
+        """
+        line = line.strip()
+        if not line:
+            return None
+        self.received += 1
+        try:
+            m = json.loads(line)
+            if not isinstance(m, dict):
+                raise ValueError("not a JSON object")
+            if not all(isinstance(m.get(k), str) for k in _REQUIRED_FIELDS):
+                raise ValueError("missing required fields")
+            eliza.memory.to_epoch_ms(m["timestamp"])
+        except ValueError:
+            self.errors += 1
+            return None
+        self._batch.append(m)
+        if len(self._batch) >= self.batch_size:
+            return self.take_batch()
+        return None
+
+    def take_batch(self) -> list[dict]:
+        """溜まっているバッチを取り出す"""
+        batch, self._batch = self._batch, []
+        return batch
+
+    def record(self, inserted: dict[str, int]) -> None:
+        """書き込み結果を記録する
+
+        Parameters
+        ----------
+        inserted
+            日 -> 新たに入った件数 (insert_batch の戻り値)
+        """
+        self.inserted += sum(inserted.values())
+        self._days.update(inserted)
+
+    def result(self) -> dict[str, Any]:
+        """取り込み結果と速度を返す"""
+        elapsed = time.perf_counter() - self._start
+        valid = self.received - self.errors
+        return {
+            "received": self.received,
+            "inserted": self.inserted,
+            "skipped": valid - self.inserted,
+            "errors": self.errors,
+            "elapsed_ms": int(elapsed * 1000),
+            "rows_per_second": round(valid / elapsed, 1) if elapsed > 0 else 0.0,
+            "dirty_days": sorted(self._days),
+        }
+
+
+def insert_batch(batch: list[dict], user_id: str | None = None) -> dict[str, int]:
+    """アーカイブ済みの message_id を除いてバッチを書き込み、日 -> 新たに入った件数 を返す
+
+    hot テーブルにあるものは insert_messages が INSERT OR IGNORE でスキップする
+
+    Parameters
+    ----------
+    batch
+        NdjsonImporter が返したバッチ
+    user_id
+        ユーザー ID (None なら現在のコンテキストのユーザー)
+    """
+    archived = eliza.archive.archived_ids((m["message_id"] for m in batch), user_id=user_id)
+    return eliza.memory.insert_messages(
+        [m for m in batch if m["message_id"] not in archived], user_id=user_id
+    )
+
+
+def import_ndjson(
+    lines: Iterable[str | bytes], batch_size: int = IMPORT_BATCH_SIZE
+) -> dict[str, Any]:
+    """NDJSON の行を batch_size 件ずつのトランザクションで取り込む
+
+    hot テーブルかアーカイブに既にある message_id はスキップし、新しく入ったメッセージの日を summary 再生成対象にする
+
+    Parameters
+    ----------
+    lines
+        NDJSON の行
+    batch_size
+        1トランザクションで書き込む件数
+    """
+    importer = NdjsonImporter(batch_size)
+    for line in lines:
+        batch = importer.add_line(line)
+        if batch:
+            importer.record(insert_batch(batch))
+    importer.record(insert_batch(importer.take_batch()))
+    return importer.result()
+
+
+async def aiter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """バイト列のストリームを行ごとに分割して返す
+
+    Parameters
+    ----------
+    chunks
+        リクエストボディなどのバイト列ストリーム
+    """
+    buf = b""
+    async for chunk in chunks:
+        buf += chunk
+        *lines, buf = buf.split(b"\n")
+        for line in lines:
+            yield line
+    if buf:
+        yield buf
+
+
+def main(argv: list[str] | None = None) -> None:
+    """CLI エントリポイント"""
+    parser = argparse.ArgumentParser(prog="python -m eliza.memory_io")
+    parser.add_argument("--user", default=None, help="対象のユーザー ID (省略時は既定ユーザー)")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_export = sub.add_parser("export", help="会話ログを NDJSON で標準出力に書き出す")
+    p_export.add_argument("--since", help="YYYY-MM-DD")
+    p_export.add_argument("--until", help="YYYY-MM-DD")
+    p_export.add_argument("--cursor", help="<timestamp>|<message_id>")
+    p_export.add_argument("--no-archive", action="store_true", help="アーカイブを含めない")
+
+    p_import = sub.add_parser("import", help="標準入力の NDJSON を取り込む")
+    p_import.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE)
+
+    p_compact = sub.add_parser(
+        "compact", help="履歴の送り直しで重複したメッセージを削除し、message_id を振り直す"
+    )
+    p_compact.add_argument("--dry-run", action="store_true", help="数えるだけで書き換えない")
+
+    args = parser.parse_args(argv)
+    with eliza.memory.use_user(args.user):
+        if args.command == "export":
+            for line in export_ndjson(
+                args.since, args.until, args.cursor, include_archive=not args.no_archive
+            ):
+                sys.stdout.write(line)
+        elif args.command == "import":
+            result = import_ndjson(sys.stdin, batch_size=args.batch_size)
+            print(json.dumps(result, ensure_ascii=False), file=sys.stderr)
+        else:
+            result = eliza.memory.compact_messages(dry_run=args.dry_run)
+            print(json.dumps(result, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
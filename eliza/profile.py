@@ -0,0 +1,208 @@
+"""Profile merge - 日別 summary の user_profile を LLM を使わずに統合する
+
+各ノードは user_profile とは別に、値ごとの出現回数と最後に出た日 (evidence) を持つ
+上位ノードの evidence は子ノードの evidence を足し合わせたもので、user_profile はそこから決める
+
+- リスト (interests / tendencies / personal_notes): 出現回数に新しさの重みを掛けたスコア順に並べる
+- スカラー (name / age / gender / occupation / location.*): 最も新しい null でない値を採用し、
+  その値が何日分の要約に出てきたか (count / total) を確信度として残す
+"""
+
+import copy
+import json
+from datetime import date
+from typing import Any
+
+DEFAULT_PROFILE: dict[str, Any] = {
+    "name": None,
+    "age": None,
+    "gender": None,
+    "location": {"prefecture": None, "city": None, "detail": None},
+    "occupation": None,
+    "interests": [],
+    "tendencies": [],
+    "personal_notes": [],
+}
+
+SCALAR_FIELDS = (
+    "name",
+    "age",
+    "gender",
+    "occupation",
+    "location.prefecture",
+    "location.city",
+    "location.detail",
+)
+LIST_FIELDS = ("interests", "tendencies", "personal_notes")
+
+# user_profile のリストに残す件数
+LIST_LIMIT = 20
+# evidence に残すリストの項目数 (全期間のノードで際限なく増えないように)
+EVIDENCE_LIST_LIMIT = 200
+# リストの項目の重みが半分になる日数 (最も新しい日からの差で測る)
+HALF_LIFE_DAYS = 30.0
+
+
+def _get_path(profile: dict, field: str) -> Any:
+    """"location.city" のようなドット区切りのフィールドを読む
+
+    Parameters
+    ----------
+    profile
+        user_profile
+    field
+        フィールド名
+    """
+    value: Any = profile
+    for part in field.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+
+def _set_path(profile: dict, field: str, value: Any) -> None:
+    """ドット区切りのフィールドに値を書く
+
+    Parameters
+    ----------
+    profile
+        user_profile
+    field
+        フィールド名
+    value
+        書き込む値
+    """
+    *parents, last = field.split(".")
+    for part in parents:
+        profile = profile.setdefault(part, {})
+    profile[last] = value
+
+
+def evidence_from_profile(profile: dict | None, day: str) -> dict[str, Any]:
+    """1日分の user_profile を evidence に変換する
+
+    Parameters
+    ----------
+    profile
+        日別 summary の user_profile
+    day
+        その日 (YYYY-MM-DD)
+    """
+    evidence: dict[str, Any] = {"scalars": {}, "lists": {}}
+    profile = profile or {}
+    for field in SCALAR_FIELDS:
+        value = _get_path(profile, field)
+        if value is None or value == "" or isinstance(value, (dict, list)):
+            continue
+        # 型 (age の int など) を保ったまま dict のキーにするため JSON にする
+        evidence["scalars"][field] = {
+            json.dumps(value, ensure_ascii=False): {"count": 1, "last": day}
+        }
+    for field in LIST_FIELDS:
+        items = profile.get(field)
+        if not isinstance(items, list):
+            continue
+        stats = {}
+        for item in items:
+            if isinstance(item, str) and item.strip():
+                stats[item.strip()] = {"count": 1, "last": day}
+        if stats:
+            evidence["lists"][field] = stats
+    return evidence
+
+
+def _score(stat: dict[str, Any], newest: date) -> float:
+    """リストの項目のスコア (出現回数 x 新しさの重み) を返す
+
+    Parameters
+    ----------
+    stat
+        {"count", "last"}
+    newest
+        統合対象の中で最も新しい日
+    """
+    age_days = max((newest - date.fromisoformat(stat["last"])).days, 0)
+    return stat["count"] * 0.5 ** (age_days / HALF_LIFE_DAYS)
+
+
+def _newest(evidence: dict[str, Any]) -> date | None:
+    """evidence に出てくる最も新しい日を返す
+
+    Parameters
+    ----------
+    evidence
+        evidence
+    """
+    lasts = [
+        stat["last"]
+        for kind in ("scalars", "lists")
+        for values in evidence[kind].values()
+        for stat in values.values()
+    ]
+    return date.fromisoformat(max(lasts)) if lasts else None
+
+
+def merge_evidence(evidences: list[dict[str, Any]]) -> dict[str, Any]:
+    """子ノードの evidence を足し合わせる
+
+    Parameters
+    ----------
+    evidences
+        子ノードの evidence
+    """
+    merged: dict[str, Any] = {"scalars": {}, "lists": {}}
+    for evidence in evidences:
+        for kind in ("scalars", "lists"):
+            for field, values in evidence.get(kind, {}).items():
+                target = merged[kind].setdefault(field, {})
+                for value, stat in values.items():
+                    current = target.get(value)
+                    if current is None:
+                        target[value] = dict(stat)
+                    else:
+                        current["count"] += stat["count"]
+                        current["last"] = max(current["last"], stat["last"])
+    newest = _newest(merged)
+    for field, items in merged["lists"].items():
+        if len(items) > EVIDENCE_LIST_LIMIT:
+            ranked = sorted(items.items(), key=lambda kv: (-_score(kv[1], newest), kv[0]))
+            merged["lists"][field] = dict(ranked[:EVIDENCE_LIST_LIMIT])
+    return merged
+
+
+def profile_from_evidence(
+    evidence: dict[str, Any],
+) -> tuple[dict[str, Any], dict[str, dict[str, int]]]:
+    """evidence から user_profile と スカラー項目の確信度を決める
+
+    Parameters
+    ----------
+    evidence
+        merge_evidence の結果
+
+    Returns
+    -------
+    (user_profile, フィールド -> {"count": 採用した値の出現回数, "total": 値が出てきた回数})
+    """
+    profile = copy.deepcopy(DEFAULT_PROFILE)
+    confidence: dict[str, dict[str, int]] = {}
+    for field in SCALAR_FIELDS:
+        values = evidence["scalars"].get(field)
+        if not values:
+            continue
+        # 最も新しい値を採用し、同じ日に複数あれば出現回数の多い方
+        value, stat = max(values.items(), key=lambda kv: (kv[1]["last"], kv[1]["count"], kv[0]))
+        _set_path(profile, field, json.loads(value))
+        confidence[field] = {
+            "count": stat["count"],
+            "total": sum(s["count"] for s in values.values()),
+        }
+    newest = _newest(evidence)
+    for field in LIST_FIELDS:
+        items = evidence["lists"].get(field)
+        if not items:
+            continue
+        ranked = sorted(items.items(), key=lambda kv: (-_score(kv[1], newest), kv[0]))
+        profile[field] = [item for item, _ in ranked[:LIST_LIMIT]]
+    return profile, confidence
@@ -0,0 +1,332 @@
+"""Retrieval module - 会話ログと日別 summary に対するローカル BM25 検索
+
+ネットワークを使わずにプロセス内でユーザーごとのインデックスを持つ
+インデックスはそのユーザーのメモリの更新 (eliza.memory.change_token) を見て差分更新する
+"""
+
+import logging
+import math
+import re
+import threading
+import unicodedata
+from collections import Counter, OrderedDict, defaultdict
+from dataclasses import dataclass
+from typing import Any, Iterator
+
+import eliza.memory
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TOP_K = 8
+DEFAULT_TOKEN_BUDGET = 800
+
+# BM25 パラメータ
+_K1 = 1.5
+_B = 0.75
+
+# 英数字は単語単位、かな・漢字は連続部分を文字 bigram に分割する
+_TOKEN_RE = re.compile(r"[a-z0-9]+|[\u3040-\u30ff\u3400-\u9fff\uf900-\ufaff]+")
+
+
+def _tokenize(text: str) -> Iterator[str]:
+    """テキストを BM25 用のトークン列に分割する
+
+    Parameters
+    ----------
+    text
+        対象テキスト
+    """
+    text = unicodedata.normalize("NFKC", text).lower()
+    for m in _TOKEN_RE.finditer(text):
+        word = m.group()
+        if word.isascii() or len(word) == 1:
+            yield word
+        else:
+            for i in range(len(word) - 1):
+                yield word[i : i + 2]
+
+
+def estimate_tokens(text: str) -> int:
+    """テキストのおおよそのトークン数を返す
+
+    ASCII は4文字で1トークン、それ以外は1文字1トークンとして数える
+
+    Parameters
+    ----------
+    text
+        対象テキスト
+    """
+    ascii_chars = sum(1 for c in text if c.isascii())
+    return max(1, ascii_chars // 4 + (len(text) - ascii_chars))
+
+
+@dataclass
+class Passage:
+    """検索対象の1文書"""
+
+    source: str  # "message" / "daily"
+    key: str  # message_id / YYYY-MM-DD
+    date: str
+    role: str
+    text: str
+
+
+class Bm25Index:
+    """1ユーザー分の、差分更新できる BM25 インデックス"""
+
+    def __init__(self, user_id: str = eliza.memory.DEFAULT_USER):
+        """空のインデックスを作る
+
+        Parameters
+        ----------
+        user_id
+            索引するメモリのユーザー ID
+        """
+        self.user_id = user_id
+        self._lock = threading.Lock()
+        self._token: tuple | None = None
+        self._rewrites: int | None = None
+        self._reset()
+
+    def _reset(self) -> None:
+        """索引した文書を全て捨てて空に戻す"""
+        self._passages: list[Passage | None] = []
+        self._lengths: list[int] = []
+        self._postings: dict[str, dict[int, int]] = defaultdict(dict)
+        self._doc_ids: dict[tuple[str, str], int] = {}
+        self._total_length = 0
+        self._num_docs = 0
+        self._last_rowid = 0
+        self._summary_updated_at: dict[str, float] = {}
+        self._summary_updated_after = 0.0
+
+    def _add(self, passage: Passage) -> None:
+        """文書を追加する (同じ source/key があれば置き換える)
+
+        Parameters
+        ----------
+        passage
+            追加する文書
+        """
+        self._remove(passage.source, passage.key)
+        terms = Counter(_tokenize(passage.text))
+        if not terms:
+            return
+        doc_id = len(self._passages)
+        self._passages.append(passage)
+        length = sum(terms.values())
+        self._lengths.append(length)
+        for term, tf in terms.items():
+            self._postings[term][doc_id] = tf
+        self._doc_ids[(passage.source, passage.key)] = doc_id
+        self._total_length += length
+        self._num_docs += 1
+
+    def _remove(self, source: str, key: str) -> None:
+        """文書を削除する
+
+        Parameters
+        ----------
+        source
+            文書の種類
+        key
+            文書のキー
+        """
+        doc_id = self._doc_ids.pop((source, key), None)
+        if doc_id is None:
+            return
+        passage = self._passages[doc_id]
+        for term in set(_tokenize(passage.text)):
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(doc_id, None)
+                if not postings:
+                    del self._postings[term]
+        self._passages[doc_id] = None
+        self._total_length -= self._lengths[doc_id]
+        self._num_docs -= 1
+
+    def refresh(self) -> None:
+        """ユーザーのメモリの更新分をインデックスに取り込む
+
+        メモリの change_token が前回と同じなら何もしない
+        compact やアーカイブでメッセージが削除・振り直しされていたら、最初から作り直す
+        """
+        token = eliza.memory.change_token(self.user_id)
+        if token == self._token:
+            return
+        rewrites = eliza.memory.message_rewrites(self.user_id)
+        if rewrites != self._rewrites:
+            if self._rewrites is not None:
+                logger.info(f"[RETRIEVAL] Messages of {self.user_id} were rewritten, rebuilding index")
+                self._reset()
+            self._rewrites = rewrites
+        added = 0
+        while True:
+            rows = eliza.memory.get_messages_since(self._last_rowid, user_id=self.user_id)
+            if not rows:
+                break
+            for r in rows:
+                self._last_rowid = r["rowid"]
+                if r["role"] not in ("user", "assistant"):
+                    continue
+                self._add(
+                    Passage(
+                        source="message",
+                        key=r["message_id"],
+                        date=r["day"],
+                        role=r["role"],
+                        text=r["content"],
+                    )
+                )
+                added += 1
+        # 書き込み待ちのメッセージも索引する (書き込み後に同じ key で置き換わる)
+        for m in eliza.memory.get_pending_messages(self.user_id):
+            if m["role"] not in ("user", "assistant"):
+                continue
+            self._add(
+                Passage(
+                    source="message",
+                    key=m["message_id"],
+                    date=eliza.memory.jst_day(m["timestamp"]),
+                    role=m["role"],
+                    text=m["content"],
+                )
+            )
+            added += 1
+        for daily in eliza.memory.get_daily_summaries(
+            self._summary_updated_after, user_id=self.user_id
+        ):
+            if self._summary_updated_at.get(daily["date"]) == daily["updated_at"]:
+                continue
+            self._summary_updated_at[daily["date"]] = daily["updated_at"]
+            self._summary_updated_after = max(
+                self._summary_updated_after, daily["updated_at"]
+            )
+            self._add(
+                Passage(
+                    source="daily",
+                    key=daily["date"],
+                    date=daily["date"],
+                    role="summary",
+                    text=daily.get("summary", ""),
+                )
+            )
+            added += 1
+        self._token = token
+        if added:
+            logger.info(
+                f"[RETRIEVAL] Indexed {added} passages for {self.user_id} ({self._num_docs} total)"
+            )
+
+    def search(
+        self,
+        query: str,
+        top_k: int = DEFAULT_TOP_K,
+        token_budget: int = DEFAULT_TOKEN_BUDGET,
+        exclude: set[str] | None = None,
+    ) -> list[dict[str, Any]]:
+        """クエリに関連する文書をスコア順に返す
+
+        上位から順に token_budget に収まるものだけを採用する
+
+        Parameters
+        ----------
+        query
+            検索クエリ
+        top_k
+            返す最大件数
+        token_budget
+            返す文書の合計トークン数の上限
+        exclude
+            除外する本文の集合 (リクエストに含まれている会話など)
+        """
+        with self._lock:
+            self.refresh()
+            if not self._num_docs:
+                return []
+            avg_length = self._total_length / self._num_docs
+            scores: dict[int, float] = defaultdict(float)
+            for term in set(_tokenize(query)):
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                df = len(postings)
+                idf = math.log(1 + (self._num_docs - df + 0.5) / (df + 0.5))
+                for doc_id, tf in postings.items():
+                    norm = _K1 * (1 - _B + _B * self._lengths[doc_id] / avg_length)
+                    scores[doc_id] += idf * tf * (_K1 + 1) / (tf + norm)
+
+            # 同点なら新しい文書を優先する
+            ranked = sorted(scores.items(), key=lambda x: (x[1], x[0]), reverse=True)
+            results: list[dict[str, Any]] = []
+            used = 0
+            for doc_id, score in ranked:
+                passage = self._passages[doc_id]
+                if exclude and passage.text in exclude:
+                    continue
+                cost = estimate_tokens(passage.text)
+                if used + cost > token_budget:
+                    continue
+                used += cost
+                results.append(
+                    {
+                        "source": passage.source,
+                        "key": passage.key,
+                        "date": passage.date,
+                        "role": passage.role,
+                        "text": passage.text,
+                        "score": round(score, 3),
+                    }
+                )
+                if len(results) >= top_k:
+                    break
+            return results
+
+
+# user_id -> インデックス (保持するユーザー数は eliza.memory.MAX_OPEN_STORES まで)
+_indexes: OrderedDict[str, Bm25Index] = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def _get_index(user_id: str) -> Bm25Index:
+    """ユーザーのインデックスを返す (なければ作る)
+
+    Parameters
+    ----------
+    user_id
+        ユーザー ID
+    """
+    with _indexes_lock:
+        index = _indexes.get(user_id)
+        if index is None:
+            index = _indexes[user_id] = Bm25Index(user_id)
+        _indexes.move_to_end(user_id)
+        while len(_indexes) > eliza.memory.MAX_OPEN_STORES:
+            _indexes.popitem(last=False)
+        return index
+
+
+def search(
+    query: str,
+    top_k: int = DEFAULT_TOP_K,
+    token_budget: int = DEFAULT_TOKEN_BUDGET,
+    exclude: set[str] | None = None,
+) -> list[dict[str, Any]]:
+    """現在のコンテキストのユーザーのインデックスで検索する
+
+    Parameters
+    ----------
+    query
+        検索クエリ
+    top_k
+        返す最大件数
+    token_budget
+        返す文書の合計トークン数の上限
+    exclude
+        除外する本文の集合
+    """
+    if not query.strip():
+        return []
+    index = _get_index(eliza.memory.current_user())
+    return index.search(query, top_k=top_k, token_budget=token_budget, exclude=exclude)
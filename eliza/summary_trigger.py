@@ -0,0 +1,97 @@
+"""Summary trigger - 会話ログの書き込みをきっかけに summary 生成のジョブを積む
+
+save_messages などの書き込みは dirty_days に日ごとの件数と時刻を残す
+リーダーのワーカーがそれを見て、次のいずれかで summary ジョブ (dirty な日だけを処理する) を積む
+
+- idle: 最後の書き込みから ELIZA_SUMMARY_IDLE_SECONDS 経った
+- messages: 前回の summary 以降に ELIZA_SUMMARY_MAX_PENDING 件のメッセージが増えた
+- day_boundary: 今日より前の日が dirty (日付をまたいだ、過去の日を取り込んだ)
+
+同じユーザーには ELIZA_SUMMARY_DEBOUNCE_SECONDS に1回までしか積まない
+"""
+
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Any
+from zoneinfo import ZoneInfo
+
+import eliza.jobs
+import eliza.memory
+
+logger = logging.getLogger(__name__)
+
+JST = ZoneInfo("Asia/Tokyo")
+
+IDLE_SECONDS = float(os.environ.get("ELIZA_SUMMARY_IDLE_SECONDS", "600"))
+MAX_PENDING_MESSAGES = int(os.environ.get("ELIZA_SUMMARY_MAX_PENDING", "50"))
+DEBOUNCE_SECONDS = float(os.environ.get("ELIZA_SUMMARY_DEBOUNCE_SECONDS", "300"))
+
+_POLL_INTERVAL_SECONDS = 10.0
+
+
+def decide(
+    state: dict[str, Any], now: float, last_triggered_at: float | None = None
+) -> str | None:
+    """summary を生成すべきかを判定し、理由を返す (不要なら None)
+
+    Parameters
+    ----------
+    state
+        eliza.memory.get_dirty_state の結果
+    now
+        現在時刻 (UNIX 秒)
+    last_triggered_at
+        前回このユーザーのジョブを積んだ時刻
+    """
+    if not state["days"]:
+        return None
+    if last_triggered_at is not None and now - last_triggered_at < DEBOUNCE_SECONDS:
+        return None
+    today = datetime.fromtimestamp(now, JST).date().isoformat()
+    if state["days"][0] < today:
+        return "day_boundary"
+    if state["pending"] >= MAX_PENDING_MESSAGES:
+        return "messages"
+    if state["last_write_at"] is not None and now - state["last_write_at"] >= IDLE_SECONDS:
+        return "idle"
+    return None
+
+
+async def run_trigger_loop():
+    """ユーザーごとの書き込み状況を見て summary とアーカイブのジョブを積むバックグラウンドループ
+
+    リーダーのワーカーでだけ動かす (eliza.leader.run_while_leader)
+    前回 dirty な日がなく change_token も変わっていないユーザーは DB を読まない
+    """
+    # user_id -> {"token", "state", "last_triggered_at"}
+    watched: dict[str, dict[str, Any]] = {}
+    while True:
+        await asyncio.sleep(_POLL_INTERVAL_SECONDS)
+        now = time.time()
+        for user_id in await asyncio.to_thread(eliza.memory.list_users):
+            entry = watched.setdefault(
+                user_id, {"token": None, "state": None, "last_triggered_at": None}
+            )
+            token = eliza.memory.change_token(user_id)
+            if token != entry["token"] or entry["state"] is None or entry["state"]["days"]:
+                entry["state"] = await asyncio.to_thread(
+                    eliza.memory.get_dirty_state, user_id
+                )
+                entry["token"] = token
+
+            reason = decide(entry["state"], now, entry["last_triggered_at"])
+            if reason is None:
+                continue
+            entry["last_triggered_at"] = now
+            job = await asyncio.to_thread(
+                eliza.jobs.enqueue, "summary", {"user_id": user_id, "only_dirty": True}
+            )
+            if reason == "day_boundary":
+                await asyncio.to_thread(eliza.jobs.enqueue, "archive", {"user_id": user_id})
+            logger.info(
+                f"[AUTO SUMMARY] Queued summary for {user_id} (reason={reason}, "
+                f"days={entry['state']['days']}, pending={entry['state']['pending']}, job {job['job_id']})"
+            )
@@ -1,15 +1,21 @@
 """Tools for Grok agent"""
 
-from typing import Any
+import bisect
+import os
+import threading
+import time
+from typing import Any, Callable
 
+from pydantic import TypeAdapter
 from xai_sdk import tools
 from xai_sdk.proto import chat_pb2
 
+from . import effects, http_client
 from .browser import Browser
 from .clipboard import Clipboard
 from .memory import MemoryTool
 from .schedule import Schedule
-from .skill import Skill
+from .skill import Skill, skills_token
 from .subagents import SubAgents
 from .switchbot import Switchbot
 from .tenki import Tenki
@@ -26,14 +32,20 @@ def is_server_side(tool_name: str) -> bool:
     )
 
 
-def create_tools(deep: bool = False, interact: bool = False, search: bool = True) -> list[chat_pb2.Tool]:
-    """Create tools for Grok agent"""
+# (deep, interact, search) -> 組み立て済みの tool 定義
+# ワーカーごとに1回だけ組み立て、スキル定義が変わったら (skills_token が変わったら) 作り直す
+_registry: dict[tuple[bool, bool, bool], tuple[chat_pb2.Tool, ...]] = {}
+_registry_token: tuple | None = None
+_registry_lock = threading.Lock()
+
+
+def _build_tools(deep: bool, interact: bool, search: bool) -> tuple[chat_pb2.Tool, ...]:
+    """Build tools for Grok agent"""
     available_tools = [tools.x_search(), tools.web_search(), tools.code_execution()] if search else []
-    try:
-        switchbot = Switchbot()
-        available_tools.extend(switchbot.create_tools())
-    except Exception as e:
-        print(f"Failed to create Switchbot tools: {e}")
+    if os.environ.get("SWITCHBOT_API_TOKEN") and os.environ.get("SWITCHBOT_API_SECRET"):
+        available_tools.extend(Switchbot.create_tools())
+    else:
+        print("Failed to create Switchbot tools: SWITCHBOT_API_TOKEN / SWITCHBOT_API_SECRET is not set")
     try:
         available_tools.extend(YouTubeSearch().create_tools())
     except Exception as e:
@@ -46,46 +58,136 @@ def create_tools(deep: bool = False, interact: bool = False, search: bool = True
     available_tools.extend(Schedule().create_tools())
     available_tools.extend(Tenki().create_tools())
     available_tools.extend(ToDo().create_tools())
+    return tuple(available_tools)
+
+
+def create_tools(deep: bool = False, interact: bool = False, search: bool = True) -> tuple[chat_pb2.Tool, ...]:
+    """Return prebuilt tools for Grok agent
+
+    The returned tuple is shared between requests and must not be modified
+    """
+    global _registry_token
+    token = skills_token()
+    key = (deep, interact, search)
+    with _registry_lock:
+        if token != _registry_token:
+            _registry.clear()
+            _registry_token = token
+        available_tools = _registry.get(key)
+        if available_tools is None:
+            available_tools = _registry[key] = _build_tools(*key)
     return available_tools
 
 
+# 1つのワーカーで使い回すツールのインスタンス (どれもリクエストごとの状態を持たない)
+_instances = (
+    Switchbot.shared(),
+    Browser(),
+    Tenki(),
+    YouTubeSearch(),
+    Clipboard(),
+    MemoryTool(),
+    Schedule(),
+    ToDo(),
+    SubAgents(),
+)
+
+# (deep, interact) -> ツール名 -> (引数の TypeAdapter, 実行する関数)
+# skill_use だけが deep / interact によって変わるので、組み合わせごとに表を持つ
+_Dispatch = dict[str, tuple[TypeAdapter, Callable[[Any], dict[str, Any] | None]]]
+# 最初の呼び出しで1回だけ組み立てる
+_dispatch: dict[tuple[bool, bool], _Dispatch] | None = None
+_dispatch_lock = threading.Lock()
+
+# ツールの実行時間のヒストグラムの境界 (ミリ秒, 最後のバケツはそれより長いもの)
+LATENCY_BUCKETS_MS = (10, 50, 100, 500, 1000, 5000, 10000)
+
+# ツール名 -> {"calls", "errors", "total_ms", "max_ms", "buckets"}
+_stats: dict[str, dict[str, Any]] = {}
+_stats_lock = threading.Lock()
+
+
+def _build_dispatch() -> dict[tuple[bool, bool], _Dispatch]:
+    """Build dispatch tables from the long-lived tool instances"""
+    shared: _Dispatch = {}
+    for instance in _instances:
+        for name, (model, func) in instance.handlers().items():
+            shared[name] = (TypeAdapter(model), func)
+    tables = {}
+    for deep in (False, True):
+        for interact in (False, True):
+            table = dict(shared)
+            for name, (model, func) in Skill(deep=deep, interact=interact).handlers().items():
+                table[name] = (TypeAdapter(model), func)
+            tables[(deep, interact)] = table
+    return tables
+
+
+def _record(tool_name: str, elapsed_ms: float, error: bool) -> None:
+    """Record a call count and latency for the tool"""
+    bucket = bisect.bisect_left(LATENCY_BUCKETS_MS, elapsed_ms)
+    with _stats_lock:
+        stat = _stats.get(tool_name)
+        if stat is None:
+            stat = _stats[tool_name] = {
+                "calls": 0,
+                "errors": 0,
+                "total_ms": 0.0,
+                "max_ms": 0.0,
+                "buckets": [0] * (len(LATENCY_BUCKETS_MS) + 1),
+            }
+        stat["calls"] += 1
+        stat["errors"] += error
+        stat["total_ms"] += elapsed_ms
+        stat["max_ms"] = max(stat["max_ms"], elapsed_ms)
+        stat["buckets"][bucket] += 1
+
+
 def call(
     tool_name: str, tool_args: dict, deep: bool = False, interact: bool = False
 ) -> dict[str, Any] | None:
-    """Call any tool by name"""
-    match tool_name:
-        case _ if tool_name.startswith("switchbot_"):
-            switchbot = Switchbot()
-            return switchbot.call(tool_name, tool_args)
-        case _ if tool_name.startswith("browser_"):
-            return Browser().call(tool_name, tool_args)
-        case _ if tool_name.startswith("tenki_"):
-            return Tenki().call(tool_name, tool_args)
-        case _ if tool_name.startswith("youtube_"):
-            return YouTubeSearch().call(tool_name, tool_args)
-        case _ if tool_name.startswith("clipboard_"):
-            return Clipboard().call(tool_name, tool_args)
-        case _ if tool_name.startswith("memory_"):
-            return MemoryTool().call(tool_name, tool_args)
-        case _ if tool_name.startswith("skill_"):
-            return Skill(deep=deep, interact=interact).call(tool_name, tool_args)
-        case _ if tool_name.startswith("schedule_"):
-            return Schedule().call(tool_name, tool_args)
-        case _ if tool_name.startswith("todo_"):
-            return ToDo().call(tool_name, tool_args)
-        case _ if tool_name.startswith("subagents_"):
-            return SubAgents().call(tool_name, tool_args)
-        case _ if (
-            tool_name.startswith("x_")
-            or tool_name.startswith("web_")
-            or tool_name.startswith("code_")
-        ):
+    """Call any tool by name
+
+    The arguments are validated against the tool's params model before the call
+    """
+    global _dispatch
+    if _dispatch is None:
+        with _dispatch_lock:
+            if _dispatch is None:
+                _dispatch = _build_dispatch()
+    handler = _dispatch[(deep, interact)].get(tool_name)
+    if handler is None:
+        if is_server_side(tool_name):
             raise ValueError("Server-side tools should not be called from the agent")
-        case _:
-            raise ValueError(f"Unknown tool: {tool_name}")
+        raise ValueError(f"Unknown tool: {tool_name}")
+    adapter, func = handler
+    start = time.perf_counter()
+    error = True
+    try:
+        result = func(adapter.validate_python(tool_args or {}))
+        error = False
+        return result
+    finally:
+        _record(tool_name, (time.perf_counter() - start) * 1000, error)
+
+
+def tool_stats() -> dict[str, dict[str, Any]]:
+    """Return call counts and latency histograms per tool (in this worker)"""
+    with _stats_lock:
+        stats = {name: dict(stat, buckets=list(stat["buckets"])) for name, stat in _stats.items()}
+    for stat in stats.values():
+        stat["avg_ms"] = round(stat["total_ms"] / stat["calls"], 3)
+        stat["total_ms"] = round(stat["total_ms"], 3)
+        stat["max_ms"] = round(stat["max_ms"], 3)
+        stat["buckets"] = {
+            **{f"le_{b}ms": n for b, n in zip(LATENCY_BUCKETS_MS, stat["buckets"])},
+            "inf": stat["buckets"][-1],
+        }
+    return dict(sorted(stats.items()))
 
 
 __all__ = [
     "create_tools",
     "call",
+    "tool_stats",
 ]
@@ -1,16 +1,29 @@
 """Browser tool - opens a URL in Vivaldi"""
 
 import os
-import subprocess
-from typing import Any
+from typing import Any, Callable
 
 from pydantic import BaseModel, Field
 from xai_sdk.chat import tool
 from xai_sdk.proto import chat_pb2
 
+from . import effects
+
 BROWSER_PATH = os.environ.get("BROWSER_PATH")
 
 
+def open_url(url: str) -> dict[str, Any]:
+    """ブラウザを起動して URL を開く (起動したプロセスの終了は待たない)
+
+    Parameters
+    ----------
+    url
+        開く URL
+    """
+    effects.spawn([BROWSER_PATH, url])
+    return {"status": "ok", "message": f"ブラウザでURLを開きました: {url}"}
+
+
 class BrowserUrlOpenParams(BaseModel):
     url: str = Field(description="開くURL")
 
@@ -31,11 +44,11 @@ class Browser:
                 "status": "error",
                 "message": "環境変数 BROWSER_PATH が設定されていません",
             }
-        subprocess.Popen([BROWSER_PATH, url])
         return {
             "status": "ok",
-            "message": f"ブラウザでURLを開きました: {url}",
+            "message": f"ブラウザでURLを開いています: {url}",
             "url": url,
+            "effects": [effects.submit("browser_open", lambda: open_url(url))],
         }
 
     def create_tools(self) -> list[chat_pb2.Tool]:
@@ -52,10 +65,8 @@ class Browser:
             ),
         ]
 
-    def call(self, tool_name: str, tool_args: dict[str, Any]) -> dict[str, Any]:
-        """Call a browser tool by name"""
-        match tool_name:
-            case "browser_url_open":
-                return self.url_open(url=tool_args["url"])
-            case _:
-                raise ValueError(f"Unknown tool: {tool_name}")
+    def handlers(self) -> dict[str, tuple[type[BaseModel], Callable[[Any], dict[str, Any]]]]:
+        """ツール名 -> (引数のモデル, 検証済みの引数を受け取るハンドラ) を返す"""
+        return {
+            "browser_url_open": (BrowserUrlOpenParams, lambda p: self.url_open(url=p.url)),
+        }
@@ -1,12 +1,14 @@
 """Clipboard tool for Grok agent - uses ~/bin/clip"""
 
 import subprocess
-from typing import Any
+from typing import Any, Callable
 
 from pydantic import BaseModel, Field
 from xai_sdk.chat import tool
 from xai_sdk.proto import chat_pb2
 
+from . import effects
+
 CLIP_CMD = "/home/cympfh/bin/clip"
 
 
@@ -44,6 +46,22 @@ class Clipboard:
             "message": f"クリップボードにコピーしました ({len(text)} 文字)",
         }
 
+    def copy_in_background(self, text: str) -> dict[str, Any]:
+        """テキストのコピーをバックグラウンドで実行し、完了を待たずに返す
+
+        コピーの結果は tool_history の "effects" に書き戻される (eliza.tools.effects.settle)
+
+        Parameters
+        ----------
+        text
+            コピーするテキスト
+        """
+        return {
+            "status": "ok",
+            "message": f"クリップボードへのコピーを開始しました ({len(text)} 文字)",
+            "effects": [effects.submit("clipboard_copy", lambda: self.copy(text), supersede="clipboard")],
+        }
+
     def paste(self) -> dict[str, Any]:
         """クリップボードの内容を取得する"""
         result = subprocess.run(
@@ -83,12 +101,12 @@ class Clipboard:
             ),
         ]
 
-    def call(self, tool_name: str, tool_args: dict[str, Any]) -> dict[str, Any]:
-        """Call a clipboard tool by name"""
-        match tool_name:
-            case "clipboard_copy":
-                return self.copy(text=tool_args["text"])
-            case "clipboard_paste":
-                return self.paste()
-            case _:
-                raise ValueError(f"Unknown tool: {tool_name}")
+    def handlers(self) -> dict[str, tuple[type[BaseModel], Callable[[Any], dict[str, Any]]]]:
+        """ツール名 -> (引数のモデル, 検証済みの引数を受け取るハンドラ) を返す"""
+        return {
+            "clipboard_copy": (
+                ClipboardCopyParams,
+                lambda p: self.copy_in_background(text=p.text),
+            ),
+            "clipboard_paste": (ClipboardPasteParams, lambda p: self.paste()),
+        }
@@ -0,0 +1,188 @@
+"""Coalesce - 同じ外部 API の呼び出しが同時に来たら、ワーカー内でもワーカー間でも1回にまとめる
+
+ツールはキャッシュを引く関数 (lookup) と、API を呼んでキャッシュに入れる関数 (fetch) を渡す
+
+- ワーカー内: 実行中の呼び出しの結果 (Future) を待つ
+- ワーカー間: 最初のワーカーが .memory/coalesce.sqlite に呼び出し中の印を置き、
+  他のワーカーは印が消えるまでキャッシュに入るのを待つ
+"""
+
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Callable, TypeVar
+
+T = TypeVar("T")
+
+COALESCE_DB = Path(".memory") / "coalesce.sqlite"
+# 他のワーカーの呼び出しがキャッシュに入るのを待つ上限の秒数とその確認間隔
+# (これより古い呼び出し中の印は、そのワーカーが落ちたものとみなす)
+WAIT_SECONDS = 15.0
+POLL_SECONDS = 0.1
+
+# (scope, key) -> 実行中の呼び出しの結果
+_inflight: dict[tuple[str, str], Future] = {}
+_inflight_lock = threading.Lock()
+
+
+def _connect() -> sqlite3.Connection:
+    """呼び出し中の印の DB に接続し、テーブルが未作成なら作成する"""
+    COALESCE_DB.parent.mkdir(exist_ok=True)
+    conn = sqlite3.connect(COALESCE_DB, timeout=5, isolation_level=None)
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS pending (
+            scope      TEXT NOT NULL,
+            key        TEXT NOT NULL,
+            claimed_at REAL NOT NULL,
+            PRIMARY KEY (scope, key)
+        )
+        """
+    )
+    return conn
+
+
+def _claim(scope: str, key: str) -> bool:
+    """この呼び出しを行うことをワーカー間で宣言し、宣言できたら True を返す
+
+    既に他のワーカーが宣言していれば False (WAIT_SECONDS より古い宣言は無視する)
+
+    Parameters
+    ----------
+    scope
+        呼び出しの種類 (例: youtube_search)
+    key
+        scope の中で呼び出しを区別するキー
+    """
+    now = time.time()
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("DELETE FROM pending WHERE claimed_at < ?", (now - WAIT_SECONDS,))
+        claimed = conn.execute(
+            "INSERT OR IGNORE INTO pending (scope, key, claimed_at) VALUES (?, ?, ?)",
+            (scope, key, now),
+        ).rowcount
+        conn.execute("COMMIT")
+        return bool(claimed)
+    except BaseException:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+
+def _release(scope: str, key: str) -> None:
+    """_claim の宣言を取り消す
+
+    Parameters
+    ----------
+    scope
+        呼び出しの種類
+    key
+        scope の中で呼び出しを区別するキー
+    """
+    conn = _connect()
+    try:
+        conn.execute("DELETE FROM pending WHERE scope = ? AND key = ?", (scope, key))
+    finally:
+        conn.close()
+
+
+def _claimed(scope: str, key: str) -> bool:
+    """他のワーカーの宣言が残っているかを返す
+
+    Parameters
+    ----------
+    scope
+        呼び出しの種類
+    key
+        scope の中で呼び出しを区別するキー
+    """
+    conn = _connect()
+    try:
+        row = conn.execute(
+            "SELECT 1 FROM pending WHERE scope = ? AND key = ?", (scope, key)
+        ).fetchone()
+    finally:
+        conn.close()
+    return row is not None
+
+
+def _wait_for_other(scope: str, key: str, lookup: Callable[[], T | None]) -> T | None:
+    """他のワーカーの呼び出しの結果がキャッシュに入るのを待って返す
+
+    宣言が取り消された (失敗した、キャッシュしない結果だった) か
+    WAIT_SECONDS 待っても入らなければ None
+
+    Parameters
+    ----------
+    scope
+        呼び出しの種類
+    key
+        scope の中で呼び出しを区別するキー
+    lookup
+        キャッシュを引き、なければ None を返す関数
+    """
+    deadline = time.monotonic() + WAIT_SECONDS
+    while time.monotonic() < deadline:
+        time.sleep(POLL_SECONDS)
+        hit = lookup()
+        if hit is not None:
+            return hit
+        if not _claimed(scope, key):
+            return lookup()
+    return None
+
+
+def fetch_once(
+    scope: str, key: str, lookup: Callable[[], T | None], fetch: Callable[[], T]
+) -> T:
+    """キャッシュにあればそれを、なければ fetch の結果を返す
+
+    同じ scope・key の呼び出しが同時に来たら fetch は1回だけ呼び、他はその結果を待つ
+
+    Parameters
+    ----------
+    scope
+        呼び出しの種類 (例: youtube_search)
+    key
+        scope の中で呼び出しを区別するキー (正規化したもの)
+    lookup
+        キャッシュを引き、なければ None を返す関数
+    fetch
+        API を呼んで結果をキャッシュに入れ、その結果を返す関数
+    """
+    hit = lookup()
+    if hit is not None:
+        return hit
+    with _inflight_lock:
+        future = _inflight.get((scope, key))
+        owner = future is None
+        if owner:
+            future = _inflight[(scope, key)] = Future()
+    if not owner:
+        return future.result()
+    try:
+        # 待っている間に他のワーカーがキャッシュに入れたかもしれない
+        hit = lookup()
+        claimed = hit is None and _claim(scope, key)
+        if hit is None and not claimed:
+            hit = _wait_for_other(scope, key, lookup)
+        if hit is None:
+            try:
+                hit = fetch()
+            finally:
+                if claimed:
+                    _release(scope, key)
+        future.set_result(hit)
+        return hit
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _inflight_lock:
+            _inflight.pop((scope, key), None)
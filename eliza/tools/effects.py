@@ -0,0 +1,165 @@
+"""Effects - クリップボードへのコピーやブラウザの起動などの副作用をバックグラウンドで実行する
+
+ツールは副作用を submit して {"effect_id", "kind", "status": "pending"} をすぐに返し、
+副作用はワーカーで1本の実行スレッドが順に実行する
+結果はエージェントの応答を返す前に settle で tool_history の各ツールの結果 ("effects") に書き戻す
+"""
+
+import logging
+import subprocess
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable
+
+logger = logging.getLogger(__name__)
+
+# settle で副作用の完了を待つ上限の秒数 (全ての副作用の合計)
+SETTLE_TIMEOUT_SECONDS = 2.0
+# 結果を覚えておく副作用の数 (settle されないものはこれを超えたら古い順に忘れる)
+_MAX_TRACKED = 256
+
+# 副作用は起きた順に実行したいので1スレッドにする (スレッドはワーカーの間使い回す)
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="effects")
+# effect_id -> 結果
+_effects: "OrderedDict[str, Future]" = OrderedDict()
+# supersede のキー -> 最後に submit された effect_id
+_latest: dict[str, str] = {}
+# 起動したまま終わっていない子プロセス (終わったら回収する)
+_children: list[subprocess.Popen] = []
+_lock = threading.Lock()
+
+
+def spawn(args: list[str]) -> subprocess.Popen:
+    """子プロセスを起動し、終了を待たずに返す (終わったものは次に起動するときに回収する)
+
+    Parameters
+    ----------
+    args
+        コマンドと引数
+    """
+    with _lock:
+        _children[:] = [p for p in _children if p.poll() is None]
+    process = subprocess.Popen(args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    with _lock:
+        _children.append(process)
+    return process
+
+
+def _run(
+    effect_id: str, kind: str, func: Callable[[], dict[str, Any]], supersede: str | None
+) -> dict[str, Any]:
+    """副作用を実行して結果を返す
+
+    Parameters
+    ----------
+    effect_id
+        副作用の ID
+    kind
+        副作用の種類
+    func
+        副作用を実行して {"status", "message"} を返す関数
+    supersede
+        同じキーの副作用が後から submit されていたら実行しない
+    """
+    start = time.perf_counter()
+    if supersede is not None:
+        with _lock:
+            superseded = _latest.get(supersede) != effect_id
+        if superseded:
+            return {
+                "effect_id": effect_id,
+                "kind": kind,
+                "status": "superseded",
+                "elapsed_ms": 0,
+            }
+    try:
+        result = func()
+    except Exception as e:
+        logger.warning(f"[EFFECTS] {kind} {effect_id} failed: {e}")
+        result = {"status": "error", "message": f"{type(e).__name__}: {e}"}
+    return {
+        "effect_id": effect_id,
+        "kind": kind,
+        **result,
+        "elapsed_ms": int((time.perf_counter() - start) * 1000),
+    }
+
+
+def submit(
+    kind: str, func: Callable[[], dict[str, Any]], supersede: str | None = None
+) -> dict[str, Any]:
+    """副作用をバックグラウンドの実行に回し、ツールの結果に入れる pending の状態を返す
+
+    Parameters
+    ----------
+    kind
+        副作用の種類 (例: clipboard_copy, browser_open)
+    func
+        副作用を実行して {"status", "message", ...} を返す関数
+    supersede
+        同じキーで後から submit された副作用があれば、実行前のこの副作用は飛ばす
+        (例: クリップボードは最後のコピーだけが残れば良い)
+    """
+    effect_id = uuid.uuid4().hex[:12]
+    with _lock:
+        if supersede is not None:
+            _latest[supersede] = effect_id
+        _effects[effect_id] = _executor.submit(_run, effect_id, kind, func, supersede)
+        while len(_effects) > _MAX_TRACKED:
+            _effects.popitem(last=False)
+    return {"effect_id": effect_id, "kind": kind, "status": "pending"}
+
+
+def result(effect_id: str, timeout: float | None = None) -> dict[str, Any] | None:
+    """副作用の結果を返す (timeout 秒待っても終わらなければ pending のまま, 知らない ID なら None)
+
+    Parameters
+    ----------
+    effect_id
+        副作用の ID
+    timeout
+        完了を待つ秒数
+    """
+    with _lock:
+        future = _effects.get(effect_id)
+    if future is None:
+        return None
+    try:
+        return future.result(timeout=timeout)
+    except TimeoutError:
+        return {"effect_id": effect_id, "status": "pending"}
+
+
+def settle(
+    tool_history: list[tuple[dict[str, Any], dict[str, Any] | None]],
+    timeout: float = SETTLE_TIMEOUT_SECONDS,
+) -> None:
+    """tool_history のツールの結果にある pending の副作用を、完了した結果に置き換える
+
+    Parameters
+    ----------
+    tool_history
+        (ツールの呼び出し, 結果) のリスト
+    timeout
+        全ての副作用の完了を待つ上限の秒数
+    """
+    deadline = time.monotonic() + timeout
+    for _, tool_result in tool_history:
+        if not tool_result or not tool_result.get("effects"):
+            continue
+        settled = []
+        for effect in tool_result["effects"]:
+            if effect.get("status") != "pending":
+                settled.append(effect)
+                continue
+            done = result(effect["effect_id"], max(deadline - time.monotonic(), 0))
+            if done is None or done["status"] == "pending":
+                settled.append(effect)
+                continue
+            settled.append(done)
+            with _lock:
+                _effects.pop(effect["effect_id"], None)
+        tool_result["effects"] = settled
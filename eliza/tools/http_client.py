@@ -0,0 +1,306 @@
+"""HTTP client - ツールが外部 API を呼ぶための共有 HTTP クライアント
+
+ワーカー内で1つの httpx.Client (非同期は event loop ごとに1つの httpx.AsyncClient) を使い回すので、
+同じホストへのリクエストは keep-alive の接続を再利用する (h2 がインストールされていれば HTTP/2 を使う)
+タイムアウトとリトライの回数はホストごとに HOST_POLICIES で決める (リトライの回数は呼び出しごとに retries で変えられる)
+
+- 接続できなかった (リクエストを送る前に失敗した): どのメソッドでもリトライする
+- 送った後のタイムアウトや切断、429 / 5xx: GET などの冪等なメソッドだけリトライする
+"""
+
+import asyncio
+import importlib.util
+import threading
+import time
+import weakref
+from dataclasses import dataclass, replace
+from typing import Any
+
+import httpx
+
+
+@dataclass(frozen=True)
+class HostPolicy:
+    # 1回のリクエストのタイムアウト (秒)
+    timeout: float = 10.0
+    # 失敗したときに追加で試す回数
+    retries: int = 1
+    # n 回目のリトライの前に backoff * 2**n 秒待つ
+    backoff: float = 0.2
+
+
+DEFAULT_POLICY = HostPolicy()
+HOST_POLICIES: dict[str, HostPolicy] = {
+    "api.switch-bot.com": HostPolicy(timeout=5.0, retries=2),
+    "api.openweathermap.org": HostPolicy(timeout=5.0, retries=2),
+    "www.googleapis.com": HostPolicy(timeout=10.0, retries=1),
+}
+
+HTTP2 = importlib.util.find_spec("h2") is not None
+_LIMITS = httpx.Limits(max_connections=32, max_keepalive_connections=16, keepalive_expiry=60.0)
+
+_IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE"})
+_RETRY_STATUS = frozenset({429, 500, 502, 503, 504})
+# リクエストを送る前に失敗したことが確かな例外 (POST でもリトライしてよい)
+_NOT_SENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+_client: httpx.Client | None = None
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = (
+    weakref.WeakKeyDictionary()
+)
+_clients_lock = threading.Lock()
+
+# ホスト -> {"requests", "errors", "retries", "connections_opened", "connections_reused", "http2"}
+_stats: dict[str, dict[str, int]] = {}
+_stats_lock = threading.Lock()
+
+
+def policy_for(host: str) -> HostPolicy:
+    """ホストのタイムアウトとリトライの設定を返す
+
+    Parameters
+    ----------
+    host
+        ホスト名
+    """
+    return HOST_POLICIES.get(host, DEFAULT_POLICY)
+
+
+def _sync_client() -> httpx.Client:
+    """ワーカーで共有する httpx.Client を返す"""
+    global _client
+    if _client is None:
+        with _clients_lock:
+            if _client is None:
+                _client = httpx.Client(http2=HTTP2, limits=_LIMITS)
+    return _client
+
+
+def _async_client() -> httpx.AsyncClient:
+    """実行中の event loop で共有する httpx.AsyncClient を返す"""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = _async_clients[loop] = httpx.AsyncClient(http2=HTTP2, limits=_LIMITS)
+    return client
+
+
+def _record(host: str, **counts: int) -> None:
+    """ホストごとの統計に加算する
+
+    Parameters
+    ----------
+    host
+        ホスト名
+    counts
+        項目 -> 加算する数
+    """
+    with _stats_lock:
+        stat = _stats.get(host)
+        if stat is None:
+            stat = _stats[host] = dict.fromkeys(
+                ("requests", "errors", "retries", "connections_opened", "connections_reused", "http2"),
+                0,
+            )
+        for key, n in counts.items():
+            stat[key] += n
+
+
+def _record_response(host: str, opened: bool, response: httpx.Response) -> None:
+    """レスポンスを受け取ったリクエストを統計に記録する
+
+    Parameters
+    ----------
+    host
+        ホスト名
+    opened
+        このリクエストのために新しく接続したか
+    response
+        レスポンス
+    """
+    _record(
+        host,
+        requests=1,
+        connections_opened=int(opened),
+        connections_reused=int(not opened),
+        http2=int(response.http_version == "HTTP/2"),
+    )
+
+
+def _retry_delay(
+    method: str,
+    policy: HostPolicy,
+    attempt: int,
+    error: Exception | None = None,
+    response: httpx.Response | None = None,
+) -> float | None:
+    """リトライするなら待つ秒数を、しないなら None を返す
+
+    Parameters
+    ----------
+    method
+        HTTP メソッド
+    policy
+        ホストの設定
+    attempt
+        何回目の試行か (0 始まり)
+    error
+        試行で起きた例外
+    response
+        試行で受け取ったレスポンス
+    """
+    if attempt >= policy.retries:
+        return None
+    if error is not None:
+        retry = isinstance(error, _NOT_SENT_ERRORS) or (
+            method in _IDEMPOTENT_METHODS and isinstance(error, httpx.TransportError)
+        )
+    else:
+        retry = method in _IDEMPOTENT_METHODS and response.status_code in _RETRY_STATUS
+    return policy.backoff * 2**attempt if retry else None
+
+
+def request(
+    method: str, url: str, retries: int | None = None, **kwargs: Any
+) -> httpx.Response:
+    """共有クライアントでリクエストを送り、レスポンスを返す
+
+    ステータスコードが 4xx / 5xx でも例外にはしない (必要なら raise_for_status を呼ぶ)
+
+    Parameters
+    ----------
+    method
+        HTTP メソッド
+    url
+        URL
+    retries
+        失敗したときに追加で試す回数 (None ならホストの設定を使う。
+        呼び出し側で送り直すなら 0 にして、リトライが重ならないようにする)
+    kwargs
+        httpx.Client.request に渡す引数 (timeout を省略したらホストの設定を使う)
+    """
+    method = method.upper()
+    host = httpx.URL(url).host
+    policy = policy_for(host)
+    if retries is not None:
+        policy = replace(policy, retries=retries)
+    kwargs.setdefault("timeout", policy.timeout)
+    client = _sync_client()
+    attempt = 0
+    while True:
+        opened = False
+
+        def trace(event_name: str, info: dict[str, Any]) -> None:
+            nonlocal opened
+            if event_name == "connection.connect_tcp.complete":
+                opened = True
+
+        try:
+            response = client.request(method, url, extensions={"trace": trace}, **kwargs)
+        except httpx.TransportError as e:
+            _record(host, errors=1, connections_opened=int(opened))
+            delay = _retry_delay(method, policy, attempt, error=e)
+            if delay is None:
+                raise
+        else:
+            _record_response(host, opened, response)
+            delay = _retry_delay(method, policy, attempt, response=response)
+            if delay is None:
+                return response
+            response.close()
+        _record(host, retries=1)
+        time.sleep(delay)
+        attempt += 1
+
+
+async def arequest(
+    method: str, url: str, retries: int | None = None, **kwargs: Any
+) -> httpx.Response:
+    """request の非同期版
+
+    Parameters
+    ----------
+    method
+        HTTP メソッド
+    url
+        URL
+    retries
+        失敗したときに追加で試す回数 (None ならホストの設定を使う。
+        呼び出し側で送り直すなら 0 にして、リトライが重ならないようにする)
+    kwargs
+        httpx.AsyncClient.request に渡す引数 (timeout を省略したらホストの設定を使う)
+    """
+    method = method.upper()
+    host = httpx.URL(url).host
+    policy = policy_for(host)
+    if retries is not None:
+        policy = replace(policy, retries=retries)
+    kwargs.setdefault("timeout", policy.timeout)
+    client = _async_client()
+    attempt = 0
+    while True:
+        opened = False
+
+        async def trace(event_name: str, info: dict[str, Any]) -> None:
+            nonlocal opened
+            if event_name == "connection.connect_tcp.complete":
+                opened = True
+
+        try:
+            response = await client.request(method, url, extensions={"trace": trace}, **kwargs)
+        except httpx.TransportError as e:
+            _record(host, errors=1, connections_opened=int(opened))
+            delay = _retry_delay(method, policy, attempt, error=e)
+            if delay is None:
+                raise
+        else:
+            _record_response(host, opened, response)
+            delay = _retry_delay(method, policy, attempt, response=response)
+            if delay is None:
+                return response
+            await response.aclose()
+        _record(host, retries=1)
+        await asyncio.sleep(delay)
+        attempt += 1
+
+
+def get(url: str, **kwargs: Any) -> httpx.Response:
+    """GET リクエストを送る"""
+    return request("GET", url, **kwargs)
+
+
+def post(url: str, **kwargs: Any) -> httpx.Response:
+    """POST リクエストを送る"""
+    return request("POST", url, **kwargs)
+
+
+async def aget(url: str, **kwargs: Any) -> httpx.Response:
+    """GET リクエストを非同期で送る"""
+    return await arequest("GET", url, **kwargs)
+
+
+async def apost(url: str, **kwargs: Any) -> httpx.Response:
+    """POST リクエストを非同期で送る"""
+    return await arequest("POST", url, **kwargs)
+
+
+def pool_stats() -> dict[str, Any]:
+    """ホストごとのリクエスト数と、新しく開いた接続・再利用した接続の数を返す (ワーカーごと)"""
+    with _stats_lock:
+        hosts = {host: dict(stat) for host, stat in _stats.items()}
+    for stat in hosts.values():
+        connections = stat["connections_opened"] + stat["connections_reused"]
+        stat["reuse_ratio"] = round(stat["connections_reused"] / connections, 3) if connections else 0.0
+    return {"http2_available": HTTP2, "hosts": dict(sorted(hosts.items()))}
+
+
+async def aclose() -> None:
+    """共有クライアントの接続を閉じる (サーバーの終了時に呼ぶ)"""
+    global _client
+    client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+    with _clients_lock:
+        client, _client = _client, None
+    if client is not None:
+        client.close()
@@ -1,12 +1,13 @@
 """Memory tool for Grok agent - 会話ログの検索"""
 
-from typing import Any
+from typing import Any, Callable
 
 from pydantic import BaseModel, Field
 from xai_sdk.chat import tool
 from xai_sdk.proto import chat_pb2
 
 import eliza.memory
+import eliza.retrieval
 
 
 class MemoryGrepParams(BaseModel):
@@ -14,6 +15,11 @@ class MemoryGrepParams(BaseModel):
     limit: int = Field(10, description="返す最大件数（デフォルト: 10）")
 
 
+class MemorySearchParams(BaseModel):
+    query: str = Field(description="検索したい内容 (自然文やキーワード)")
+    limit: int = Field(5, description="返す最大件数（デフォルト: 5）")
+
+
 class MemoryTool:
     """過去の会話ログを検索するツール"""
 
@@ -21,11 +27,26 @@ class MemoryTool:
         """正規表現で会話ログを検索する"""
         try:
             results = eliza.memory.grep(pattern, limit)
+            messages = eliza.memory.grep_messages(pattern, limit)
             return {
                 "status": "ok",
                 "pattern": pattern,
                 "count": len(results),
                 "results": results,
+                "messages": messages,
+            }
+        except Exception as e:
+            return {"status": "error", "message": str(e)}
+
+    def search(self, query: str, limit: int = 5) -> dict[str, Any]:
+        """会話ログと日別 summary から関連する記録を BM25 で検索する"""
+        try:
+            results = eliza.retrieval.search(query, top_k=limit)
+            return {
+                "status": "ok",
+                "query": query,
+                "count": len(results),
+                "results": results,
             }
         except Exception as e:
             return {"status": "error", "message": str(e)}
@@ -38,19 +59,30 @@ class MemoryTool:
                 description=(
                     "過去の会話ログを正規表現で検索します。"
                     "「以前〇〇について話したっけ？」「△△を調べたことある？」などに使います。"
-                    "最新の会話から順に最大 limit 件返します。"
+                    "日別の要約 (results) と会話ログ本文 (messages) のそれぞれについて、最新の会話から順に最大 limit 件返します。"
                 ),
                 parameters=MemoryGrepParams.model_json_schema(),
             ),
+            tool(
+                name="memory_search",
+                description=(
+                    "過去の会話ログと日別の要約から、内容が関連する記録を探します。"
+                    "正確な言い回しがわからないときや「あのとき話した〇〇の件」のような曖昧な問い合わせに使います。"
+                    "関連度の高い順に最大 limit 件返します。"
+                ),
+                parameters=MemorySearchParams.model_json_schema(),
+            ),
         ]
 
-    def call(self, tool_name: str, tool_args: dict[str, Any]) -> dict[str, Any]:
-        """Call a memory tool by name"""
-        match tool_name:
-            case "memory_grep":
-                return self.grep(
-                    pattern=tool_args["pattern"],
-                    limit=tool_args.get("limit", 10),
-                )
-            case _:
-                raise ValueError(f"Unknown tool: {tool_name}")
+    def handlers(self) -> dict[str, tuple[type[BaseModel], Callable[[Any], dict[str, Any]]]]:
+        """ツール名 -> (引数のモデル, 検証済みの引数を受け取るハンドラ) を返す"""
+        return {
+            "memory_grep": (
+                MemoryGrepParams,
+                lambda p: self.grep(pattern=p.pattern, limit=p.limit),
+            ),
+            "memory_search": (
+                MemorySearchParams,
+                lambda p: self.search(query=p.query, limit=p.limit),
+            ),
+        }
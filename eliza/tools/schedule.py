@@ -1,21 +1,30 @@
-"""Schedule tool for Grok agent - schedule tool calls for future execution"""
+"""Schedule tool for Grok agent - schedule tool calls for future execution
+
+タスクは .memory/schedule.sqlite に保存するので、どのワーカーで登録してもリーダーのワーカーが実行する
+"""
 
 import asyncio
+import json
 import logging
+import sqlite3
 import uuid
 from datetime import datetime, timedelta
-from typing import Any
+from pathlib import Path
+from typing import Any, Callable
 from zoneinfo import ZoneInfo
 
 from pydantic import BaseModel, Field
 from xai_sdk.chat import tool
 from xai_sdk.proto import chat_pb2
 
+import eliza.memory
 import eliza.tools
+import eliza.tools.effects
 
 logger = logging.getLogger(__name__)
 JST = ZoneInfo("Asia/Tokyo")
 
+SCHEDULE_DB = Path(".memory") / "schedule.sqlite"
 _RUNNER_INTERVAL_SECONDS = 5
 
 
@@ -26,10 +35,103 @@ class ScheduledTask(BaseModel):
     tool_name: str
     tool_args: dict[str, Any]
     execute_at: datetime
+    user_id: str = eliza.memory.DEFAULT_USER
     status: str = "pending"
 
 
-_scheduled_tasks: list[ScheduledTask] = []
+def _connect() -> sqlite3.Connection:
+    """スケジュール DB に接続し、テーブルが未作成なら作成する"""
+    SCHEDULE_DB.parent.mkdir(exist_ok=True)
+    conn = sqlite3.connect(SCHEDULE_DB, timeout=5)
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS scheduled_tasks (
+            task_id       TEXT PRIMARY KEY,
+            tool_name     TEXT NOT NULL,
+            tool_args     TEXT NOT NULL,
+            execute_at    TEXT NOT NULL,
+            execute_at_ts REAL NOT NULL,
+            user_id       TEXT NOT NULL,
+            status        TEXT NOT NULL DEFAULT 'pending'
+        )
+        """
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS scheduled_tasks_due ON scheduled_tasks (status, execute_at_ts)"
+    )
+    return conn
+
+
+def _claim_due_tasks(now: datetime) -> list[ScheduledTask]:
+    """実行時刻を過ぎた pending のタスクを running にして返す
+
+    他のワーカーが先に running にしたタスクは返さない
+
+    Parameters
+    ----------
+    now
+        現在時刻
+    """
+    conn = _connect()
+    try:
+        rows = conn.execute(
+            "SELECT task_id, tool_name, tool_args, execute_at, user_id FROM scheduled_tasks WHERE status = 'pending' AND execute_at_ts <= ? ORDER BY execute_at_ts ASC",
+            (now.timestamp(),),
+        ).fetchall()
+        claimed = []
+        for task_id, tool_name, tool_args, execute_at, user_id in rows:
+            cur = conn.execute(
+                "UPDATE scheduled_tasks SET status = 'running' WHERE task_id = ? AND status = 'pending'",
+                (task_id,),
+            )
+            if cur.rowcount:
+                claimed.append(
+                    ScheduledTask(
+                        task_id=task_id,
+                        tool_name=tool_name,
+                        tool_args=json.loads(tool_args),
+                        execute_at=datetime.fromisoformat(execute_at),
+                        user_id=user_id,
+                        status="running",
+                    )
+                )
+        conn.commit()
+        return claimed
+    finally:
+        conn.close()
+
+
+def _remove_task(task_id: str) -> None:
+    """実行済みのタスクを削除する
+
+    Parameters
+    ----------
+    task_id
+        タスク ID
+    """
+    conn = _connect()
+    try:
+        conn.execute("DELETE FROM scheduled_tasks WHERE task_id = ?", (task_id,))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _execute(task: ScheduledTask) -> dict[str, Any]:
+    """登録したユーザーのコンテキストでタスクのツールを実行する
+
+    クリップボード・ブラウザの副作用はバックグラウンドで実行されるので、
+    完了を待って pending を結果に置き換えてから返す
+
+    Parameters
+    ----------
+    task
+        実行するタスク
+    """
+    with eliza.memory.use_user(task.user_id):
+        result = eliza.tools.call(task.tool_name, task.tool_args)
+    eliza.tools.effects.settle([({"name": task.tool_name, "args": task.tool_args}, result)])
+    return result
 
 
 class ScheduleToolCallParams(BaseModel):
@@ -115,8 +217,25 @@ class Schedule:
             tool_name=tool_name,
             tool_args=tool_args,
             execute_at=execute_at,
+            user_id=eliza.memory.current_user(),
         )
-        _scheduled_tasks.append(task)
+        conn = _connect()
+        try:
+            conn.execute(
+                "INSERT INTO scheduled_tasks (task_id, tool_name, tool_args, execute_at, execute_at_ts, user_id, status) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    task.task_id,
+                    task.tool_name,
+                    json.dumps(task.tool_args, ensure_ascii=False),
+                    task.execute_at.isoformat(),
+                    task.execute_at.timestamp(),
+                    task.user_id,
+                    task.status,
+                ),
+            )
+            conn.commit()
+        finally:
+            conn.close()
         logger.info(
             f"[SCHEDULE] Registered: {task.task_id} -> {tool_name}({tool_args}) at {execute_at.isoformat()}"
         )
@@ -149,46 +268,40 @@ class Schedule:
             ),
         ]
 
-    def call(self, tool_name: str, tool_args: dict[str, Any]) -> dict[str, Any]:
-        """Call a schedule tool by name"""
-        match tool_name:
-            case "schedule_tool_call":
-                return self.schedule_tool_call(
-                    tool_name=tool_args["tool_name"],
-                    tool_args=tool_args.get("tool_args", {}),
-                    execute_at=tool_args["execute_at"],
-                )
-            case "schedule_tool_call_after_minutes":
-                return self.schedule_tool_call_after_minutes(
-                    tool_name=tool_args["tool_name"],
-                    tool_args=tool_args.get("tool_args", {}),
-                    minutes=tool_args["minutes"],
-                )
-            case _:
-                raise ValueError(f"Unknown tool: {tool_name}")
+    def handlers(self) -> dict[str, tuple[type[BaseModel], Callable[[Any], dict[str, Any]]]]:
+        """ツール名 -> (引数のモデル, 検証済みの引数を受け取るハンドラ) を返す"""
+        return {
+            "schedule_tool_call": (
+                ScheduleToolCallParams,
+                lambda p: self.schedule_tool_call(
+                    tool_name=p.tool_name, tool_args=p.tool_args, execute_at=p.execute_at
+                ),
+            ),
+            "schedule_tool_call_after_minutes": (
+                ScheduleToolCallAfterMinutesParams,
+                lambda p: self.schedule_tool_call_after_minutes(
+                    tool_name=p.tool_name, tool_args=p.tool_args, minutes=p.minutes
+                ),
+            ),
+        }
 
 
 async def run_scheduled_tasks_loop():
-    """スケジュールされたタスクを定期的にチェックし実行するバックグラウンドループ"""
+    """スケジュールされたタスクを定期的にチェックし実行するバックグラウンドループ
+
+    リーダーのワーカーでだけ動かす (eliza.leader.run_while_leader)
+    """
     while True:
         await asyncio.sleep(_RUNNER_INTERVAL_SECONDS)
-        now = datetime.now(JST)
-        due_tasks = [
-            t for t in _scheduled_tasks if t.status == "pending" and t.execute_at <= now
-        ]
+        due_tasks = await asyncio.to_thread(_claim_due_tasks, datetime.now(JST))
         for task in due_tasks:
-            task.status = "running"
             logger.info(
                 f"[SCHEDULE] Executing: {task.task_id} -> {task.tool_name}({task.tool_args})"
             )
             try:
-                result = await asyncio.to_thread(
-                    eliza.tools.call, task.tool_name, task.tool_args
-                )
-                task.status = "done"
+                result = await asyncio.to_thread(_execute, task)
                 logger.info(f"[SCHEDULE] Done: {task.task_id} -> {result}")
             except Exception as e:
-                task.status = "error"
                 logger.error(f"[SCHEDULE] Error: {task.task_id} -> {e}")
-        # 完了・エラーのタスクをリストから除去
-        _scheduled_tasks[:] = [t for t in _scheduled_tasks if t.status == "pending"]
+            # 完了・エラーのタスクは削除する
+            await asyncio.to_thread(_remove_task, task.task_id)
@@ -2,9 +2,9 @@
 
 import os
 from pathlib import Path
-from typing import Any
+from typing import Any, Callable
 
-from cachetools import TTLCache, cached
+from cachetools import LRUCache, cached
 from jinja2 import Template
 from pydantic import BaseModel, Field
 from xai_sdk.chat import tool
@@ -34,11 +34,27 @@ class SkillDef:
 
 
 _DEEP_ONLY_SKILLS = {"deep_research"}
-_CACHE_TTL = 30.0
 
 
-@cached(cache=TTLCache(maxsize=4, ttl=_CACHE_TTL))
-def _load_skills(deep: bool = False, interact: bool = False) -> list[SkillDef]:
+def skills_token() -> tuple:
+    """スキル定義の変更検知用トークン (.md ファイルごとの名前・更新時刻・サイズ) を返す
+
+    ファイルを読まずに stat だけで求める
+    """
+    if not SKILL_DIR.exists():
+        return ()
+    token = []
+    for md_file in sorted(SKILL_DIR.glob("*.md")):
+        try:
+            st = md_file.stat()
+        except FileNotFoundError:
+            continue
+        token.append((md_file.name, st.st_mtime_ns, st.st_size))
+    return tuple(token)
+
+
+@cached(cache=LRUCache(maxsize=8))
+def _load_skills(deep: bool = False, interact: bool = False, token: tuple = ()) -> list[SkillDef]:
     """SKILL_DIR 以下の .md ファイルを読み込んでスキル一覧を返す
 
     スキル本文は Jinja2 テンプレートとして interact 変数を渡してレンダリングする
@@ -49,6 +65,8 @@ def _load_skills(deep: bool = False, interact: bool = False) -> list[SkillDef]:
         False のとき deep_research など deep 専用スキルを除外する
     interact
         スキルテンプレートに渡す interact フラグ
+    token
+        skills_token() の値。キャッシュのキーにして、スキルが変わったら読み直す
     """
     skills = []
     if not SKILL_DIR.exists():
@@ -121,11 +139,11 @@ class Skill:
 
     def skills(self) -> list[SkillDef]:
         """利用可能なスキル一覧を返す"""
-        return _load_skills(deep=self.deep, interact=self.interact)
+        return _load_skills(deep=self.deep, interact=self.interact, token=skills_token())
 
     def skill_use(self, skill_name: str) -> dict[str, Any]:
         """スキルの instruction を返す"""
-        skills = _load_skills(deep=self.deep, interact=self.interact)
+        skills = self.skills()
         for skill in skills:
             if skill.name == skill_name:
                 return {
@@ -137,7 +155,7 @@ class Skill:
 
     def create_tools(self) -> list[chat_pb2.Tool]:
         """skill_use ツールを返す"""
-        skills = _load_skills(deep=self.deep, interact=self.interact)
+        skills = self.skills()
         if not skills:
             return []
         skill_list = "\n".join(f"- {s.name}" for s in skills)
@@ -157,10 +175,8 @@ class Skill:
             ),
         ]
 
-    def call(self, tool_name: str, tool_args: dict[str, Any]) -> dict[str, Any]:
-        """Call a skill tool by name"""
-        match tool_name:
-            case "skill_use":
-                return self.skill_use(skill_name=tool_args["skill_name"])
-            case _:
-                raise ValueError(f"Unknown tool: {tool_name}")
+    def handlers(self) -> dict[str, tuple[type[BaseModel], Callable[[Any], dict[str, Any]]]]:
+        """ツール名 -> (引数のモデル, 検証済みの引数を受け取るハンドラ) を返す"""
+        return {
+            "skill_use": (SkillUseParams, lambda p: self.skill_use(skill_name=p.skill_name)),
+        }
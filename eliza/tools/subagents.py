@@ -3,7 +3,7 @@
 import os
 import subprocess
 from dataclasses import dataclass
-from typing import Any
+from typing import Any, Callable
 
 import xai_sdk
 import xai_sdk.chat
@@ -128,10 +128,8 @@ class SubAgents:
             ),
         ]
 
-    def call(self, tool_name: str, tool_args: dict[str, Any]) -> dict[str, Any]:
-        """Call a sub-agents tool by name"""
-        match tool_name:
-            case "subagents_ask":
-                return self.ask(**tool_args)
-            case _:
-                raise ValueError(f"Unknown tool: {tool_name}")
+    def handlers(self) -> dict[str, tuple[type[BaseModel], Callable[[Any], dict[str, Any]]]]:
+        """ツール名 -> (引数のモデル, 検証済みの引数を受け取るハンドラ) を返す"""
+        return {
+            "subagents_ask": (SubAgentsAskParams, lambda p: self.ask(question=p.question)),
+        }
@@ -1,67 +1,307 @@
 """Switchbot API tool for Grok agent"""
 
+import asyncio
 import base64
 import hashlib
 import hmac
+import json
+import logging
 import os
+import sqlite3
+import threading
 import time
 import uuid
-from typing import Any, Literal
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Literal
 
-import requests
+import httpx
 from pydantic import BaseModel, Field
 from xai_sdk.chat import tool
 from xai_sdk.proto import chat_pb2
 
+from . import http_client
+
+logger = logging.getLogger(__name__)
+
 
 class SwitchbotEmptyParams(BaseModel):
     pass
 
 
+class SwitchbotSensorParams(BaseModel):
+    max_age_seconds: int | None = Field(
+        None,
+        description=(
+            "この秒数より古い計測値なら API から取り直す (省略時は数分前までの計測値をそのまま使う)。"
+            "ユーザーが「今の」温度を正確に知りたがっているときだけ小さい値 (例: 60) を指定する"
+        ),
+    )
+
+
 class SwitchbotAirconOnParams(BaseModel):
     mode: Literal["heat", "cool", "fan"] = Field(
         description="エアコンのモード: heat=暖房, cool=冷房, fan=送風"
     )
 
 
-class Switchbot:
-    """Switchbot API クライアント"""
+AIRCON_DEVICE_ID = "02-202010092320-98867876"
+# ライトのデバイス ID (明るさの指定は暗い寝室用のライトから順に並べる)
+LIGHT_DEVICE_IDS = (
+    "6055F92DD962",
+    "6055F922E062",
+    "6055F9236AAE",
+    "6055F92C65B2",
+    "68B6B3B2CCE6",
+    "6055F933FCBA",
+    "6055F936FA16",
+    "68B6B3AFEAFE",
+    "686725B28D1A",
+)
 
-    def _auth(self):
-        """認証ヘッダーを生成"""
-        token = os.environ.get("SWITCHBOT_API_TOKEN")
-        assert token, "SWITCHBOT_API_TOKEN is not set"
-        secret = os.environ.get("SWITCHBOT_API_SECRET")
-        assert secret, "SWITCHBOT_API_SECRET is not set"
-        nonce = uuid.uuid4()
-        t = int(round(time.time() * 1000))
-        string_to_sign = bytes(f"{token}{t}{nonce}", "utf-8")
-        key = bytes(secret, "utf-8")
-        sign = base64.b64encode(
-            hmac.new(key, msg=string_to_sign, digestmod=hashlib.sha256).digest()
+
+def _set_all(parameter: str) -> dict[str, Any]:
+    """エアコンの setAll コマンド (温度,モード,風量,on/off)"""
+    return {"commandType": "command", "command": "setAll", "parameter": parameter}
+
+
+def _set_brightness(brightness: int) -> dict[str, Any]:
+    """ライトの setBrightness コマンド"""
+    return {"commandType": "command", "command": "setBrightness", "parameter": brightness}
+
+
+# シーン名 -> {"description", "commands": [(device_id, command)]}
+SCENES: dict[str, dict[str, Any]] = {
+    "aircon_off": {
+        "description": "Aircon off",
+        "commands": [(AIRCON_DEVICE_ID, _set_all("26,1,3,off"))],
+    },
+    "aircon_heat": {
+        "description": "Aircon on (heat)",
+        "commands": [(AIRCON_DEVICE_ID, _set_all("26,5,1,on"))],
+    },
+    "aircon_cool": {
+        "description": "Aircon on (cool)",
+        # 実際は除湿
+        "commands": [(AIRCON_DEVICE_ID, _set_all("24,3,1,on"))],
+    },
+    "aircon_fan": {
+        "description": "Aircon on (fan)",
+        "commands": [(AIRCON_DEVICE_ID, _set_all("25,4,3,on"))],
+    },
+    "light_off": {
+        "description": "All lights off",
+        "commands": [
+            (device_id, _set_brightness(brightness))
+            for device_id, brightness in zip(LIGHT_DEVICE_IDS, (0, 0, 0, 0, 0, 1, 1, 1, 30))
+        ],
+    },
+    "light_on": {
+        "description": "All lights on",
+        "commands": [
+            (device_id, _set_brightness(brightness))
+            for device_id, brightness in zip(LIGHT_DEVICE_IDS, (0, 0, 0, 0, 0, 50, 50, 50, 60))
+        ],
+    },
+}
+
+# シーンのコマンドを同時に送る数
+SCENE_PARALLELISM = int(os.environ.get("SWITCHBOT_SCENE_PARALLELISM", "4"))
+# コマンドを送り始める間隔の最小値 (秒)。同時に送っても API に一度に集中しないようにする
+SCENE_INTERVAL_SECONDS = float(os.environ.get("SWITCHBOT_SCENE_INTERVAL_SECONDS", "0.1"))
+# 失敗したデバイスに送り直す回数
+SCENE_RETRIES = int(os.environ.get("SWITCHBOT_SCENE_RETRIES", "2"))
+_RETRY_BACKOFF_SECONDS = 0.5
+# 送り直しても結果が変わらない statusCode (デバイスの種類の誤り / デバイスがない / 未対応のコマンド)
+_PERMANENT_ERRORS = frozenset({151, 152, 160})
+
+_scene_pool = ThreadPoolExecutor(max_workers=SCENE_PARALLELISM, thread_name_prefix="switchbot-scene")
+_pace_lock = threading.Lock()
+_next_start = 0.0
+
+
+def _pace() -> None:
+    """前のコマンドから SCENE_INTERVAL_SECONDS 経つまで待つ (ワーカー内の全スレッドで共有)"""
+    global _next_start
+    with _pace_lock:
+        now = time.monotonic()
+        wait = _next_start - now
+        _next_start = max(now, _next_start) + SCENE_INTERVAL_SECONDS
+    if wait > 0:
+        time.sleep(wait)
+
+
+# センサー名 -> デバイス ID
+SENSOR_DEVICE_IDS = {"room": "D641FC309593", "outside": "F5BD2BF834BF"}
+# バックグラウンドでセンサーを読み直す間隔 (秒)
+# 読み直すのはリーダーの1ワーカーだけなので、既定の 300 秒ならワーカー数によらず
+# センサー2台で 1 日 576 回 (API の上限は 1 日 10,000 回)
+SENSOR_POLL_SECONDS = float(os.environ.get("SWITCHBOT_SENSOR_POLL_SECONDS", "300"))
+# ツールの呼び出しで max_age_seconds が省略されたときに許す計測値の古さ (秒)
+SENSOR_MAX_AGE_SECONDS = float(os.environ.get("SWITCHBOT_SENSOR_MAX_AGE_SECONDS", "600"))
+# ワーカー間で共有する計測値のキャッシュ
+SENSOR_DB = Path(".memory") / "switchbot.sqlite"
+
+# device_id -> (読んだ時刻 (UNIX 秒), API のレスポンス)
+_sensor_readings: dict[str, tuple[float, dict[str, Any]]] = {}
+_sensor_lock = threading.Lock()
+
+
+def _connect_sensor_db() -> sqlite3.Connection:
+    """計測値のキャッシュの DB に接続し、テーブルが未作成なら作成する"""
+    SENSOR_DB.parent.mkdir(exist_ok=True)
+    conn = sqlite3.connect(SENSOR_DB, timeout=5, isolation_level=None)
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS sensors (
+            device_id TEXT PRIMARY KEY,
+            read_at   REAL NOT NULL,
+            data      TEXT NOT NULL
         )
-        self.headers = {
+        """
+    )
+    return conn
+
+
+def _store_reading(device_id: str, read_at: float, response: dict[str, Any]) -> None:
+    """計測値をプロセス内とディスクのキャッシュに書く
+
+    Parameters
+    ----------
+    device_id
+        デバイス ID
+    read_at
+        読んだ時刻 (UNIX 秒)
+    response
+        API のレスポンス
+    """
+    with _sensor_lock:
+        _sensor_readings[device_id] = (read_at, response)
+    conn = _connect_sensor_db()
+    try:
+        conn.execute(
+            "INSERT OR REPLACE INTO sensors (device_id, read_at, data) VALUES (?, ?, ?)",
+            (device_id, read_at, json.dumps(response, ensure_ascii=False)),
+        )
+    finally:
+        conn.close()
+
+
+def _load_reading(device_id: str) -> tuple[float, dict[str, Any]] | None:
+    """キャッシュの計測値を返す (プロセス内 -> ディスクの順に新しい方, なければ None)
+
+    Parameters
+    ----------
+    device_id
+        デバイス ID
+    """
+    with _sensor_lock:
+        reading = _sensor_readings.get(device_id)
+    conn = _connect_sensor_db()
+    try:
+        row = conn.execute(
+            "SELECT read_at, data FROM sensors WHERE device_id = ? AND read_at > ?",
+            (device_id, reading[0] if reading else 0.0),
+        ).fetchone()
+    finally:
+        conn.close()
+    if row is None:
+        return reading
+    reading = (row[0], json.loads(row[1]))
+    with _sensor_lock:
+        _sensor_readings[device_id] = reading
+    return reading
+
+
+class SwitchbotSigner:
+    """Switchbot API v1.1 の認証ヘッダーをリクエストごとに作る
+
+    署名は時刻と nonce を含むので使い回せない
+    トークンと HMAC の鍵の準備は1回だけ行い、リクエストごとには t / nonce / sign だけを作る
+    """
+
+    def __init__(self, token: str, secret: str):
+        """署名器を初期化する
+
+        Parameters
+        ----------
+        token
+            Switchbot のトークン
+        secret
+            Switchbot のシークレット
+        """
+        self.token = token
+        self._mac = hmac.new(secret.encode(), digestmod=hashlib.sha256)
+        self._static_headers = {
             "Authorization": token,
             "Content-Type": "application/json",
             "charset": "utf8",
-            "t": str(t),
-            "sign": str(sign, "utf-8"),
-            "nonce": str(nonce),
         }
 
-    def __init__(self):
-        """Switchbot クライアントを初期化して認証する"""
-        self._auth()
+    @classmethod
+    def from_env(cls) -> "SwitchbotSigner":
+        """環境変数 SWITCHBOT_API_TOKEN / SWITCHBOT_API_SECRET から署名器を作る"""
+        token = os.environ.get("SWITCHBOT_API_TOKEN")
+        assert token, "SWITCHBOT_API_TOKEN is not set"
+        secret = os.environ.get("SWITCHBOT_API_SECRET")
+        assert secret, "SWITCHBOT_API_SECRET is not set"
+        return cls(token, secret)
+
+    def headers(self) -> dict[str, str]:
+        """1回のリクエスト用の認証ヘッダーを返す (複数のスレッドから呼んでよい)"""
+        nonce = str(uuid.uuid4())
+        t = str(time.time_ns() // 1_000_000)
+        mac = self._mac.copy()
+        mac.update(f"{self.token}{t}{nonce}".encode())
+        return {
+            **self._static_headers,
+            "t": t,
+            "sign": base64.b64encode(mac.digest()).decode(),
+            "nonce": nonce,
+        }
+
+
+class Switchbot:
+    """Switchbot API クライアント
+
+    認証ヘッダーはリクエストごとに作るので、1つのインスタンスを
+    エージェント・スケジューラー・センサーのポーリングで共有できる (Switchbot.shared)
+    """
+
+    _shared: "Switchbot | None" = None
+
+    def __init__(self, signer: SwitchbotSigner | None = None):
+        """Switchbot クライアントを初期化する
+
+        Parameters
+        ----------
+        signer
+            認証ヘッダーの署名器 (None なら最初のリクエストで環境変数から作る)
+        """
+        self._signer = signer
+
+    @classmethod
+    def shared(cls) -> "Switchbot":
+        """ワーカー内で共有するクライアントを返す"""
+        if cls._shared is None:
+            cls._shared = cls()
+        return cls._shared
+
+    def _auth(self) -> dict[str, str]:
+        """認証ヘッダーを生成する"""
+        if self._signer is None:
+            self._signer = SwitchbotSigner.from_env()
+        return self._signer.headers()
 
     def get(self, uri: str):
         """GET リクエスト"""
         url = f"https://api.switch-bot.com{uri}"
-        return requests.get(url, headers=self.headers).json()
+        return http_client.get(url, headers=self._auth()).json()
 
-    def post(self, uri: str, data: dict[str, Any]):
-        """POST リクエスト"""
+    def post(self, uri: str, data: dict[str, Any], retries: int | None = None):
+        """POST リクエスト (retries を省略したら http_client のホストの設定でリトライする)"""
         url = f"https://api.switch-bot.com{uri}"
-        return requests.post(url, json=data, headers=self.headers).json()
+        return http_client.post(url, json=data, headers=self._auth(), retries=retries).json()
 
     def get_devices(self) -> dict[str, Any]:
         """デバイス一覧を取得"""
@@ -71,29 +311,130 @@ class Switchbot:
         """デバイスのステータスを取得"""
         return self.get(f"/v1.1/devices/{device_id}/status")
 
-    def send_command(self, device_id: str, command: dict[str, Any]) -> dict[str, Any]:
+    def send_command(
+        self, device_id: str, command: dict[str, Any], retries: int | None = None
+    ) -> dict[str, Any]:
         """デバイスにコマンドを送信"""
-        return self.post(f"/v1.1/devices/{device_id}/commands", command)
+        return self.post(f"/v1.1/devices/{device_id}/commands", command, retries=retries)
 
-    def get_room_temperature(self) -> dict[str, Any]:
+    def refresh_sensor(self, device_id: str) -> dict[str, Any]:
+        """センサーのステータスを API から読み、成功したらキャッシュして返す
+
+        Parameters
+        ----------
+        device_id
+            デバイス ID
+        """
+        response = self.get_status(device_id)
+        if response.get("statusCode") == 100:
+            _store_reading(device_id, time.time(), response)
+        return response
+
+    def read_sensor(self, device_id: str, max_age_seconds: float | None = None) -> dict[str, Any]:
+        """センサーのステータスを返す
+
+        キャッシュ (リーダーのワーカーが読んでおいたもの) の計測値が max_age_seconds 以内ならそれを、
+        古ければ API から読み直したものを返す
+        どちらの場合も計測値の古さ (age_seconds) と、キャッシュから返したか (cached) を付ける
+
+        Parameters
+        ----------
+        device_id
+            デバイス ID
+        max_age_seconds
+            許す計測値の古さ (秒, None なら SENSOR_MAX_AGE_SECONDS)
+        """
+        if max_age_seconds is None:
+            max_age_seconds = SENSOR_MAX_AGE_SECONDS
+        reading = _load_reading(device_id)
+        if reading is not None:
+            age = time.time() - reading[0]
+            if age <= max_age_seconds:
+                return {**reading[1], "cached": True, "age_seconds": int(age)}
+        return {**self.refresh_sensor(device_id), "cached": False, "age_seconds": 0}
+
+    def get_room_temperature(self, max_age_seconds: float | None = None) -> dict[str, Any]:
         """部屋の温度と湿度を取得"""
-        device_id = "D641FC309593"
-        return self.get_status(device_id)
+        return self.read_sensor(SENSOR_DEVICE_IDS["room"], max_age_seconds)
 
-    def get_outside_temperature(self) -> dict[str, Any]:
+    def get_outside_temperature(self, max_age_seconds: float | None = None) -> dict[str, Any]:
         """家のすぐ外の温度と湿度を取得"""
-        device_id = "F5BD2BF834BF"
-        return self.get_status(device_id)
+        return self.read_sensor(SENSOR_DEVICE_IDS["outside"], max_age_seconds)
+
+    def _send_with_retry(self, device_id: str, command: dict[str, Any]) -> dict[str, Any]:
+        """コマンドを送り、失敗したら SCENE_RETRIES 回までリトライしてデバイスごとの結果を返す
+
+        リトライはここでだけ行う (http_client のホストごとのリトライは重ねない)
+
+        Parameters
+        ----------
+        device_id
+            デバイス ID
+        command
+            送るコマンド (setAll / setBrightness はどれも何度送っても同じ状態になる)
+        """
+        start = time.perf_counter()
+        attempt = 0
+        while True:
+            attempt += 1
+            _pace()
+            try:
+                response = self.send_command(device_id, command, retries=0)
+            except (httpx.HTTPError, ValueError) as e:
+                error, retry = f"{type(e).__name__}: {e}", True
+            else:
+                code = response.get("statusCode")
+                if code == 100:
+                    return {
+                        "device_id": device_id,
+                        "status": "ok",
+                        "attempts": attempt,
+                        "elapsed_ms": int((time.perf_counter() - start) * 1000),
+                    }
+                error = f"statusCode {code}: {response.get('message')}"
+                retry = code not in _PERMANENT_ERRORS
+            if not retry or attempt > SCENE_RETRIES:
+                return {
+                    "device_id": device_id,
+                    "status": "error",
+                    "attempts": attempt,
+                    "elapsed_ms": int((time.perf_counter() - start) * 1000),
+                    "error": error,
+                }
+            time.sleep(_RETRY_BACKOFF_SECONDS * attempt)
+
+    def run_scene(self, name: str) -> dict[str, Any]:
+        """シーンのコマンドを SCENE_PARALLELISM 台ずつ並行に送り、デバイスごとの結果を返す
+
+        Parameters
+        ----------
+        name
+            SCENES のシーン名
+        """
+        scene = SCENES[name]
+        start = time.perf_counter()
+        devices = list(
+            _scene_pool.map(lambda step: self._send_with_retry(*step), scene["commands"])
+        )
+        failed = sum(d["status"] != "ok" for d in devices)
+        if failed == 0:
+            status = "Accepted"
+        elif failed < len(devices):
+            status = "PartiallyAccepted"
+        else:
+            status = "Failed"
+        return {
+            "status": status,
+            "result": scene["description"],
+            "scene": name,
+            "failed": failed,
+            "devices": devices,
+            "elapsed_ms": int((time.perf_counter() - start) * 1000),
+        }
 
     def post_aircon_off(self) -> dict[str, Any]:
         """エアコンを消すコマンドを送信"""
-        device_id = "02-202010092320-98867876"
-        command = {
-            "commandType": "command",
-            "command": "setAll",
-            "parameter": "26,1,3,off",
-        }
-        return self.send_command(device_id, command)
+        return self.run_scene("aircon_off")
 
     def post_aircon_on(self, mode: str) -> dict[str, Any]:
         """エアコンをつけるコマンドを送信する
@@ -103,83 +444,35 @@ class Switchbot:
         mode
             "heat" -> 暖房 (26C, fan=auto) / "cool" -> 冷房 (24C, fan=auto) / "fan" -> 送風 (25C)
         """
-        device_id = "02-202010092320-98867876"
-        if mode == "cool":
-            parameter = "24,3,1,on"  # 実際は除湿
-        elif mode == "fan":
-            parameter = "25,4,3,on"
-        else:
-            parameter = "26,5,1,on"
-        command = {
-            "commandType": "command",
-            "command": "setAll",
-            "parameter": parameter,
-        }
-        return self.send_command(device_id, command)
+        return self.run_scene(f"aircon_{mode}" if mode in ("cool", "fan") else "aircon_heat")
 
     def post_light_off(self) -> dict[str, Any]:
         """家の中の全てのライトを消す
 
         寝る前に使う
         """
-        # (device_id, brightness)
-        devices = [
-            ("6055F92DD962", 0),
-            ("6055F922E062", 0),
-            ("6055F9236AAE", 0),
-            ("6055F92C65B2", 0),
-            ("68B6B3B2CCE6", 0),
-            ("6055F933FCBA", 1),
-            ("6055F936FA16", 1),
-            ("68B6B3AFEAFE", 1),
-            ("686725B28D1A", 30),
-        ]
-        for device_id, brightness in devices:
-            command = {
-                "commandType": "command",
-                "command": "setBrightness",
-                "parameter": brightness,
-            }
-            self.send_command(device_id, command)
-        return {"status": "Accepted", "result": "All lights off"}
+        return self.run_scene("light_off")
 
     def post_light_on(self) -> dict[str, Any]:
         """家の中の全てのライトをつける"""
-        # (device_id, brightness)
-        devices = [
-            ("6055F92DD962", 0),
-            ("6055F922E062", 0),
-            ("6055F9236AAE", 0),
-            ("6055F92C65B2", 0),
-            ("68B6B3B2CCE6", 0),
-            ("6055F933FCBA", 50),
-            ("6055F936FA16", 50),
-            ("68B6B3AFEAFE", 50),
-            ("686725B28D1A", 60),
-        ]
-        for device_id, brightness in devices:
-            command = {
-                "commandType": "command",
-                "command": "setBrightness",
-                "parameter": brightness,
-            }
-            self.send_command(device_id, command)
-        return {"status": "Accepted", "result": "All lights on"}
-
-    def create_tools(self) -> list[chat_pb2.Tool]:
-        """Grok agent 用のツール定義を作成"""
+        return self.run_scene("light_on")
+
+    @staticmethod
+    def create_tools() -> list[chat_pb2.Tool]:
+        """Grok agent 用のツール定義を作成 (認証は不要)"""
         empty = SwitchbotEmptyParams.model_json_schema()
+        sensor = SwitchbotSensorParams.model_json_schema()
 
         return [
             tool(
                 name="switchbot_get_room_temperature",
                 description="部屋の温度と湿度を取得します。室内の現在の気温と湿度を確認したいときに使います。",
-                parameters=empty,
+                parameters=sensor,
             ),
             tool(
                 name="switchbot_get_outside_temperature",
                 description="家のすぐ外の温度と湿度を取得します。外の気温や湿度を確認したいときに使います。",
-                parameters=empty,
+                parameters=sensor,
             ),
             tool(
                 name="switchbot_post_aircon_off",
@@ -206,20 +499,40 @@ class Switchbot:
             ),
         ]
 
-    def call(self, tool_name: str, tool_args: dict[str, Any]) -> dict[str, Any]:
-        """Call a switchbot tool by name"""
-        match tool_name:
-            case "switchbot_get_room_temperature":
-                return self.get_room_temperature()
-            case "switchbot_get_outside_temperature":
-                return self.get_outside_temperature()
-            case "switchbot_post_aircon_off":
-                return self.post_aircon_off()
-            case "switchbot_post_aircon_on":
-                return self.post_aircon_on(mode=tool_args["mode"])
-            case "switchbot_post_light_off":
-                return self.post_light_off()
-            case "switchbot_post_light_on":
-                return self.post_light_on()
-            case _:
-                raise ValueError(f"Unknown tool: {tool_name}")
+    def handlers(self) -> dict[str, tuple[type[BaseModel], Callable[[Any], dict[str, Any]]]]:
+        """ツール名 -> (引数のモデル, 検証済みの引数を受け取るハンドラ) を返す"""
+        return {
+            "switchbot_get_room_temperature": (
+                SwitchbotSensorParams,
+                lambda p: self.get_room_temperature(p.max_age_seconds),
+            ),
+            "switchbot_get_outside_temperature": (
+                SwitchbotSensorParams,
+                lambda p: self.get_outside_temperature(p.max_age_seconds),
+            ),
+            "switchbot_post_aircon_off": (SwitchbotEmptyParams, lambda p: self.post_aircon_off()),
+            "switchbot_post_aircon_on": (
+                SwitchbotAirconOnParams,
+                lambda p: self.post_aircon_on(mode=p.mode),
+            ),
+            "switchbot_post_light_off": (SwitchbotEmptyParams, lambda p: self.post_light_off()),
+            "switchbot_post_light_on": (SwitchbotEmptyParams, lambda p: self.post_light_on()),
+        }
+
+
+async def run_sensor_poller():
+    """SENSOR_POLL_SECONDS ごとにセンサーを読み、キャッシュを新しくしておくバックグラウンドループ
+
+    計測値は .memory/switchbot.sqlite でワーカー間で共有するので、
+    リーダーのワーカーでだけ動かす (eliza.leader.run_while_leader)
+    """
+    if not (os.environ.get("SWITCHBOT_API_TOKEN") and os.environ.get("SWITCHBOT_API_SECRET")):
+        return
+    switchbot = Switchbot.shared()
+    while True:
+        for name, device_id in SENSOR_DEVICE_IDS.items():
+            try:
+                await asyncio.to_thread(switchbot.refresh_sensor, device_id)
+            except Exception as e:
+                logger.warning(f"[SWITCHBOT] Failed to refresh {name} sensor: {e}")
+        await asyncio.sleep(SENSOR_POLL_SECONDS)
@@ -1,15 +1,46 @@
-"""Tenki (weather) tool for Grok agent - uses OpenWeatherMap API"""
+"""Tenki (weather) tool for Grok agent - uses OpenWeatherMap API
 
-from typing import Any
+API のレスポンスはメモリの LRU とワーカー間で共有する SQLite (.memory/tenki.sqlite) の2段でキャッシュする
+キーは都市名を正規化したもので、"Tokyo" で引いた結果が "Tokyo,JP" を指すことも覚えておく
+同じ都市への同時の問い合わせは1回のリクエストにまとめる
+"""
 
-import requests
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from itertools import groupby
+from pathlib import Path
+from typing import Any, Callable, Literal
+
+from cachetools import LRUCache
 from pydantic import BaseModel, Field
 from xai_sdk.chat import tool
 from xai_sdk.proto import chat_pb2
 
+from . import coalesce, http_client
+
 APPID = "cc78d27e7519b67719a1121d90e67426"
 BASE_URL = "http://api.openweathermap.org/data/2.5"
 
+CACHE_DB = Path(".memory") / "tenki.sqlite"
+# OpenWeatherMap の現在の天気は10分ほど、予報は3時間ごとに更新される
+CURRENT_TTL_SECONDS = float(os.environ.get("TENKI_CURRENT_TTL_SECONDS", "600"))
+FORECAST_TTL_SECONDS = float(os.environ.get("TENKI_FORECAST_TTL_SECONDS", "1800"))
+# endpoint -> キャッシュの有効秒数
+_TTL = {"weather": CURRENT_TTL_SECONDS, "forecast": FORECAST_TTL_SECONDS}
+# ディスクのキャッシュをこの秒数より古いものから消す
+_DISK_RETENTION_SECONDS = 24 * 60 * 60
+
+# (endpoint, 都市のキー) -> (取得した時刻, レスポンス)
+_memory: LRUCache = LRUCache(maxsize=128)
+# 正規化した問い合わせ -> 都市のキー ("tokyo" -> "tokyo,jp")
+_aliases: dict[str, str] = {}
+_cache_lock = threading.Lock()
+
 
 def _kelvin_to_celsius(k: float) -> float:
     """ケルビンを摂氏に変換する
@@ -22,12 +53,250 @@ def _kelvin_to_celsius(k: float) -> float:
     return round(k - 273.15, 1)
 
 
+def normalize_city(city: str) -> str:
+    """都市名をキャッシュのキーにする ("  Tokyo ,JP" -> "tokyo,jp")
+
+    Parameters
+    ----------
+    city
+        都市名 (カンマ区切りで国コードなどを付けてもよい)
+    """
+    parts = (" ".join(part.split()).casefold() for part in city.split(","))
+    return ",".join(part for part in parts if part)
+
+
+def _city_key(endpoint: str, data: dict[str, Any]) -> str:
+    """レスポンスの都市名と国コードから都市のキーを作る
+
+    Parameters
+    ----------
+    endpoint
+        weather / forecast
+    data
+        API のレスポンス
+    """
+    city = data if endpoint == "weather" else data["city"]
+    country = city["sys"]["country"] if endpoint == "weather" else city["country"]
+    return normalize_city(f"{city['name']},{country}")
+
+
+def _connect() -> sqlite3.Connection:
+    """キャッシュの DB に接続し、テーブルが未作成なら作成する"""
+    CACHE_DB.parent.mkdir(exist_ok=True)
+    conn = sqlite3.connect(CACHE_DB, timeout=5, isolation_level=None)
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS weather (
+            endpoint   TEXT NOT NULL,
+            city_key   TEXT NOT NULL,
+            fetched_at REAL NOT NULL,
+            data       TEXT NOT NULL,
+            PRIMARY KEY (endpoint, city_key)
+        )
+        """
+    )
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS aliases (query TEXT PRIMARY KEY, city_key TEXT NOT NULL)"
+    )
+    return conn
+
+
+def _lookup(endpoint: str, query: str) -> tuple[float, dict[str, Any]] | None:
+    """キャッシュから有効期限内のレスポンスを探す (メモリ -> ディスクの順)
+
+    Parameters
+    ----------
+    endpoint
+        weather / forecast
+    query
+        正規化した問い合わせ
+    """
+    now = time.time()
+    ttl = _TTL[endpoint]
+    with _cache_lock:
+        key = _aliases.get(query, query)
+        hit = _memory.get((endpoint, key))
+    if hit is not None and now - hit[0] < ttl:
+        return hit
+    conn = _connect()
+    try:
+        row = conn.execute(
+            """
+            SELECT city_key, fetched_at, data FROM weather
+            WHERE endpoint = ?
+              AND city_key = COALESCE((SELECT city_key FROM aliases WHERE query = ?), ?)
+            """,
+            (endpoint, query, query),
+        ).fetchone()
+    finally:
+        conn.close()
+    if row is None or now - row[1] >= ttl:
+        return None
+    hit = (row[1], json.loads(row[2]))
+    with _cache_lock:
+        _aliases[query] = row[0]
+        _memory[(endpoint, row[0])] = hit
+    return hit
+
+
+def _store(endpoint: str, query: str, fetched_at: float, data: dict[str, Any]) -> None:
+    """レスポンスをメモリとディスクのキャッシュに入れる
+
+    Parameters
+    ----------
+    endpoint
+        weather / forecast
+    query
+        正規化した問い合わせ
+    fetched_at
+        取得した時刻 (UNIX 秒)
+    data
+        API のレスポンス
+    """
+    key = _city_key(endpoint, data)
+    with _cache_lock:
+        _aliases[query] = key
+        _memory[(endpoint, key)] = (fetched_at, data)
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute(
+            "INSERT OR REPLACE INTO weather (endpoint, city_key, fetched_at, data) VALUES (?, ?, ?, ?)",
+            (endpoint, key, fetched_at, json.dumps(data, ensure_ascii=False)),
+        )
+        conn.execute("INSERT OR REPLACE INTO aliases (query, city_key) VALUES (?, ?)", (query, key))
+        conn.execute(
+            "DELETE FROM weather WHERE fetched_at < ?", (fetched_at - _DISK_RETENTION_SECONDS,)
+        )
+        conn.execute("COMMIT")
+    except BaseException:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+
+def _fetch(endpoint: str, city: str) -> tuple[float, dict[str, Any]]:
+    """OpenWeatherMap のレスポンスを (取得した時刻, レスポンス) で返す
+
+    キャッシュになければ API を呼ぶ
+    同じ都市を同時に問い合わせたら、ワーカーをまたいでも API は1回だけ呼ぶ (eliza.tools.coalesce)
+
+    Parameters
+    ----------
+    endpoint
+        weather / forecast
+    city
+        都市名
+    """
+    query = normalize_city(city)
+
+    def request() -> tuple[float, dict[str, Any]]:
+        fetched_at = time.time()
+        data = http_client.get(f"{BASE_URL}/{endpoint}", params={"q": city, "appid": APPID}).json()
+        # 見つからなかった都市などはキャッシュしない (cod は weather では数値、forecast では文字列)
+        if str(data.get("cod")) == "200":
+            _store(endpoint, query, fetched_at, data)
+        return fetched_at, data
+
+    return coalesce.fetch_once(
+        f"tenki_{endpoint}", query, lambda: _lookup(endpoint, query), request
+    )
+
+
+def _forecast_columns(data: dict[str, Any]) -> dict[str, list]:
+    """予報のリストを列ごとのリストにする (日付は都市の現地時刻)
+
+    Parameters
+    ----------
+    data
+        forecast のレスポンス
+    """
+    offset = data["city"].get("timezone", 0)
+    items = data["list"]
+    return {
+        "dt": [item["dt"] for item in items],
+        "day": [
+            datetime.fromtimestamp(item["dt"] + offset, timezone.utc).strftime("%m-%d")
+            for item in items
+        ],
+        "temp_min": [item["main"].get("temp_min", item["main"]["temp"]) for item in items],
+        "temp_max": [item["main"].get("temp_max", item["main"]["temp"]) for item in items],
+        "weather": [item["weather"][0]["main"] for item in items],
+        "pop": [item.get("pop", 0.0) for item in items],
+    }
+
+
+def _rollup(columns: dict[str, list], indices: list[int]) -> str:
+    """予報の行をまとめて「最低〜最高気温 主な天気 降水確率」の文字列にする
+
+    Parameters
+    ----------
+    columns
+        _forecast_columns の結果
+    indices
+        まとめる行
+    """
+    low = _kelvin_to_celsius(min(columns["temp_min"][i] for i in indices))
+    high = _kelvin_to_celsius(max(columns["temp_max"][i] for i in indices))
+    weather = Counter(columns["weather"][i] for i in indices).most_common(1)[0][0]
+    pop = max(columns["pop"][i] for i in indices)
+    text = f"{low}〜{high}°C  {weather}"
+    return f"{text}  降水確率{round(pop * 100)}%" if pop else text
+
+
+def _daily(columns: dict[str, list]) -> list[str]:
+    """日ごとに最低/最高気温と主な天気をまとめる
+
+    Parameters
+    ----------
+    columns
+        _forecast_columns の結果
+    """
+    return [
+        f"{day}  {_rollup(columns, [i for i, _ in rows])}"
+        for day, rows in groupby(enumerate(columns["day"]), key=lambda row: row[1])
+    ]
+
+
+def _next_hours(columns: dict[str, list], hours: int, now: float) -> list[str]:
+    """これから hours 時間の予報を1行にまとめる
+
+    Parameters
+    ----------
+    columns
+        _forecast_columns の結果
+    hours
+        まとめる時間数
+    now
+        現在時刻 (UNIX 秒)
+    """
+    # 予報の時刻は3時間の枠の始まりなので、今を含む枠から数える
+    indices = [
+        i for i, dt in enumerate(columns["dt"]) if now - 3 * 3600 < dt <= now + hours * 3600
+    ]
+    if not indices:
+        return []
+    return [f"これから{hours}時間  {_rollup(columns, indices)}"]
+
+
 class TenkiCurrentParams(BaseModel):
     city: str = Field(description="都市名 (英語, 例: Tokyo, Osaka, London, New York)")
 
 
 class TenkiForecastParams(BaseModel):
     city: str = Field(description="都市名 (英語, 例: Tokyo, Osaka, London, New York)")
+    resolution: Literal["daily", "hours", "3h"] = Field(
+        "daily",
+        description=(
+            "予報の粒度。daily=日ごとの最低/最高気温と主な天気 (デフォルト), "
+            "hours=これから hours 時間をまとめた1行, 3h=3時間ごとの全ての予報 (時間ごとの変化が必要なときだけ)"
+        ),
+    )
+    hours: int = Field(
+        24, ge=3, le=120, description="resolution=hours のとき、これから何時間分をまとめるか"
+    )
 
 
 class Tenki:
@@ -41,12 +310,7 @@ class Tenki:
         city
             都市名 (例: Tokyo, Osaka, London)
         """
-        resp = requests.get(
-            f"{BASE_URL}/weather",
-            params={"q": city, "appid": APPID},
-            timeout=10,
-        )
-        data = resp.json()
+        fetched_at, data = _fetch("weather", city)
 
         if data.get("cod") == "404":
             return {"error": f"City not found: {city}"}
@@ -70,42 +334,52 @@ class Tenki:
             "humidity": f"{humidity}%",
             "weather": weather_main,
             "description": weather_desc,
+            "age_seconds": int(time.time() - fetched_at),
             "summary": (
                 f"{name},{country}: {temp}°C ({temp_min}/{temp_max}°C), "
                 f"{weather_main} ({weather_desc}), {pressure}hPa, 湿度{humidity}%"
             ),
         }
 
-    def forecast(self, city: str) -> dict[str, Any]:
-        """指定都市の5日間天気予報を取得する (3時間ごと)
+    def forecast(
+        self, city: str, resolution: str = "daily", hours: int = 24
+    ) -> dict[str, Any]:
+        """指定都市の5日間天気予報を取得する
 
         Parameters
         ----------
         city
             都市名 (例: Tokyo, Osaka, London)
+        resolution
+            "daily" -> 日ごとの最低/最高気温と主な天気 / "hours" -> これから hours 時間をまとめた1行 /
+            "3h" -> 3時間ごとの全ての予報
+        hours
+            resolution="hours" のときにまとめる時間数
         """
-        resp = requests.get(
-            f"{BASE_URL}/forecast",
-            params={"q": city, "appid": APPID},
-            timeout=10,
-        )
-        data = resp.json()
+        fetched_at, data = _fetch("forecast", city)
 
         if data.get("cod") == "404":
             return {"error": f"City not found: {city}"}
 
         city_name = f"{data['city']['name']},{data['city']['country']}"
-        entries = []
-        for item in data["list"]:
-            dt_txt = item["dt_txt"]
-            temp = _kelvin_to_celsius(item["main"]["temp"])
-            weather = item["weather"][0]["main"]
-            desc = item["weather"][0]["description"]
-            entries.append(f"{dt_txt[5:16]}  {temp}°C  {weather} ({desc})")
+        if resolution == "3h":
+            entries = []
+            for item in data["list"]:
+                dt_txt = item["dt_txt"]
+                temp = _kelvin_to_celsius(item["main"]["temp"])
+                weather = item["weather"][0]["main"]
+                desc = item["weather"][0]["description"]
+                entries.append(f"{dt_txt[5:16]}  {temp}°C  {weather} ({desc})")
+        elif resolution == "hours":
+            entries = _next_hours(_forecast_columns(data), hours, time.time())
+        else:
+            entries = _daily(_forecast_columns(data))
 
         return {
             "city": city_name,
+            "resolution": resolution,
             "forecast": entries,
+            "age_seconds": int(time.time() - fetched_at),
         }
 
     def create_tools(self) -> list[chat_pb2.Tool]:
@@ -123,20 +397,21 @@ class Tenki:
             tool(
                 name="tenki_forecast",
                 description=(
-                    "指定した都市の5日間天気予報 (3時間ごと) を取得します。"
+                    "指定した都市の5日間天気予報を取得します。"
                     "「今週の天気は？」「明日の天気は？」「天気予報を見せて」などに使います。"
+                    " 通常は resolution を省略 (日ごと) し、「今夜」「この後」など直近だけなら resolution=hours を使ってください。"
                     " city は英語の都市名 (例: Tokyo, Osaka, London) で指定してください。"
                 ),
                 parameters=TenkiForecastParams.model_json_schema(),
             ),
         ]
 
-    def call(self, tool_name: str, tool_args: dict[str, Any]) -> dict[str, Any]:
-        """Call a tenki tool by name"""
-        match tool_name:
-            case "tenki_current":
-                return self.current(city=tool_args["city"])
-            case "tenki_forecast":
-                return self.forecast(city=tool_args["city"])
-            case _:
-                raise ValueError(f"Unknown tool: {tool_name}")
+    def handlers(self) -> dict[str, tuple[type[BaseModel], Callable[[Any], dict[str, Any]]]]:
+        """ツール名 -> (引数のモデル, 検証済みの引数を受け取るハンドラ) を返す"""
+        return {
+            "tenki_current": (TenkiCurrentParams, lambda p: self.current(city=p.city)),
+            "tenki_forecast": (
+                TenkiForecastParams,
+                lambda p: self.forecast(city=p.city, resolution=p.resolution, hours=p.hours),
+            ),
+        }
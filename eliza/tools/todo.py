@@ -3,7 +3,7 @@
 import json
 import os
 from datetime import datetime
-from typing import Any
+from typing import Any, Callable
 
 from pydantic import BaseModel, Field
 from xai_sdk.chat import tool
@@ -140,20 +140,11 @@ class ToDo:
             ),
         ]
 
-    def call(self, tool_name: str, tool_args: dict[str, Any]) -> dict[str, Any]:
-        """Call a todo tool by name"""
-        match tool_name:
-            case "todo_list":
-                return self.list_todos(
-                    include_done=tool_args.get("include_done", False)
-                )
-            case "todo_add":
-                return self.add(
-                    title=tool_args["title"], note=tool_args.get("note", "")
-                )
-            case "todo_done":
-                return self.done(todo_id=tool_args["id"])
-            case "todo_delete":
-                return self.delete(todo_id=tool_args["id"])
-            case _:
-                raise ValueError(f"Unknown tool: {tool_name}")
+    def handlers(self) -> dict[str, tuple[type[BaseModel], Callable[[Any], dict[str, Any]]]]:
+        """ツール名 -> (引数のモデル, 検証済みの引数を受け取るハンドラ) を返す"""
+        return {
+            "todo_list": (TodoListParams, lambda p: self.list_todos(include_done=p.include_done)),
+            "todo_add": (TodoAddParams, lambda p: self.add(title=p.title, note=p.note)),
+            "todo_done": (TodoDoneParams, lambda p: self.done(todo_id=p.id)),
+            "todo_delete": (TodoDeleteParams, lambda p: self.delete(todo_id=p.id)),
+        }
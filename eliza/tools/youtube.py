@@ -1,29 +1,50 @@
 """YouTube search tool for Grok agent - uses YouTube Data API v3"""
 
-import hashlib
+import asyncio
 import json
+import logging
 import os
-import subprocess
+import shutil
+import sqlite3
 import time
 from pathlib import Path
-from typing import Any, Literal
+from typing import Any, Callable, Literal
 
-import httpx
 from pydantic import BaseModel, Field
 from xai_sdk.chat import tool
 from xai_sdk.proto import chat_pb2
 
+from . import coalesce, effects, http_client
+from .browser import open_url
 from .clipboard import Clipboard
 
+logger = logging.getLogger(__name__)
+
 BROWSER_PATH = os.environ.get("BROWSER_PATH")
 
 YOUTUBE_API_KEY = os.getenv("YOUTUBE_API_KEY")
 BASE_URL = "https://www.googleapis.com/youtube/v3"
-CACHE_DIR = Path("/tmp/eliza_youtube_cache")
+CACHE_DB = Path(".memory") / "youtube.sqlite"
+# 以前の1検索1ファイルのキャッシュ (掃除のときに消す)
+LEGACY_CACHE_DIR = Path("/tmp/eliza_youtube_cache")
+# キャッシュに残す検索の数 (超えたら最後に使われたのが古いものから消す)
+CACHE_MAX_ENTRIES = int(os.environ.get("YOUTUBE_CACHE_MAX_ENTRIES", "1000"))
+# 並び順 -> キャッシュの有効秒数 (新着順は早く変わるので短くする)
+ORDER_TTL_SECONDS = {
+    "date": 300,
+    "viewCount": 1800,
+    "rating": 3600,
+    "relevance": 3600,
+    "title": 3600,
+    "videoCount": 3600,
+}
+SWEEP_INTERVAL_SECONDS = 600.0
+# ヒットのたびに last_used_at を書き込まないよう、これより新しければ更新しない
+_TOUCH_INTERVAL_SECONDS = 60.0
 
 
-def _cache_file(keyword: str, order: str) -> Path:
-    """検索キャッシュファイルのパスを返す
+def _cache_key(keyword: str, order: str) -> tuple[str, str]:
+    """検索のキャッシュのキーを返す (キーワードの前後と連続する空白は区別しない)
 
     Parameters
     ----------
@@ -32,21 +53,143 @@ def _cache_file(keyword: str, order: str) -> Path:
     order
         並び順
     """
-    key = hashlib.sha256(f"{keyword}\0{order}".encode()).hexdigest()
-    return CACHE_DIR / f"search_{key}.json"
+    return " ".join(keyword.split()), order
 
 
-def _search(keyword: str, limit: int, order: str) -> list[dict[str, str]]:
-    """YouTube API で検索"""
-    CACHE_DIR.mkdir(exist_ok=True)
-    cache_file = _cache_file(keyword, order)
+def _connect() -> sqlite3.Connection:
+    """キャッシュの DB に接続し、テーブルが未作成なら作成する"""
+    CACHE_DB.parent.mkdir(exist_ok=True)
+    conn = sqlite3.connect(CACHE_DB, timeout=5, isolation_level=None)
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS searches (
+            keyword      TEXT NOT NULL,
+            order_by     TEXT NOT NULL,
+            fetched_at   REAL NOT NULL,
+            last_used_at REAL NOT NULL,
+            results      TEXT NOT NULL,
+            PRIMARY KEY (keyword, order_by)
+        )
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS searches_last_used ON searches (last_used_at)")
+    return conn
+
+
+def _lookup(keyword: str, order: str) -> list[dict[str, str]] | None:
+    """有効期限内のキャッシュされた検索結果を返す (なければ None)
+
+    Parameters
+    ----------
+    keyword
+        正規化したキーワード
+    order
+        並び順
+    """
+    now = time.time()
+    conn = _connect()
+    try:
+        row = conn.execute(
+            "SELECT fetched_at, last_used_at, results FROM searches WHERE keyword = ? AND order_by = ?",
+            (keyword, order),
+        ).fetchone()
+        if row is None or now - row[0] >= ORDER_TTL_SECONDS[order]:
+            return None
+        if now - row[1] >= _TOUCH_INTERVAL_SECONDS:
+            conn.execute(
+                "UPDATE searches SET last_used_at = ? WHERE keyword = ? AND order_by = ?",
+                (now, keyword, order),
+            )
+        return json.loads(row[2])
+    finally:
+        conn.close()
+
+
+def _evict(conn: sqlite3.Connection) -> int:
+    """CACHE_MAX_ENTRIES を超えた分を最後に使われたのが古い順に消し、消した件数を返す
+
+    Parameters
+    ----------
+    conn
+        キャッシュの DB への接続
+    """
+    return conn.execute(
+        """
+        DELETE FROM searches WHERE rowid IN (
+            SELECT rowid FROM searches ORDER BY last_used_at DESC LIMIT -1 OFFSET ?
+        )
+        """,
+        (CACHE_MAX_ENTRIES,),
+    ).rowcount
+
 
-    if cache_file.exists():
-        if time.time() - cache_file.stat().st_mtime < 300:
-            with open(cache_file, encoding="utf-8") as f:
-                return json.load(f)[:limit]
-        cache_file.unlink()
+def _store(keyword: str, order: str, results: list[dict[str, str]]) -> None:
+    """検索結果をキャッシュし、上限を超えた分を消す
 
+    Parameters
+    ----------
+    keyword
+        正規化したキーワード
+    order
+        並び順
+    results
+        検索結果
+    """
+    now = time.time()
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute(
+            "INSERT OR REPLACE INTO searches (keyword, order_by, fetched_at, last_used_at, results) VALUES (?, ?, ?, ?, ?)",
+            (keyword, order, now, now, json.dumps(results, ensure_ascii=False)),
+        )
+        _evict(conn)
+        conn.execute("COMMIT")
+    except BaseException:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+
+def sweep_cache() -> dict[str, int]:
+    """期限切れの検索結果と上限を超えた分を消し、消した件数を返す"""
+    now = time.time()
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        expired = 0
+        for order, ttl in ORDER_TTL_SECONDS.items():
+            expired += conn.execute(
+                "DELETE FROM searches WHERE order_by = ? AND fetched_at < ?", (order, now - ttl)
+            ).rowcount
+        evicted = _evict(conn)
+        conn.execute("COMMIT")
+    except BaseException:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+    shutil.rmtree(LEGACY_CACHE_DIR, ignore_errors=True)
+    return {"expired": expired, "evicted": evicted}
+
+
+async def run_cache_sweeper():
+    """SWEEP_INTERVAL_SECONDS ごとに検索のキャッシュを掃除するバックグラウンドループ
+
+    キャッシュはワーカー間で共有するので、リーダーのワーカーでだけ動かす (eliza.leader.run_while_leader)
+    """
+    while True:
+        result = await asyncio.to_thread(sweep_cache)
+        if result["expired"] or result["evicted"]:
+            logger.info(f"[YOUTUBE] Swept search cache: {result}")
+        await asyncio.sleep(SWEEP_INTERVAL_SECONDS)
+
+
+def _request_search(keyword: str, order: str) -> list[dict[str, str]]:
+    """YouTube API で検索して上位20件を返す"""
     params = {
         "part": "snippet",
         "q": keyword,
@@ -56,10 +199,9 @@ def _search(keyword: str, limit: int, order: str) -> list[dict[str, str]]:
         "key": YOUTUBE_API_KEY,
         "safeSearch": "none",
     }
-    with httpx.Client() as client:
-        response = client.get(f"{BASE_URL}/search", params=params, timeout=10)
-        response.raise_for_status()
-        data = response.json()
+    response = http_client.get(f"{BASE_URL}/search", params=params)
+    response.raise_for_status()
+    data = response.json()
 
     results = []
     for item in data.get("items", []):
@@ -75,10 +217,24 @@ def _search(keyword: str, limit: int, order: str) -> list[dict[str, str]]:
                 "published_at": snippet["publishedAt"][:10],
             }
         )
+    return results
+
+
+def _search(keyword: str, limit: int, order: str) -> list[dict[str, str]]:
+    """YouTube API で検索 (キャッシュがあればそれを使う)
 
-    with open(cache_file, "w", encoding="utf-8") as f:
-        json.dump(results, f, ensure_ascii=False, indent=2)
+    同じキーワード・並び順の検索が同時に来たら、ワーカーをまたいでも API は1回だけ呼ぶ (eliza.tools.coalesce)
+    """
+    key = _cache_key(keyword, order)
+
+    def request() -> list[dict[str, str]]:
+        results = _request_search(key[0], order)
+        _store(*key, results)
+        return results
 
+    results = coalesce.fetch_once(
+        f"youtube_search:{order}", key[0], lambda: _lookup(*key), request
+    )
     return results[:limit]
 
 
@@ -127,21 +283,24 @@ class YouTubeSearch:
 
         limit = min(limit, 10)
         results = _search(keyword, limit, order)
-        if results:
-            Clipboard().copy(results[0]["url"])
 
         ret: dict[str, Any] = {
             "keyword": keyword,
             "count": len(results),
             "results": results,
         }
+        if not results:
+            return ret
 
-        if browser_open and results:
+        # コピーとブラウザの起動は完了を待たずに返す (結果は tool_history の effects に入る)
+        url = results[0]["url"]
+        ret["effects"] = [Clipboard().copy_in_background(url)["effects"][0]]
+        if browser_open:
             if not BROWSER_PATH:
                 ret["browser_error"] = "環境変数 BROWSER_PATH が設定されていません"
             else:
-                subprocess.Popen([BROWSER_PATH, results[0]["url"]])
-                ret["browser_opened"] = results[0]["url"]
+                ret["effects"].append(effects.submit("browser_open", lambda: open_url(url)))
+                ret["browser_opened"] = url
 
         return ret
 
@@ -161,15 +320,16 @@ class YouTubeSearch:
             ),
         ]
 
-    def call(self, tool_name: str, tool_args: dict[str, Any]) -> dict[str, Any]:
-        """Call a youtube tool by name"""
-        match tool_name:
-            case "youtube_search":
-                return self.search(
-                    keyword=tool_args["keyword"],
-                    limit=tool_args.get("limit", 5),
-                    order=tool_args.get("order", "relevance"),
-                    browser_open=tool_args.get("browser_open", False),
-                )
-            case _:
-                raise ValueError(f"Unknown tool: {tool_name}")
+    def handlers(self) -> dict[str, tuple[type[BaseModel], Callable[[Any], dict[str, Any]]]]:
+        """ツール名 -> (引数のモデル, 検証済みの引数を受け取るハンドラ) を返す"""
+        return {
+            "youtube_search": (
+                YouTubeSearchParams,
+                lambda p: self.search(
+                    keyword=p.keyword,
+                    limit=p.limit,
+                    order=p.order,
+                    browser_open=p.browser_open,
+                ),
+            ),
+        }
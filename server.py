@@ -1,22 +1,36 @@
 import asyncio
-import hashlib
 import json
 import logging
 import os
 import signal
 import sys
 import time
+import uuid
 from contextlib import asynccontextmanager
-from datetime import datetime
+from datetime import date, datetime
 from typing import Any
 from zoneinfo import ZoneInfo
 
 import uvicorn
-from fastapi import BackgroundTasks, Depends, FastAPI, HTTPException, Security
+from fastapi import (
+    Depends,
+    FastAPI,
+    HTTPException,
+    Query,
+    Request,
+    Security,
+)
+from fastapi.responses import StreamingResponse
 from fastapi.security import APIKeyHeader
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, model_validator
 
+import eliza.archive
+import eliza.jobs
+import eliza.leader
 import eliza.memory
+import eliza.memory_context
+import eliza.memory_io
+import eliza.summary_trigger
 import eliza.tools
 from eliza.agents.full_operation import FullOperationAgent
 from eliza.agents.question import QuestionAgent
@@ -24,6 +38,8 @@ from eliza.agents.router import IntentLabel, IntentRouter
 from eliza.agents.translator import TranslatorAgent
 from eliza.agents.trivial import TrivialAgent
 from eliza.tools.schedule import run_scheduled_tasks_loop
+from eliza.tools.switchbot import run_sensor_poller
+from eliza.tools.youtube import run_cache_sweeper
 
 JST = ZoneInfo("Asia/Tokyo")
 
@@ -51,24 +67,6 @@ async def _verify_secret(key: str | None = Security(_api_key_header)):
         raise HTTPException(status_code=403, detail="Forbidden")
 
 
-_AUTO_SUMMARY_INTERVAL_SECONDS = 30 * 60  # 30分
-
-
-async def _auto_summary_loop():
-    """30分ごとに直近のやりとりを確認し summary を自動生成する
-
-    30分以内にやりとりがなかった場合はスキップする
-    """
-    while True:
-        await asyncio.sleep(_AUTO_SUMMARY_INTERVAL_SECONDS)
-        request_id = f"auto-{datetime.now().strftime('%Y%m%d-%H%M%S')}"
-        if not eliza.memory.has_recent_messages(minutes=30):
-            logger.info("[AUTO SUMMARY] No recent messages in the last 30 minutes. Skipping.")
-            continue
-        logger.info(f"[AUTO SUMMARY] Starting auto summary ({request_id})...")
-        await asyncio.to_thread(_generate_summary_in_background, request_id)
-
-
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """FastAPI アプリのライフサイクル管理
@@ -79,19 +77,27 @@ async def lifespan(app: FastAPI):
         FastAPI アプリインスタンス
     """
     logger.info("Eliza Agent Server starting up...")
-    auto_summary_task = asyncio.create_task(_auto_summary_loop())
-    schedule_runner_task = asyncio.create_task(run_scheduled_tasks_loop())
+    # バックグラウンドループはリーダーに選ばれた1ワーカーだけが動かす
+    leader_task = asyncio.create_task(
+        eliza.leader.run_while_leader(
+            {
+                "auto_summary": eliza.summary_trigger.run_trigger_loop,
+                "schedule_runner": run_scheduled_tasks_loop,
+                "job_runner": eliza.jobs.run_jobs_loop,
+                "youtube_cache_sweeper": run_cache_sweeper,
+                "sensor_poller": run_sensor_poller,
+            }
+        )
+    )
     yield
-    auto_summary_task.cancel()
-    schedule_runner_task.cancel()
-    try:
-        await auto_summary_task
-    except asyncio.CancelledError:
-        pass
+    leader_task.cancel()
     try:
-        await schedule_runner_task
+        await leader_task
     except asyncio.CancelledError:
         pass
+    # write-behind キューに残っているメッセージを書き切る
+    await asyncio.to_thread(eliza.memory.shutdown)
+    await eliza.tools.http_client.aclose()
     logger.info("Eliza Agent Server shutting down gracefully...")
 
 
@@ -103,31 +109,60 @@ app = FastAPI(
 )
 
 
-def _generate_message_id() -> str:
-    """現在時刻と乱数から16文字のhex message_id を生成する"""
-    raw = f"{datetime.now(JST).isoformat()}-{os.urandom(8).hex()}"
-    return hashlib.sha256(raw.encode()).hexdigest()[:16]
-
-
 # リクエスト/レスポンスのスキーマ
 class Message(BaseModel):
     role: str  # "system", "user", "assistant"
     content: str
     timestamp: datetime = Field(default_factory=lambda: datetime.now(JST))
-    message_id: str = Field(default_factory=_generate_message_id)
+    # 省略時は ChatRequest が会話内の位置・role・内容から決める (eliza.memory.chain_message_id)
+    message_id: str | None = None
 
 
 class ChatRequest(BaseModel):
     messages: list[Message]
+    # メモリはユーザーごとに分かれる (省略時は既定ユーザー)
+    user_id: str | None = Field(default=None, pattern=eliza.memory.USER_ID_PATTERN)
+    # 会話ログに記録するだけで、メモリの分割には使わない
+    session_id: str | None = None
+    # 同じ会話の続きを送るときは、前回のレスポンスの conversation_id を送り返す
+    # (省略時は会話の最初のメッセージから決める)
+    conversation_id: str | None = Field(default=None, max_length=128)
     use_memory: bool = True
     detect_sleep: bool = True
     max_tool_loops: int = 5
     deep: bool = False
     interact: bool = False
 
+    @model_validator(mode="after")
+    def _assign_message_ids(self) -> "ChatRequest":
+        """message_id のないメッセージに、会話 ID と会話内の位置から決まる ID を付ける
+
+        同じ conversation_id で履歴を毎回送り直すクライアントでも同じメッセージは同じ ID になる
+        conversation_id がなければ、会話の最初のメッセージ (role, 内容, 送られていれば時刻) から決める
+        """
+        if self.conversation_id is None and self.messages:
+            first = self.messages[0]
+            self.conversation_id = eliza.memory.derive_conversation_id(
+                self.user_id,
+                first.role,
+                first.content,
+                first.timestamp.isoformat() if "timestamp" in first.model_fields_set else None,
+            )
+        elif self.conversation_id is None:
+            self.conversation_id = uuid.uuid4().hex
+        if self.messages:
+            parent = eliza.memory.conversation_seed(self.user_id, self.conversation_id)
+            for m in self.messages:
+                if m.message_id is None:
+                    m.message_id = eliza.memory.chain_message_id(parent, m.role, m.content)
+                parent = m.message_id
+        return self
+
 
 class ChatResponse(BaseModel):
     message: Message
+    # 会話の続きを送るときにリクエストの conversation_id に入れる
+    conversation_id: str
     reasoning: str | None = None
     sleep: bool = False
     tool: list[tuple[dict[str, Any], dict[str, Any] | None]] | None = None
@@ -137,6 +172,7 @@ class ChatResponse(BaseModel):
 
 class SummaryResponse(BaseModel):
     status: str
+    job_id: str
 
 
 @app.get("/eliza/api/health")
@@ -162,6 +198,10 @@ async def post_chat(request: ChatRequest) -> ChatResponse:
     logger.info("=" * 80)
     logger.info(f"[REQUEST ID: {request_id}] POST /chat")
     logger.info("-" * 80)
+    logger.info(
+        f"[REQUEST] User: {request.user_id}, Session: {request.session_id}, "
+        f"Conversation: {request.conversation_id}"
+    )
     logger.info(f"[REQUEST] Number of messages: {len(request.messages)}")
     logger.info("[REQUEST] Body:")
     for i, msg in enumerate(request.messages):
@@ -183,173 +223,407 @@ async def post_chat(request: ChatRequest) -> ChatResponse:
     MAX_RETRIES = 3
     last_error = None
 
-    for attempt in range(1, MAX_RETRIES + 1):
-        try:
-            logger.info(
-                f"[REQUEST ID: {request_id}] Creating Grok client... (attempt {attempt}/{MAX_RETRIES})"
-            )
-            messages_dicts = [
-                {"role": m.role, "content": m.content} for m in request.messages
-            ]
-
-            # router で意図を分類
-            intent_result = await asyncio.to_thread(
-                IntentRouter(api_key=XAI_API_KEY).classify,
-                messages_dicts,
-                request_id,
-            )
-            logger.info(
-                f"[REQUEST ID: {request_id}] Intent: {intent_result.label}, query_hint: {intent_result.query_hint}"
-            )
-
-            if intent_result.label == IntentLabel.Trivial:
-                result = await asyncio.to_thread(
-                    TrivialAgent(
-                        api_key=XAI_API_KEY,
-                        use_memory=request.use_memory,
-                    ).run,
-                    messages=messages_dicts,
-                    request_id=request_id,
-                    detect_sleep=request.detect_sleep,
-                    query_hint=intent_result.query_hint,
+    # エージェントとツールのメモリ操作はすべてこのユーザーのストアに向く
+    # 処理中はバックグラウンドジョブが新しい LLM 呼び出しを控える
+    with eliza.memory.use_user(request.user_id), eliza.jobs.interactive(request_id):
+        for attempt in range(1, MAX_RETRIES + 1):
+            try:
+                logger.info(
+                    f"[REQUEST ID: {request_id}] Creating Grok client... (attempt {attempt}/{MAX_RETRIES})"
                 )
-            elif intent_result.label == IntentLabel.Question:
-                result = await asyncio.to_thread(
-                    QuestionAgent(
-                        api_key=XAI_API_KEY,
-                        use_memory=request.use_memory,
-                    ).run,
-                    messages=messages_dicts,
-                    request_id=request_id,
-                    detect_sleep=request.detect_sleep,
-                    query_hint=intent_result.query_hint,
+                messages_dicts = [
+                    {"role": m.role, "content": m.content} for m in request.messages
+                ]
+
+                # router で意図を分類
+                intent_result = await asyncio.to_thread(
+                    IntentRouter(api_key=XAI_API_KEY).classify,
+                    messages_dicts,
+                    request_id,
                 )
-            elif intent_result.label == IntentLabel.Translator:
-                result = await asyncio.to_thread(
-                    TranslatorAgent(
-                        api_key=XAI_API_KEY,
-                        use_memory=request.use_memory,
-                    ).run,
-                    messages=messages_dicts,
-                    request_id=request_id,
-                    detect_sleep=request.detect_sleep,
-                    query_hint=intent_result.query_hint,
+                logger.info(
+                    f"[REQUEST ID: {request_id}] Intent: {intent_result.label}, query_hint: {intent_result.query_hint}"
                 )
-            else:
-                # FullOperation (default)
-                result = await asyncio.to_thread(
-                    FullOperationAgent(
-                        api_key=XAI_API_KEY,
-                        use_memory=request.use_memory,
-                        deep=request.deep,
-                        interact=request.interact,
-                    ).run,
-                    messages=messages_dicts,
-                    request_id=request_id,
-                    max_tool_loops=request.max_tool_loops,
-                    detect_sleep=request.detect_sleep,
-                    query_hint=intent_result.query_hint,
+
+                if intent_result.label == IntentLabel.Trivial:
+                    result = await asyncio.to_thread(
+                        TrivialAgent(
+                            api_key=XAI_API_KEY,
+                            use_memory=request.use_memory,
+                        ).run,
+                        messages=messages_dicts,
+                        request_id=request_id,
+                        detect_sleep=request.detect_sleep,
+                        query_hint=intent_result.query_hint,
+                    )
+                elif intent_result.label == IntentLabel.Question:
+                    result = await asyncio.to_thread(
+                        QuestionAgent(
+                            api_key=XAI_API_KEY,
+                            use_memory=request.use_memory,
+                        ).run,
+                        messages=messages_dicts,
+                        request_id=request_id,
+                        detect_sleep=request.detect_sleep,
+                        query_hint=intent_result.query_hint,
+                    )
+                elif intent_result.label == IntentLabel.Translator:
+                    result = await asyncio.to_thread(
+                        TranslatorAgent(
+                            api_key=XAI_API_KEY,
+                            use_memory=request.use_memory,
+                        ).run,
+                        messages=messages_dicts,
+                        request_id=request_id,
+                        detect_sleep=request.detect_sleep,
+                        query_hint=intent_result.query_hint,
+                    )
+                else:
+                    # FullOperation (default)
+                    result = await asyncio.to_thread(
+                        FullOperationAgent(
+                            api_key=XAI_API_KEY,
+                            use_memory=request.use_memory,
+                            deep=request.deep,
+                            interact=request.interact,
+                        ).run,
+                        messages=messages_dicts,
+                        request_id=request_id,
+                        max_tool_loops=request.max_tool_loops,
+                        detect_sleep=request.detect_sleep,
+                        query_hint=intent_result.query_hint,
+                    )
+
+                elapsed_ms = int((time.monotonic() - request_start) * 1000)
+                logger.info("-" * 80)
+                logger.info(f"[RESPONSE ID: {request_id}] Success ({elapsed_ms} ms)")
+                logger.info("[RESPONSE] Role: assistant")
+                logger.info(f"[RESPONSE] Content length: {len(result.content)} chars")
+                logger.info("[RESPONSE] Content:")
+                logger.info(f"  {result.content}")
+                logger.info("[RESPONSE] Reasoning:")
+                logger.info(f"  {result.reasoning}")
+                logger.info("[RESPONSE] Citations:")
+                if result.citations:
+                    for url in result.citations:
+                        logger.info(f"  {url}")
+                else:
+                    logger.info("  -- no citations --")
+                logger.info("=" * 80)
+
+                response_message = Message(
+                    role="assistant",
+                    content=result.content,
+                    message_id=eliza.memory.chain_message_id(
+                        request.messages[-1].message_id, "assistant", result.content
+                    ),
                 )
 
-            elapsed_ms = int((time.monotonic() - request_start) * 1000)
-            logger.info("-" * 80)
-            logger.info(f"[RESPONSE ID: {request_id}] Success ({elapsed_ms} ms)")
-            logger.info("[RESPONSE] Role: assistant")
-            logger.info(f"[RESPONSE] Content length: {len(result.content)} chars")
-            logger.info("[RESPONSE] Content:")
-            logger.info(f"  {result.content}")
-            logger.info("[RESPONSE] Reasoning:")
-            logger.info(f"  {result.reasoning}")
-            logger.info("[RESPONSE] Citations:")
-            if result.citations:
-                for url in result.citations:
-                    logger.info(f"  {url}")
-            else:
-                logger.info("  -- no citations --")
-            logger.info("=" * 80)
-
-            response_message = Message(role="assistant", content=result.content)
-
-            # 受信メッセージ + 生成メッセージを SQLite に保存
-            save_records = [
-                {
-                    "message_id": m.message_id,
-                    "timestamp": m.timestamp.isoformat(),
-                    "role": m.role,
-                    "content": m.content,
-                }
-                for m in request.messages
-            ] + [
-                {
-                    "message_id": response_message.message_id,
-                    "timestamp": response_message.timestamp.isoformat(),
-                    "role": response_message.role,
-                    "content": response_message.content,
-                    "reasoning": result.reasoning,
-                }
-            ]
-            eliza.memory.save_messages(save_records)
-
-            return ChatResponse(
-                message=response_message,
-                reasoning=result.reasoning,
-                sleep=result.sleep,
-                tool=result.tool_history if result.tool_history else None,
-                citations=result.citations,
-                elapsed_ms=elapsed_ms,
-            )
+                # 受信メッセージ + 生成メッセージを SQLite に保存
+                save_records = [
+                    {
+                        "message_id": m.message_id,
+                        "timestamp": m.timestamp.isoformat(),
+                        "role": m.role,
+                        "content": m.content,
+                        "session_id": request.session_id,
+                        "conversation_id": request.conversation_id,
+                    }
+                    for m in request.messages
+                ] + [
+                    {
+                        "message_id": response_message.message_id,
+                        "timestamp": response_message.timestamp.isoformat(),
+                        "role": response_message.role,
+                        "content": response_message.content,
+                        "reasoning": result.reasoning,
+                        "session_id": request.session_id,
+                        "conversation_id": request.conversation_id,
+                    }
+                ]
+                # 書き込みは write-behind キューに積むだけで、ディスクへの書き込みを待たない
+                eliza.memory.save_messages(save_records)
+
+                return ChatResponse(
+                    message=response_message,
+                    conversation_id=request.conversation_id,
+                    reasoning=result.reasoning,
+                    sleep=result.sleep,
+                    tool=result.tool_history if result.tool_history else None,
+                    citations=result.citations,
+                    elapsed_ms=elapsed_ms,
+                )
 
-        except Exception as e:
-            last_error = e
-            logger.error(
-                f"[REQUEST ID: {request_id}] Error occurred (attempt {attempt}/{MAX_RETRIES}): {str(e)}"
-            )
-            if attempt < MAX_RETRIES:
-                logger.info(f"[REQUEST ID: {request_id}] Retrying...")
-            else:
-                logger.error("=" * 80)
+            except Exception as e:
+                last_error = e
+                logger.error(
+                    f"[REQUEST ID: {request_id}] Error occurred (attempt {attempt}/{MAX_RETRIES}): {str(e)}"
+                )
+                if attempt < MAX_RETRIES:
+                    logger.info(f"[REQUEST ID: {request_id}] Retrying...")
+                else:
+                    logger.error("=" * 80)
 
     raise HTTPException(status_code=500, detail=f"Error: {str(last_error)}")
 
 
-def _generate_summary_in_background(request_id: str):
-    """バックグラウンドで summary 生成を実行する"""
-    try:
-        logger.info(f"[REQUEST ID: {request_id}] Generating summary ...")
-        result = eliza.memory.generate_summary(model="grok-4-1-fast")
-        summary_str = json.dumps(result, ensure_ascii=False)
-        logger.info(
-            f"[REQUEST ID: {request_id}] Summary done: {summary_str[:500]}{'...' if len(summary_str) > 500 else ''}"
-        )
-        logger.info("=" * 80)
-    except Exception as e:
-        logger.error(
-            f"[REQUEST ID: {request_id}] Error in summary background task: {str(e)}"
-        )
-        logger.error("=" * 80)
+def _summary_job(payload: dict[str, Any], progress) -> dict:
+    """summary 生成ジョブ
+
+    Parameters
+    ----------
+    payload
+        {"user_id": 対象のユーザー, "only_dirty": dirty な日だけを処理するか (省略時 False)}
+    progress
+        進捗を報告する関数
+    """
+    user_id = payload["user_id"]
+    logger.info(f"[JOBS] Generating summary for {user_id} ...")
+    result = eliza.memory.generate_summary(
+        model="grok-4-1-fast",
+        user_id=user_id,
+        progress=progress,
+        only_dirty=payload.get("only_dirty", False),
+    )
+    summary_str = json.dumps(result, ensure_ascii=False)
+    logger.info(
+        f"[JOBS] Summary done: {summary_str[:500]}{'...' if len(summary_str) > 500 else ''}"
+    )
+    return result
+
+
+def _archive_job(payload: dict[str, Any], progress) -> dict:
+    """古いメッセージのアーカイブと、古い reasoning の切り詰めジョブ
+
+    Parameters
+    ----------
+    payload
+        {"user_id": 対象のユーザー}
+    progress
+        進捗を報告する関数
+    """
+    progress("archive", 0, 2)
+    result = eliza.archive.archive_messages(user_id=payload["user_id"])
+    progress("reasoning", 1, 2)
+    result["reasoning"] = eliza.memory.prune_reasoning(user_id=payload["user_id"])
+    logger.info(f"[JOBS] Archive done: {result}")
+    return result
+
+
+eliza.jobs.register("summary", _summary_job)
+eliza.jobs.register("archive", _archive_job)
 
 
 @app.post("/eliza/api/summary", status_code=202, response_model=SummaryResponse, dependencies=[Depends(_verify_secret)])
-async def post_summary(background_tasks: BackgroundTasks) -> SummaryResponse:
-    """メモリ要約をバックグラウンドで生成する
+async def post_summary(
+    user_id: str | None = Query(default=None, pattern=eliza.memory.USER_ID_PATTERN),
+) -> SummaryResponse:
+    """メモリ要約のジョブを積む
 
-    処理はバックグラウンドで実行され即座に 202 Accepted を返す
+    ジョブはリーダーのワーカーが実行し、即座に 202 Accepted とジョブ ID を返す
+    同じユーザーの summary ジョブが待機中ならそれを返す
 
     Parameters
     ----------
-    background_tasks
-        FastAPI の BackgroundTasks インスタンス
+    user_id
+        対象のユーザー (省略時は既定ユーザー)
     """
     request_id = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
 
     logger.info("=" * 80)
     logger.info(f"[REQUEST ID: {request_id}] POST /summary")
 
-    background_tasks.add_task(_generate_summary_in_background, request_id)
+    job = await asyncio.to_thread(
+        eliza.jobs.enqueue,
+        "summary",
+        {"user_id": user_id or eliza.memory.DEFAULT_USER},
+        eliza.jobs.PRIORITY_INTERACTIVE,
+    )
+
+    logger.info(f"[REQUEST ID: {request_id}] Accepted as job {job['job_id']}.")
+
+    return SummaryResponse(status="accepted", job_id=job["job_id"])
+
+
+@app.get("/eliza/api/jobs/{job_id}", dependencies=[Depends(_verify_secret)])
+async def get_job(job_id: str) -> dict[str, Any]:
+    """ジョブの状態・進捗・結果を返す
 
-    logger.info(f"[REQUEST ID: {request_id}] Accepted. Processing in background.")
+    Parameters
+    ----------
+    job_id
+        ジョブ ID
+    """
+    job = await asyncio.to_thread(eliza.jobs.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@app.get("/eliza/api/memory/cache", dependencies=[Depends(_verify_secret)])
+async def get_memory_cache() -> dict[str, Any]:
+    """memory context キャッシュの統計 (ヒット率・節約時間) を返す
+
+    統計はワーカーごとに集計される
+    """
+    return {"pid": os.getpid(), **eliza.memory_context.stats()}
+
+
+@app.get("/eliza/api/memory/stats", dependencies=[Depends(_verify_secret)])
+async def get_memory_stats(
+    user_id: str | None = Query(default=None, pattern=eliza.memory.USER_ID_PATTERN),
+) -> dict[str, Any]:
+    """会話ログの書き込み件数と、重複としてスキップした件数、reasoning の保存状況を返す
+
+    書き込み件数の統計はワーカーごとに集計される
+
+    Parameters
+    ----------
+    user_id
+        reasoning の保存状況を返すユーザー (省略時は既定ユーザー)
+    """
+    reasoning = await asyncio.to_thread(
+        eliza.memory.reasoning_stats, user_id or eliza.memory.DEFAULT_USER
+    )
+    return {"pid": os.getpid(), **eliza.memory.write_stats(), "reasoning": reasoning}
+
+
+@app.get(
+    "/eliza/api/memory/messages/{message_id}/reasoning",
+    dependencies=[Depends(_verify_secret)],
+)
+async def get_message_reasoning(
+    message_id: str,
+    user_id: str | None = Query(default=None, pattern=eliza.memory.USER_ID_PATTERN),
+) -> dict[str, Any]:
+    """メッセージの reasoning を返す (デバッグ用)
+
+    Parameters
+    ----------
+    message_id
+        メッセージ ID
+    user_id
+        ユーザー ID (省略時は既定ユーザー)
+    """
+    found = await asyncio.to_thread(
+        eliza.memory.get_reasoning, message_id, user_id or eliza.memory.DEFAULT_USER
+    )
+    if found is None:
+        raise HTTPException(status_code=404, detail="Reasoning not found")
+    return found
 
-    return SummaryResponse(status="accepted")
+
+@app.get("/eliza/api/memory/profile", dependencies=[Depends(_verify_secret)])
+async def get_memory_profile(
+    user_id: str | None = Query(default=None, pattern=eliza.memory.USER_ID_PATTERN),
+) -> dict[str, Any]:
+    """日別 summary から統合した user_profile と、各項目の確信度を返す
+
+    Parameters
+    ----------
+    user_id
+        ユーザー ID (省略時は既定ユーザー)
+    """
+    profile = await asyncio.to_thread(eliza.memory.get_profile, user_id or eliza.memory.DEFAULT_USER)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Summary has not been generated yet")
+    return profile
+
+
+@app.get("/eliza/api/tools/stats", dependencies=[Depends(_verify_secret)])
+async def get_tools_stats() -> dict[str, Any]:
+    """ツールごとの呼び出し回数、エラー数、実行時間のヒストグラムと、外部 API への接続の再利用状況を返す
+
+    チャットとスケジュール実行の両方の呼び出しを含み、ワーカーごとに集計される
+    """
+    return {
+        "pid": os.getpid(),
+        "buckets_ms": list(eliza.tools.LATENCY_BUCKETS_MS),
+        "tools": eliza.tools.tool_stats(),
+        "http": eliza.tools.http_client.pool_stats(),
+    }
+
+
+@app.get("/eliza/api/leader", dependencies=[Depends(_verify_secret)])
+async def get_leader() -> dict[str, Any]:
+    """バックグラウンドジョブを動かしているリーダーのワーカーと、応答したワーカーの情報を返す"""
+    return await asyncio.to_thread(eliza.leader.status)
+
+
+@app.get("/eliza/api/memory/export", dependencies=[Depends(_verify_secret)])
+async def get_memory_export(
+    since: str | None = None,
+    until: str | None = None,
+    cursor: str | None = None,
+    include_archive: bool = True,
+    user_id: str | None = Query(default=None, pattern=eliza.memory.USER_ID_PATTERN),
+) -> StreamingResponse:
+    """会話ログを NDJSON でストリーミングする
+
+    Parameters
+    ----------
+    since
+        この日 (YYYY-MM-DD) 以降のメッセージだけを返す
+    until
+        この日 (YYYY-MM-DD) 以前のメッセージだけを返す
+    cursor
+        最後に受け取った行の "<timestamp>|<message_id>"。これより後から再開する
+    include_archive
+        True のときアーカイブ済みのメッセージも含める
+    user_id
+        対象のユーザー (省略時は既定ユーザー)
+    """
+    try:
+        for day in (since, until):
+            if day is not None:
+                date.fromisoformat(day)
+        eliza.memory_io.parse_cursor(cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return StreamingResponse(
+        eliza.memory_io.export_ndjson(
+            since,
+            until,
+            cursor,
+            include_archive,
+            user_id=user_id or eliza.memory.DEFAULT_USER,
+        ),
+        media_type="application/x-ndjson",
+    )
+
+
+@app.post("/eliza/api/memory/import", dependencies=[Depends(_verify_secret)])
+async def post_memory_import(
+    request: Request,
+    user_id: str | None = Query(default=None, pattern=eliza.memory.USER_ID_PATTERN),
+) -> dict[str, Any]:
+    """NDJSON の会話ログを取り込む
+
+    まとまった件数ごとに1トランザクションで INSERT OR IGNORE し、取り込み速度を返す
+    アーカイブ済みの message_id もスキップする
+    新しく入ったメッセージの日は summary 再生成対象になる
+
+    Parameters
+    ----------
+    request
+        NDJSON をボディに持つリクエスト
+    user_id
+        取り込み先のユーザー (省略時は既定ユーザー)
+    """
+    request_id = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+    logger.info(f"[REQUEST ID: {request_id}] POST /memory/import (user: {user_id})")
+    importer = eliza.memory_io.NdjsonImporter()
+    with eliza.memory.use_user(user_id):
+        async for line in eliza.memory_io.aiter_lines(request.stream()):
+            batch = importer.add_line(line)
+            if batch:
+                importer.record(await asyncio.to_thread(eliza.memory_io.insert_batch, batch))
+        importer.record(
+            await asyncio.to_thread(eliza.memory_io.insert_batch, importer.take_batch())
+        )
+        result = importer.result()
+    logger.info(f"[REQUEST ID: {request_id}] Import done: {result}")
+    return result
 
 
 def main():
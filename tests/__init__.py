@@ -0,0 +1,19 @@
+import os
+import tempfile
+import unittest
+
+import eliza.memory
+
+
+class TempDirTestCase(unittest.TestCase):
+    """.memory を一時ディレクトリに作るテスト (カレントディレクトリを移す)"""
+
+    def setUp(self):
+        self._cwd = os.getcwd()
+        self._tmp = tempfile.TemporaryDirectory()
+        os.chdir(self._tmp.name)
+
+    def tearDown(self):
+        eliza.memory.shutdown()
+        os.chdir(self._cwd)
+        self._tmp.cleanup()
@@ -0,0 +1,108 @@
+"""アーカイブのテスト"""
+
+import sqlite3
+from contextlib import closing
+
+import eliza.archive
+import eliza.memory
+import eliza.memory_io
+from tests import TempDirTestCase
+
+MESSAGES = [
+    {
+        "message_id": "m1",
+        "timestamp": "2025-01-05T10:00:00+09:00",
+        "role": "user",
+        "content": "おはよう",
+        "session_id": "s1",
+        "conversation_id": "c1",
+    },
+    {
+        "message_id": "m2",
+        "timestamp": "2025-01-05T10:00:05+09:00",
+        "role": "assistant",
+        "content": "おはようございます",
+        "session_id": "s1",
+        "conversation_id": "c1",
+    },
+]
+
+
+class ArchiveConversationIdTest(TempDirTestCase):
+    def setUp(self):
+        super().setUp()
+        eliza.memory.insert_messages(MESSAGES, user_id="alice")
+        eliza.archive.archive_messages(older_than_days=30, user_id="alice")
+
+    def test_archived_records_keep_conversation_id(self):
+        archived = list(eliza.archive.iter_messages(user_id="alice"))
+        self.assertEqual([m["message_id"] for m in archived], ["m1", "m2"])
+        self.assertEqual([m["conversation_id"] for m in archived], ["c1", "c1"])
+        loaded = eliza.archive.load_messages(["m2"], user_id="alice")
+        self.assertEqual(loaded[0]["conversation_id"], "c1")
+
+    def test_export_and_import_restore_conversation_id(self):
+        lines = list(eliza.memory_io.export_ndjson(user_id="alice"))
+        with eliza.memory.use_user("bob"):
+            eliza.memory_io.import_ndjson(lines)
+        restored = list(eliza.memory.iter_messages(user_id="bob"))
+        self.assertEqual([m["conversation_id"] for m in restored], ["c1", "c1"])
+
+
+class ArchivedIndexTest(TempDirTestCase):
+    def setUp(self):
+        super().setUp()
+        eliza.memory.insert_messages(MESSAGES, user_id="alice")
+        eliza.archive.archive_messages(older_than_days=30, user_id="alice")
+
+    def test_index_is_limited_to_requested_days(self):
+        rows = eliza.archive.get_archived_index("alice", ["2025-01-05"])
+        self.assertEqual(sorted(r[0] for r in rows), ["m1", "m2"])
+        self.assertEqual({r[2] for r in rows}, {"2025-01-05"})
+        self.assertEqual(eliza.archive.get_archived_index("alice", ["2025-01-06"]), [])
+        self.assertEqual(eliza.archive.get_archived_index("alice", []), [])
+
+    def test_index_without_day_column_is_backfilled(self):
+        index_db = eliza.archive.archive_dir("alice") / "index.sqlite"
+        with closing(sqlite3.connect(index_db)) as conn:
+            conn.execute("DROP INDEX idx_archived_day")
+            conn.execute("ALTER TABLE archived DROP COLUMN day")
+            conn.commit()
+        rows = eliza.archive.get_archived_index("alice", ["2025-01-05"])
+        self.assertEqual(sorted(r[0] for r in rows), ["m1", "m2"])
+
+
+class FrameRangeTest(TempDirTestCase):
+    def setUp(self):
+        super().setUp()
+        # 文字列では 2025-01-05T23:30 (UTC) の方が 2025-01-06T07:00+09:00 より前に見える
+        eliza.memory.insert_messages(
+            [
+                {**MESSAGES[0], "message_id": "a1", "timestamp": "2025-01-05T23:30:00+00:00"},
+                {**MESSAGES[1], "message_id": "a2", "timestamp": "2025-01-06T07:00:00+09:00"},
+            ],
+            user_id="alice",
+        )
+        eliza.archive.archive_messages(older_than_days=30, user_id="alice")
+        eliza.memory.insert_messages(MESSAGES, user_id="alice")
+        eliza.archive.archive_messages(older_than_days=30, user_id="alice")
+
+    def test_frames_are_selected_by_epoch(self):
+        # 2025-01-05T23:30Z は JST で 2025-01-06T08:30
+        picked = list(eliza.archive.iter_messages("2025-01-06", "2025-01-06", user_id="alice"))
+        self.assertEqual([m["message_id"] for m in picked], ["a2", "a1"])
+        picked = list(eliza.archive.iter_messages("2025-01-05", "2025-01-05", user_id="alice"))
+        self.assertEqual([m["message_id"] for m in picked], ["m1", "m2"])
+
+    def test_newest_frame_first(self):
+        newest = list(eliza.archive.iter_messages_newest_first(user_id="alice"))
+        self.assertEqual([m["message_id"] for m in newest], ["a1", "a2", "m2", "m1"])
+
+    def test_index_without_ts_columns_is_backfilled(self):
+        index_db = eliza.archive.archive_dir("alice") / "index.sqlite"
+        with closing(sqlite3.connect(index_db)) as conn:
+            conn.execute("ALTER TABLE frames DROP COLUMN first_ts_ms")
+            conn.execute("ALTER TABLE frames DROP COLUMN last_ts_ms")
+            conn.commit()
+        picked = list(eliza.archive.iter_messages("2025-01-06", user_id="alice"))
+        self.assertEqual([m["message_id"] for m in picked], ["a2", "a1"])
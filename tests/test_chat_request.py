@@ -0,0 +1,49 @@
+"""ChatRequest が付ける conversation_id / message_id のテスト"""
+
+import unittest
+
+import server
+
+HISTORY = [
+    {"role": "user", "content": "電気消して", "timestamp": "2026-10-19T22:00:00+09:00"},
+    {"role": "assistant", "content": "消しました", "timestamp": "2026-10-19T22:00:05+09:00"},
+    {"role": "user", "content": "エアコンも", "timestamp": "2026-10-19T22:01:00+09:00"},
+]
+
+
+def _parse(messages: list[dict], **fields) -> server.ChatRequest:
+    return server.ChatRequest.model_validate({"messages": messages, "user_id": "alice", **fields})
+
+
+class AssignMessageIdsTest(unittest.TestCase):
+    def test_same_body_gets_same_ids(self):
+        first = _parse(HISTORY)
+        second = _parse(HISTORY)
+        self.assertEqual(first.conversation_id, second.conversation_id)
+        self.assertEqual(
+            [m.message_id for m in first.messages], [m.message_id for m in second.messages]
+        )
+
+    def test_longer_body_keeps_earlier_ids(self):
+        short = _parse(HISTORY[:2])
+        long = _parse(HISTORY)
+        self.assertEqual(short.conversation_id, long.conversation_id)
+        self.assertEqual(
+            [m.message_id for m in short.messages], [m.message_id for m in long.messages[:2]]
+        )
+
+    def test_same_opening_at_different_times_is_another_conversation(self):
+        later = [{**HISTORY[0], "timestamp": "2026-10-19T23:30:00+09:00"}]
+        self.assertNotEqual(
+            _parse(HISTORY[:1]).messages[0].message_id, _parse(later).messages[0].message_id
+        )
+
+    def test_client_conversation_id_is_used(self):
+        a = _parse(HISTORY, conversation_id="c1")
+        b = _parse(HISTORY, conversation_id="c2")
+        self.assertEqual(a.conversation_id, "c1")
+        self.assertNotEqual(a.messages[0].message_id, b.messages[0].message_id)
+
+
+if __name__ == "__main__":
+    unittest.main()
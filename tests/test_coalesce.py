@@ -0,0 +1,55 @@
+"""外部 API の呼び出しをまとめる eliza.tools.coalesce のテスト"""
+
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from eliza.tools import coalesce
+
+from . import TempDirTestCase
+
+
+class FetchOnceTest(TempDirTestCase):
+    def test_concurrent_calls_fetch_once(self):
+        cache: dict[str, str] = {}
+        calls = []
+
+        def fetch():
+            calls.append(1)
+            time.sleep(0.2)
+            cache["k"] = "v"
+            return "v"
+
+        def call(_):
+            return coalesce.fetch_once("test", "k", lambda: cache.get("k"), fetch)
+
+        with ThreadPoolExecutor(4) as pool:
+            results = list(pool.map(call, range(4)))
+        self.assertEqual(results, ["v"] * 4)
+        self.assertEqual(len(calls), 1)
+
+    def test_waits_for_claim_of_other_worker(self):
+        cache: dict[str, str] = {}
+        # 他のワーカーが呼び出し中
+        self.assertTrue(coalesce._claim("test", "k"))
+
+        def other_worker():
+            time.sleep(0.3)
+            cache["k"] = "from other"
+            coalesce._release("test", "k")
+
+        threading.Thread(target=other_worker).start()
+        result = coalesce.fetch_once("test", "k", lambda: cache.get("k"), lambda: "fetched")
+        self.assertEqual(result, "from other")
+
+    def test_fetches_itself_when_other_worker_gives_up(self):
+        self.assertTrue(coalesce._claim("test", "k"))
+        threading.Timer(0.2, coalesce._release, ("test", "k")).start()
+        result = coalesce.fetch_once("test", "k", lambda: None, lambda: "fetched")
+        self.assertEqual(result, "fetched")
+        self.assertFalse(coalesce._claimed("test", "k"))
+
+
+if __name__ == "__main__":
+    unittest.main()
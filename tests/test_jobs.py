@@ -0,0 +1,65 @@
+"""ジョブキューのリーダー交代・シャットダウン時の扱いのテスト"""
+
+import asyncio
+import threading
+import time
+import unittest
+from unittest import mock
+
+import eliza.jobs
+import eliza.leader
+
+from . import TempDirTestCase
+
+
+class RequeueTest(TempDirTestCase):
+    def _leave_running(self, worker_id: str) -> str:
+        """他のワーカーが実行中のまま残したジョブを作る (進捗の報告は直前)"""
+        job = eliza.jobs.enqueue("summary", {"user_id": "alice"})
+        now = time.time()
+        eliza.jobs._update(
+            job["job_id"], status="running", worker_id=worker_id, started_at=now, heartbeat_at=now
+        )
+        return job["job_id"]
+
+    def test_restart_requeues_job_of_previous_leader(self):
+        # 再起動で前のリーダーがリースを手放し、すぐに引き継いだ場合
+        job_id = self._leave_running("host:1:old")
+        self.assertEqual(eliza.jobs._requeue_abandoned(), 1)
+        claimed = eliza.jobs._claim_next()
+        self.assertIsNotNone(claimed)
+        self.assertEqual(claimed["job_id"], job_id)
+
+    def test_own_running_job_is_kept(self):
+        self._leave_running(eliza.leader.WORKER_ID)
+        self.assertEqual(eliza.jobs._requeue_abandoned(), 0)
+
+    def test_cancelled_runner_requeues_job(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        def handler(payload, progress):
+            started.set()
+            release.wait(5)
+            return {"ok": True}
+
+        async def run():
+            task = asyncio.create_task(eliza.jobs.run_jobs_loop())
+            await asyncio.to_thread(started.wait, 5)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            self.assertEqual(eliza.jobs.get(job["job_id"])["status"], "queued")
+            # 止められなかったスレッドを終わらせる
+            release.set()
+
+        eliza.jobs.register("test_block", handler)
+        job = eliza.jobs.enqueue("test_block", {})
+        with mock.patch.object(eliza.jobs, "chat_active", return_value=False):
+            asyncio.run(run())
+        # スレッドが後から終わっても、待機中のまま
+        self.assertEqual(eliza.jobs.get(job["job_id"])["status"], "queued")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+"""memory context キャッシュのテスト"""
+
+import threading
+from unittest import mock
+
+import eliza.memory
+import eliza.memory_context
+from tests import TempDirTestCase
+
+
+def _put_summary(user_id: str, summary: str) -> None:
+    node = {"level": "all", "key": "all", "hash": summary, "summary": summary}
+    with eliza.memory._connect(user_id) as conn:
+        eliza.memory._put_summaries(conn, [node])
+        conn.commit()
+
+
+def _message(message_id: str, content: str) -> dict:
+    return {
+        "message_id": message_id,
+        "timestamp": f"2026-10-19T10:00:0{message_id[-1]}+09:00",
+        "role": "user",
+        "content": content,
+    }
+
+
+class MemoryContextTest(TempDirTestCase):
+    def setUp(self):
+        super().setUp()
+        eliza.memory_context._cache.clear()
+
+    def _get(self, user_id: str) -> str:
+        with eliza.memory.use_user(user_id):
+            return eliza.memory_context.get("test")
+
+    def test_saving_messages_keeps_summary_cached(self):
+        _put_summary("alice", "朝型の生活")
+        eliza.memory.insert_messages([_message("m1", "おはよう")], user_id="alice")
+        first = self._get("alice")
+        hits = eliza.memory_context.stats()["hits"]
+
+        eliza.memory.insert_messages([_message("m2", "電気つけて")], user_id="alice")
+        second = self._get("alice")
+        self.assertEqual(eliza.memory_context.stats()["hits"], hits + 1)
+        self.assertIn("朝型の生活", second)
+        self.assertNotIn("電気つけて", first)
+        self.assertIn("電気つけて", second)
+
+    def test_new_summary_is_reloaded(self):
+        _put_summary("alice", "朝型の生活")
+        self.assertIn("朝型の生活", self._get("alice"))
+        _put_summary("alice", "夜型の生活")
+        self.assertIn("夜型の生活", self._get("alice"))
+
+    def test_slow_load_does_not_block_other_users(self):
+        started = threading.Event()
+        release = threading.Event()
+        load = eliza.memory_context._load_summary
+
+        def slow_load(user_id):
+            if user_id == "alice":
+                started.set()
+                release.wait(5)
+            return load(user_id)
+
+        _put_summary("bob", "猫を飼っている")
+        with mock.patch.object(eliza.memory_context, "_load_summary", slow_load):
+            alice = threading.Thread(target=self._get, args=("alice",))
+            alice.start()
+            try:
+                self.assertTrue(started.wait(5))
+                self.assertIn("猫を飼っている", self._get("bob"))
+            finally:
+                release.set()
+                alice.join()
@@ -0,0 +1,22 @@
+"""summary の rollup 階層のテスト"""
+
+import unittest
+
+import eliza.memory
+
+
+class WeekOfTest(unittest.TestCase):
+    def test_week_across_new_year_is_one_week(self):
+        # 2025-12-29 (月) 〜 2026-01-04 (日) は ISO 2026-W01
+        keys = {eliza.memory._week_of(f"2025-12-{d}") for d in (29, 30, 31)}
+        keys |= {eliza.memory._week_of(f"2026-01-0{d}") for d in (1, 2, 3, 4)}
+        self.assertEqual(keys, {("2026-W01", "2026-01")})
+
+    def test_iso_year_differs_from_calendar_year(self):
+        # 2027-01-01 (金) は ISO 2026-W53 で、木曜日は 2026-12-31
+        self.assertEqual(eliza.memory._week_of("2027-01-01"), ("2026-W53", "2026-12"))
+
+    def test_week_across_months_goes_to_thursday_month(self):
+        # 2026-09-28 (月) 〜 2026-10-04 (日) の木曜日は 2026-10-01
+        self.assertEqual(eliza.memory._week_of("2026-09-30"), ("2026-W40", "2026-10"))
+        self.assertEqual(eliza.memory._week_of("2026-10-04"), ("2026-W40", "2026-10"))